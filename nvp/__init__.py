@@ -74,14 +74,22 @@ __author__ = 'Birk Nilson <birk@tictail.com>'
 __version__ = '0.0.1-dev'
 __all__ = [
     'util',
-    'dump', 'dumps',
-    'load', 'loads',
+    'dump', 'dumps', 'dumps_chunked', 'encoded_size',
+    'load', 'loads', 'loads_many',
+    'iterparse', 'peek', 'to_json',
+    'Limits', 'LimitExceededError', 'ParseError',
+    'DecodeCache',
+    'ValueInterner', 'KeyRegistry',
+    'Message', 'Model',
 ]
 
 
-from urllib import urlencode
-from urlparse import parse_qs
 from nvp import util
+from nvp import phases
+from nvp.cache import DecodeCache
+from nvp.interning import ValueInterner, KeyRegistry
+from nvp.message import Message
+from nvp.models import Model
 
 
 # Convention aliases
@@ -90,6 +98,13 @@ CONVENTION_BRACKET = util.CONVENTION_BRACKET
 CONVENTION_PARENTHESES = util.CONVENTION_PARENTHESES
 CONVENTION_UNDERSCORE = util.CONVENTION_UNDERSCORE
 
+# Resource limit aliases
+Limits = util.Limits
+LimitExceededError = util.LimitExceededError
+
+# Strict parsing aliases
+ParseError = util.ParseError
+
 
 ###############################################################################
 # ENCODING & DECODING API
@@ -98,7 +113,9 @@ CONVENTION_UNDERSCORE = util.CONVENTION_UNDERSCORE
 def dumps(obj,
           convention=util.DEFAULT_CONVENTION,
           key_filter=None,
-          value_filter=None):
+          value_filter=None,
+          as_bytes=False,
+          batch_value_filter=None):
     """Encode given ``obj`` into an NVP query string.
 
     :param obj: The dictionary to encode
@@ -110,10 +127,97 @@ def dumps(obj,
     :param value_filter: Function in which all values should be filtered
                          through. In order to UTF-8 encode values for
                          example.
+    :param as_bytes: Whether to retrieve the query string as bytes ready to
+                     be sent over a socket for instance.
+    :param batch_value_filter: Function given the list of all values at
+                               once rather than one value per call, or a
+                               dictionary of such functions per field.
+    """
+    pairs = phases.get_pairs(obj, convention=convention,
+                             key_filter=key_filter, value_filter=value_filter,
+                             batch_value_filter=batch_value_filter)
+    return phases.encode_query(pairs, as_bytes=as_bytes)
+
+
+def dumps_chunked(obj,
+                  split_key,
+                  max_items=None,
+                  max_bytes=None,
+                  shared_keys=None,
+                  convention=util.DEFAULT_CONVENTION,
+                  key_filter=None,
+                  value_filter=None,
+                  batch_value_filter=None):
+    """Encode given ``obj`` into several NVP query strings among which the
+    items of the sequence ``obj[split_key]`` are split. Intended for APIs
+    capping the number of items, or the size of the body, of each call::
+
+        >>> import nvp
+        >>> obj = {'METHOD': 'AddItems', 'L': ['a', 'b', 'c']}
+        >>> list(nvp.dumps_chunked(obj, 'L', max_items=2))
+        ['METHOD=AddItems&L0=a&L1=b', 'METHOD=AddItems&L0=c']
+
+    Retrieves a generator of the query strings. The items in each of them
+    are indexed from zero and the shared keys are repeated in all of them.
+    Each query string is encoded only once it is consumed.
+
+    :param obj: The dictionary to encode
+    :param split_key: The top-level key of the sequence to split
+    :param max_items: Maximum number of items in each query string
+    :param max_bytes: Maximum length of each query string. Raises
+                      ``ValueError`` in case an item does not fit.
+    :param shared_keys: The top-level keys to repeat in each query string.
+                        Other keys are encoded in the first one only. By
+                        default all keys are shared.
+    :param convention: The convention to utilize in encoding keys
+                       corresponding to non-string sequences, e.g lists.
+    :param key_filter: Function in which all keys should be filtered through.
+    :param value_filter: Function in which all values should be filtered
+                         through.
+    :param batch_value_filter: Function given the values of each item at
+                               once rather than one value per call, or a
+                               dictionary of such functions per field.
+    """
+    return util.iter_split_payloads(
+        obj, split_key, convention=convention,
+        max_items=max_items, max_bytes=max_bytes, shared_keys=shared_keys,
+        key_filter=key_filter, value_filter=value_filter,
+        batch_value_filter=batch_value_filter,
+    )
+
+
+def encoded_size(obj,
+                 convention=util.DEFAULT_CONVENTION,
+                 key_filter=None,
+                 value_filter=None,
+                 batch_value_filter=None):
+    """Retrieve the exact length of the NVP query string which ``dumps``
+    encodes ``obj`` into without producing the query string. Intended to
+    determine ``Content-Length`` or to enforce body size limits prior to
+    encoding a request.
+
+    :param obj: The dictionary to measure the encoded size of
+    :param convention: The convention to utilize in encoding keys
+                       corresponding to non-string sequences, e.g lists.
+    :param key_filter: Function in which all keys should be filtered through.
+    :param value_filter: Function in which all values should be filtered
+                         through.
+    :param batch_value_filter: Function given the values of a chunk of
+                               pairs at once rather than one value per
+                               call, or a dictionary of such functions
+                               per field.
     """
-    return urlencode(util.get_hierarchical_pairs(
+    # Filtered keys cannot be measured without being generated. Neither
+    # can values filtered in batches without being collected.
+    if key_filter is None and batch_value_filter is None:
+        return util.get_hierarchical_encoded_size(
+            obj, convention=convention, value_filter=value_filter,
+        )
+
+    return util.get_encoded_size(util.iter_hierarchical_pairs(
         obj, convention=convention,
         key_filter=key_filter, value_filter=value_filter,
+        batch_value_filter=batch_value_filter,
     ))
 
 
@@ -121,13 +225,20 @@ def dump(obj,
          fp,
          convention=util.DEFAULT_CONVENTION,
          key_filter=None,
-         value_filter=None):
+         value_filter=None,
+         batch_value_filter=None):
     """Encode given ``obj`` into an NVP query string.
     Save the encoded value of ``obj`` to the file-like object ``fp``
     which is required to support the ``write`` operation.
 
+    The encoded value is written in chunks which are never joined into a
+    single string. File-like objects supporting ``writelines`` are given
+    all the chunks in a single call. ``fp`` may also be a file descriptor
+    or a socket in which case the chunks are written to it directly.
+
     :param obj: The dictionary to encode
-    :param fp: The file pointer in which the encoded value should be stored
+    :param fp: The file pointer, file descriptor or socket in which the
+               encoded value should be stored
     :param convention: The convention to utilize in encoding keys
                        corresponding to non-string sequences, e.g lists.
     :param key_filter: Function in which all keys should be filtered through.
@@ -136,10 +247,20 @@ def dump(obj,
     :param value_filter: Function in which all values should be filtered
                          through. In order to UTF-8 encode values for
                          example.
+    :param batch_value_filter: Function given the values of a chunk of
+                               pairs at once rather than one value per
+                               call, or a dictionary of such functions
+                               per field.
     """
-    kwargs = locals()
-    del kwargs['fp']
-    fp.write(dumps(**kwargs))
+    # The pairs are encoded and written in chunks rather than as a single
+    # string. Thus, sequence values given as generators are never stored
+    # in memory in their entirety.
+    pairs = util.iter_hierarchical_pairs(
+        obj, convention=convention,
+        key_filter=key_filter, value_filter=value_filter,
+        batch_value_filter=batch_value_filter,
+    )
+    util.write_chunks(fp, util.iter_encoded_chunks(pairs))
 
 
 def loads(string,
@@ -147,12 +268,20 @@ def loads(string,
           strict_parsing=False,
           get_hierarchical=True,
           key_filter=None,
-          value_filter=None):
+          value_filter=None,
+          limits=None,
+          cache=None,
+          interner=None,
+          registry=None,
+          convention=None,
+          batch_value_filter=None,
+          into=None):
     """Decode given NVP ``string`` into a dictionary.
 
     :param string: The encoded NVP string to decode
     :param keep_blank_values: Whether to retain keys with undefined values
-    :param strict_parsing: Whether to use strict parsing of the query string
+    :param strict_parsing: Whether to reject malformed query strings by
+                           raising :class:`ParseError`.
     :param get_hierarchical: Whether to decode into a single-level or
                              hierarchical dictionary.
     :param key_filter: Function in which all keys should be filtered through.
@@ -161,28 +290,63 @@ def loads(string,
     :param value_filter: Function in which all values should be filtered
                          through. In order to UTF-8 decode values for
                          example.
+    :param limits: :class:`Limits` to enforce on untrusted input. Violations
+                   raise :class:`LimitExceededError` prior to building
+                   the hierarchical dictionary.
+    :param cache: :class:`DecodeCache` in which decoded values are cached
+                  and retrieved from. Keyed by the digest of the payload
+                  along with the options given.
+    :param interner: :class:`ValueInterner` through which equal values of
+                     low-cardinality fields are shared across payloads.
+    :param registry: :class:`KeyRegistry` through which keys and key paths
+                     are shared across payloads.
+    :param convention: The convention which all keys conform to. Selects
+                       a decoder specialized for it. Otherwise, it is
+                       detected from a sample of the keys of each payload.
+    :param batch_value_filter: Function given the list of all values at
+                               once rather than one value per call, or a
+                               dictionary of such functions per field.
+                               Allowing vectorized conversions.
+    :param into: :class:`Model` class to decode into rather than into a
+                 dictionary. Attributes are assigned directly from the
+                 pairs and ``get_hierarchical`` is ignored.
     """
     # In case we receive an object which is considered False in an expression
     # we return an empty dictionary. The reason is because NVP is in essence
     # query strings in their encoded format, i.e they are expected to contain
     # key-value pairs.
     if not string:
-        return {}
+        return {} if into is None else into.__new__(into)
 
     # In case the value is not a string we consider it decoded since no other
     # type is allowed nor can be decoded in this implementation.
     if not util.is_string(string):
         return string
 
-    pairs = util.get_filtered_pairs(
-        parse_qs(string, keep_blank_values=keep_blank_values),
-        key_filter=key_filter, value_filter=value_filter,
-    )
-
-    params = dict(pairs)
-    if not get_hierarchical:
-        return params
-    return util.get_hierarchical_dict(params)
+    if cache is not None:
+        cache_key = cache.get_key(string, (
+            keep_blank_values, strict_parsing, get_hierarchical,
+            key_filter, value_filter, limits, convention,
+            batch_value_filter, into,
+        ))
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    query = phases.parse_query(string, keep_blank_values=keep_blank_values,
+                               strict_parsing=strict_parsing, limits=limits,
+                               convention=convention)
+    params = phases.filter_query(query, key_filter=key_filter,
+                                 value_filter=value_filter,
+                                 batch_value_filter=batch_value_filter,
+                                 interner=interner)
+    ret = phases.build_hierarchy(params, get_hierarchical=get_hierarchical,
+                                 limits=limits, registry=registry,
+                                 convention=convention, into=into)
+
+    if cache is not None:
+        cache.set(cache_key, ret, len(string))
+    return ret
 
 
 def load(fp,
@@ -190,13 +354,21 @@ def load(fp,
          strict_parsing=False,
          get_hierarchical=True,
          key_filter=None,
-         value_filter=None):
+         value_filter=None,
+         limits=None,
+         cache=None,
+         interner=None,
+         registry=None,
+         convention=None,
+         batch_value_filter=None,
+         into=None):
     """Decode given NVP ``fp`` into a dictionary.
     Where ``fp`` is a file-like object supporting the ``read`` operation.
 
     :param fp: File-like object supporting the read operation
     :param keep_blank_values: Whether to retain keys with undefined values
-    :param strict_parsing: Whether to use strict parsing of the query string
+    :param strict_parsing: Whether to reject malformed query strings by
+                           raising :class:`ParseError`.
     :param get_hierarchical: Whether to decode into a single-level or
                              hierarchical dictionary.
     :param key_filter: Function in which all keys should be filtered through.
@@ -205,7 +377,201 @@ def load(fp,
     :param value_filter: Function in which all values should be filtered
                          through. In order to UTF-8 decode values for
                          example.
+    :param limits: :class:`Limits` to enforce on untrusted input. Violations
+                   raise :class:`LimitExceededError` prior to building
+                   the hierarchical dictionary.
+    :param cache: :class:`DecodeCache` in which decoded values are cached
+                  and retrieved from. Keyed by the digest of the payload
+                  along with the options given.
+    :param interner: :class:`ValueInterner` through which equal values of
+                     low-cardinality fields are shared across payloads.
+    :param registry: :class:`KeyRegistry` through which keys and key paths
+                     are shared across payloads.
+    :param convention: The convention which all keys conform to. Selects
+                       a decoder specialized for it. Otherwise, it is
+                       detected from a sample of the keys of each payload.
+    :param batch_value_filter: Function given the list of all values at
+                               once rather than one value per call, or a
+                               dictionary of such functions per field.
+                               Allowing vectorized conversions.
+    :param into: :class:`Model` class to decode into rather than into a
+                 dictionary. Attributes are assigned directly from the
+                 pairs and ``get_hierarchical`` is ignored.
     """
     kwargs = locals()
     del kwargs['fp']
     return loads(fp.read(), **kwargs)
+
+
+def loads_many(strings,
+               keep_blank_values=False,
+               strict_parsing=False,
+               get_hierarchical=True,
+               key_filter=None,
+               value_filter=None,
+               limits=None,
+               cache=None,
+               interner=None,
+               registry=None,
+               convention=None,
+               batch_value_filter=None,
+               into=None):
+    """Decode each NVP string in the iterable ``strings``. Retrieves a
+    generator of the decoded dictionaries in the same order. Intended for
+    bulk decoding in which case an ``interner`` shared by all the payloads
+    significantly reduces the memory footprint of the decoded values.
+
+    :param strings: Iterable of encoded NVP strings to decode
+    :param keep_blank_values: Whether to retain keys with undefined values
+    :param strict_parsing: Whether to reject malformed query strings by
+                           raising :class:`ParseError`.
+    :param get_hierarchical: Whether to decode into a single-level or
+                             hierarchical dictionary.
+    :param key_filter: Function in which all keys should be filtered through.
+    :param value_filter: Function in which all values should be filtered
+                         through.
+    :param limits: :class:`Limits` to enforce on each payload
+    :param cache: :class:`DecodeCache` in which decoded values are cached
+                  and retrieved from.
+    :param interner: :class:`ValueInterner` through which equal values of
+                     low-cardinality fields are shared across payloads.
+    :param registry: :class:`KeyRegistry` through which keys and key paths
+                     are shared across payloads.
+    :param convention: The convention which all keys conform to. Selects
+                       a decoder specialized for it. Otherwise, it is
+                       detected from a sample of the keys of each payload.
+    :param batch_value_filter: Function given the list of all values at
+                               once rather than one value per call, or a
+                               dictionary of such functions per field.
+                               Allowing vectorized conversions.
+    :param into: :class:`Model` class to decode into rather than into a
+                 dictionary. Attributes are assigned directly from the
+                 pairs and ``get_hierarchical`` is ignored.
+    """
+    kwargs = locals()
+    del kwargs['strings']
+    return (loads(string, **kwargs) for string in strings)
+
+
+def iterparse(string_or_fp,
+              keep_blank_values=False,
+              strict_parsing=False,
+              key_filter=None,
+              value_filter=None,
+              limits=None):
+    """Decode given NVP ``string_or_fp`` into a generator of
+    ``(path, value)`` events in the order the pairs appear. Where ``path``
+    is the tuple of key components, e.g ``('L', 'AMT', 0)`` for the key
+    ``L_AMT0``. No dictionaries nor lists are built. Thus, file-like
+    objects are decoded in constant memory regardless of their size, unless
+    ``strict_parsing`` is requested. In which case the key path of each
+    pair is retained in order to detect duplicates::
+
+        >>> import nvp
+        >>> list(nvp.iterparse('L_AMT0=10.00&ACK=Success'))
+        [(('L', 'AMT', 0), '10.00'), (('ACK',), 'Success')]
+
+    Note that indexes are reported as they appear in the keys. Gaps in
+    the indexes of a sequence are thus not resolved as they are by
+    :func:`loads` which requires all the keys of the sequence to do so.
+
+    :param string_or_fp: The encoded NVP string to decode or a file-like
+                         object supporting the read operation.
+    :param keep_blank_values: Whether to retain keys with undefined values
+    :param strict_parsing: Whether to reject malformed query strings by
+                           raising :class:`ParseError`.
+    :param key_filter: Function in which all keys should be filtered through.
+                       Allowing key conversion from lowercase to uppercase
+                       or vice versa for example.
+    :param value_filter: Function in which all values should be filtered
+                         through. In order to UTF-8 decode values for
+                         example.
+    :param limits: :class:`Limits` to enforce on untrusted input. Violations
+                   raise :class:`LimitExceededError` as soon as the
+                   offending pair is read.
+    """
+    pairs = util.iter_raw_pairs(string_or_fp,
+                                keep_blank_values=keep_blank_values,
+                                strict_parsing=strict_parsing,
+                                limits=limits)
+    for k, v in pairs:
+        if key_filter is not None:
+            k = key_filter(k)
+        if value_filter is not None:
+            v = value_filter(v)
+
+        path = util.tokenize_key(k)
+        util.check_key_path_limits(k, path, limits)
+        yield (path, v)
+
+
+def peek(string_or_fp,
+         keys,
+         keep_blank_values=False,
+         limits=None):
+    """Retrieve a dictionary of the values of the given raw ``keys`` in
+    the NVP ``string_or_fp`` without decoding the rest of it. Reading
+    stops as soon as all the keys are found. Thus, the cost of routing a
+    response by a few leading keys is independent of its size::
+
+        >>> import nvp
+        >>> nvp.peek('ACK=Failure&L_ERRORCODE0=10001&L_AMT0=1.00',
+        ...          keys=['ACK', 'L_ERRORCODE0'])
+        {'ACK': 'Failure', 'L_ERRORCODE0': '10001'}
+
+    Keys which are not present are absent from the dictionary. In case a
+    key occurs more than once only its first value is retrieved.
+
+    :param string_or_fp: The encoded NVP string to search or a file-like
+                         object supporting the read operation.
+    :param keys: Iterable of the raw, i.e flat, keys to retrieve
+    :param keep_blank_values: Whether to retain keys with undefined values
+    :param limits: :class:`Limits` to enforce on the input read
+    """
+    return util.find_pairs(string_or_fp, keys,
+                           keep_blank_values=keep_blank_values,
+                           limits=limits)
+
+
+def to_json(string_or_fp,
+            out_fp,
+            keep_blank_values=False,
+            strict_parsing=False,
+            key_filter=None,
+            value_filter=None,
+            limits=None):
+    """Decode given NVP ``string_or_fp`` and write the JSON equivalent of
+    the hierarchical dictionary to the file-like object ``out_fp``. The
+    output is the same as ``json.dump(loads(string), out_fp, sort_keys=True)``
+    without building the hierarchical dictionary in between, unless the
+    payload is irregular. The pairs are buffered in order to be sorted.
+    See ``util.write_hierarchical_json``::
+
+        >>> import sys
+        >>> import nvp
+        >>> nvp.to_json('L_AMT0=10.00&L_AMT1=5.00&ACK=Success', sys.stdout)
+        {"ACK": "Success", "L": {"AMT": ["10.00", "5.00"]}}
+
+    :param string_or_fp: The encoded NVP string to decode or a file-like
+                         object supporting the read operation.
+    :param out_fp: The file pointer in which the JSON should be written
+    :param keep_blank_values: Whether to retain keys with undefined values
+    :param strict_parsing: Whether to reject malformed query strings by
+                           raising :class:`ParseError`.
+    :param key_filter: Function in which all keys should be filtered through.
+                       Allowing key conversion from lowercase to uppercase
+                       or vice versa for example.
+    :param value_filter: Function in which all values should be filtered
+                         through. In order to UTF-8 decode values for
+                         example.
+    :param limits: :class:`Limits` to enforce on untrusted input. Violations
+                   raise :class:`LimitExceededError` prior to writing.
+    """
+    pairs = util.iter_raw_pairs(string_or_fp,
+                                keep_blank_values=keep_blank_values,
+                                strict_parsing=strict_parsing,
+                                limits=limits)
+    util.write_hierarchical_json(pairs, out_fp,
+                                 key_filter=key_filter,
+                                 value_filter=value_filter,
+                                 limits=limits)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+NVP Decode Cache.
+
+Services receiving the same NVP payloads repeatedly - IPN retries and
+replayed responses for instance - can avoid decoding them over and over
+again by passing a :class:`DecodeCache` to ``nvp.loads``::
+
+    >>> import nvp
+    >>> cache = nvp.DecodeCache(max_entries=1024, max_bytes=1 << 20)
+    >>> nvp.loads('ACK=Success&TOKEN=EC-123', cache=cache)
+    {'ACK': 'Success', 'TOKEN': 'EC-123'}
+    >>> cache.stats()['misses']
+    1
+
+Cached values are never handed out directly. Each hit retrieves a copy
+of the cached dictionary in order to ensure callers cannot corrupt it.
+"""
+
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
+
+from nvp import util
+from nvp.models import Model
+
+
+class DecodeCache(object):
+    """Bounded, thread-safe LRU cache of decoded NVP payloads keyed by
+    the digest of the payload along with the options it was decoded with.
+
+    :param max_entries: Maximum number of cached payloads
+    :param max_bytes: Maximum accumulated length of the cached payloads
+                      or ``None`` in order to only bound the entries.
+    """
+    def __init__(self, max_entries=1024, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_key(self, string, options):
+        """Retrieve the cache key of the encoded ``string`` when decoded
+        with the given ``options``.
+
+        :param string: The encoded NVP string
+        :param options: Hashable tuple of the options given to ``loads``
+        """
+        if isinstance(string, unicode):
+            string = string.encode('utf-8')
+        return (hashlib.sha1(string).digest(), options)
+
+    def get(self, key):
+        """Retrieve a copy of the value cached under ``key``. In case no
+        such value is cached ``None`` is returned.
+
+        :param key: The key as retrieved via :meth:`get_key`
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            # Re-insert the entry in order to mark it as the most
+            # recently utilized one.
+            self._entries[key] = entry
+            self.hits += 1
+        return _copy_value(entry[0])
+
+    def set(self, key, value, size):
+        """Cache a copy of the decoded ``value`` under ``key``.
+
+        :param key: The key as retrieved via :meth:`get_key`
+        :param value: The decoded value to cache
+        :param size: The length of the encoded payload of ``value``
+        """
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        value = _copy_value(value)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+
+            self._entries[key] = (value, size)
+            self.size += size
+            while (len(self._entries) > self.max_entries or
+                   (self.max_bytes is not None and
+                    self.size > self.max_bytes)):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """Remove all cached values. The statistics are retained."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """Retrieve a dictionary containing the statistics of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': (float(self.hits) / lookups) if lookups else 0.0,
+            }
+
+
+def _copy_value(value):
+    """Recursively copy the dictionaries and lists of the decoded
+    ``value``. Strings are immutable and thus shared between the copies.
+    Models are copied into instances of the same class. Other values, e.g
+    as retrieved via a value filter, are copied via ``copy.copy`` in order
+    to retain their type.
+
+    :param value: The decoded value to copy
+    """
+    cls = value.__class__
+    if cls is dict:
+        return dict((k, _copy_value(v)) for k, v in value.iteritems())
+    if cls is list:
+        return [_copy_value(v) for v in value]
+    if util.is_string(value):
+        return value
+    if isinstance(value, Model):
+        ret = cls.__new__(cls)
+        for name, v in value.iteritems():
+            setattr(ret, name, _copy_value(v))
+        return ret
+    return copy.copy(value)
@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+"""
+NVP Client.
+
+Executes large batches of independent NVP API calls, e.g refunds or
+status checks, concurrently rather than one after another::
+
+    >>> import nvp.client
+    >>> executor = nvp.client.BatchExecutor('https://api.example.com/nvp',
+    ...                                     max_concurrency=16)
+    >>> results = executor.run({'METHOD': 'RefundTransaction',
+    ...                         'TRANSACTIONID': t} for t in transactions)
+    ... # doctest: +SKIP
+
+Each call is encoded via ``nvp.dumps``, sent as the body of a ``POST``
+request and its response decoded via ``nvp.loads``. At most
+``max_concurrency`` calls are in flight at any given time. Each worker
+retains a persistent connection per host which is reused across calls.
+
+Calls failing with a ``503 Service Unavailable`` response, which the
+server has not processed, are retried with an exponential backoff. So are
+calls failing due to connection errors before the request was sent, i.e
+failing to connect or a persistent connection closed by the server while
+idle. Calls such as refunds are not idempotent. Thus, calls failing once
+the request may have been received are not retried unless ``retry_unsafe``
+is given. That is calls timing out while waiting for the response and
+calls failing with any other server error, i.e a status of 500 or above,
+since the server might have processed the call prior to failing.
+
+The results are retrieved in the order the calls were submitted in along
+with throughput and latency statistics of the batch. In case a ``rate``
+is given the calls are started at that rate, e.g in order to load test a
+server. See ``nvp.testing``.
+
+Python 2 lacks ``asyncio``. Thus, the calls are executed by a pool of
+threads which, since the calls spend most of their time waiting for the
+network, scales in the same manner for the number of concurrent calls
+intended.
+"""
+
+import time
+import Queue
+import socket
+import httplib
+import threading
+
+from urlparse import urlsplit
+
+import nvp
+from nvp import util
+
+#: Status codes of responses which are considered transient
+RETRY_STATUS_MIN = 500
+
+#: Status codes of transient responses to calls which the server has not
+#: processed. Thus, retried even though ``retry_unsafe`` is not given.
+SAFE_RETRY_STATUSES = frozenset([503])
+
+#: Percentiles of the latencies reported by :meth:`BatchExecutor.run`
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+class CallError(IOError):
+    """Raised in case an API call does not retrieve a successful response.
+
+    :param status: The status code of the response, if any
+    :param reason: Description of the error
+    """
+    def __init__(self, reason, status=None):
+        message = reason if status is None else '%d %s' % (status, reason)
+        super(CallError, self).__init__(message)
+        self.status = status
+        self.reason = reason
+
+
+class _AttemptError(Exception):
+    """Wraps the connection error of an attempt along with whether the
+    request may have been received by the server.
+    """
+    def __init__(self, error, sent):
+        Exception.__init__(self, error)
+        self.error = error
+        self.sent = sent
+
+
+class CallResult(object):
+    """Outcome of a single API call executed by :class:`BatchExecutor`.
+
+    :param request: The dictionary encoded as the body of the call
+    :param response: The decoded response or ``None`` in case of failure
+    :param error: The exception of the last attempt in case of failure,
+                  including unexpected errors while encoding the call or
+                  decoding its response
+    :param attempts: The number of attempts made
+    :param latency: The number of seconds from the call being encoded
+                    until its response was decoded
+    :param encode_time: The number of seconds spent encoding the call
+    :param decode_time: The number of seconds spent decoding the response
+    """
+    __slots__ = ('request', 'response', 'error', 'attempts', 'latency',
+                 'encode_time', 'decode_time')
+
+    def __init__(self, request, response=None, error=None,
+                 attempts=0, latency=0.0, encode_time=0.0, decode_time=0.0):
+        self.request = request
+        self.response = response
+        self.error = error
+        self.attempts = attempts
+        self.latency = latency
+        self.encode_time = encode_time
+        self.decode_time = decode_time
+
+    def __repr__(self):
+        outcome = 'error=%r' % self.error if self.error else 'ok'
+        return '<CallResult %s attempts=%d latency=%.3f>' % (
+            outcome, self.attempts, self.latency)
+
+    @property
+    def ok(self):
+        # Calls which have not been attempted are never successful
+        return self.error is None and self.attempts > 0
+
+
+class BatchExecutor(object):
+    """Executor of many concurrent NVP API calls.
+
+    :param url: The default URL of the API which each call is sent to
+    :param max_concurrency: Maximum number of calls in flight at once
+    :param retries: The number of times a failing call is retried
+    :param backoff: The number of seconds to wait prior to the first retry.
+                    Doubled for each subsequent retry of a call.
+    :param max_backoff: Maximum number of seconds to wait prior to a retry
+    :param timeout: The number of seconds to wait for a response
+    :param headers: Dictionary of additional HTTP headers of each call
+    :param convention: The convention to encode the calls with
+    :param loads_options: Keyword arguments given ``nvp.loads`` in order to
+                          decode each response, e.g ``limits``.
+    :param rate: Maximum number of calls started per second or ``None``
+                 in order to start each call as soon as a worker is idle
+    :param retry_unsafe: Whether to retry calls failing after the request
+                         may have been received, i.e due to connection
+                         errors such as read timeouts or due to server
+                         errors other than ``SAFE_RETRY_STATUSES``. Only
+                         safe for idempotent calls since the server might
+                         process the call twice.
+    """
+    def __init__(self,
+                 url=None,
+                 max_concurrency=8,
+                 retries=2,
+                 backoff=0.1,
+                 max_backoff=5.0,
+                 timeout=30.0,
+                 headers=None,
+                 convention=util.DEFAULT_CONVENTION,
+                 loads_options=None,
+                 rate=None,
+                 retry_unsafe=False):
+        if max_concurrency < 1:
+            raise ValueError('Cannot execute less than one call at a time')
+
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self.convention = convention
+        self.loads_options = dict(loads_options or {})
+        self.rate = rate
+        self.retry_unsafe = retry_unsafe
+        self.stats = None
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def run(self, calls):
+        """Execute all ``calls`` and retrieve a list of their
+        :class:`CallResult` in the order they were given in.
+
+        Statistics of the batch are stored in :attr:`stats` afterwards.
+        See :func:`get_stats`.
+
+        :param calls: Iterable of either dictionaries to send to the
+                      default URL or tuples of the URL and dictionary
+        """
+        tasks = Queue.Queue()
+        results = []
+        for index, call in enumerate(calls):
+            url, request = call if isinstance(call, tuple) else (self.url,
+                                                                 call)
+            if url is None:
+                raise ValueError('Cannot send call without URL: %s' % request)
+            results.append(CallResult(request))
+            tasks.put((index, url))
+
+        workers = []
+        for _ in xrange(min(self.max_concurrency, len(results))):
+            tasks.put(None)
+            worker = threading.Thread(target=self._work,
+                                      args=(tasks, results))
+            worker.daemon = True
+            workers.append(worker)
+
+        started_at = self._next_start = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.stats = get_stats(results, time.time() - started_at)
+        return results
+
+    def _work(self, tasks, results):
+        """Execute the calls of ``tasks`` until ``None`` is retrieved.
+        Connections are retained per host and reused across calls.
+        """
+        connections = {}
+        try:
+            while True:
+                task = tasks.get()
+                if task is None:
+                    break
+                index, url = task
+                result = results[index]
+                try:
+                    if self.rate:
+                        self._wait_for_start()
+                    self._call(connections, url, result)
+                except Exception as e:
+                    # Unexpected errors fail the call rather than the worker.
+                    # Otherwise, the remaining calls of the worker would not
+                    # be executed since the other workers stop at their
+                    # sentinels. The state of the connections is unknown.
+                    result.error = e
+                    for connection in connections.itervalues():
+                        connection.close()
+                    connections.clear()
+        finally:
+            for connection in connections.itervalues():
+                connection.close()
+
+    def _wait_for_start(self):
+        """Wait until the next call is due in order to start the calls
+        at the intended rate.
+        """
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next_start)
+            self._next_start = start + 1.0 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+    def _call(self, connections, url, result):
+        """Execute the call of ``result`` by sending it to ``url``.
+        Retried until it succeeds or all retries have been made.
+        """
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        headers.update(self.headers)
+
+        started_at = time.time()
+        body = nvp.dumps(result.request, convention=self.convention)
+        result.encode_time = time.time() - started_at
+        while True:
+            result.attempts += 1
+            try:
+                connection = self._get_connection(connections, parts)
+                response = self._send(connection, path, body, headers)
+            except (_AttemptError, CallError) as e:
+                # Connections are closed on errors other than unsuccessful
+                # responses and re-established by the next attempt.
+                if isinstance(e, _AttemptError):
+                    connections.pop((parts.scheme, parts.netloc), None)
+                if self._is_retryable(e) and result.attempts <= self.retries:
+                    delay = self.backoff * (2 ** (result.attempts - 1))
+                    time.sleep(min(delay, self.max_backoff))
+                    continue
+                result.error = e.error if isinstance(e, _AttemptError) else e
+                break
+            else:
+                decode_started_at = time.time()
+                try:
+                    result.response = nvp.loads(response,
+                                                **self.loads_options)
+                except ValueError as e:
+                    result.error = e
+                result.decode_time = time.time() - decode_started_at
+                break
+        result.latency = time.time() - started_at
+
+    def _is_retryable(self, e):
+        """Check whether the call failing due to ``e`` may be retried."""
+        if isinstance(e, CallError):
+            if e.status in SAFE_RETRY_STATUSES:
+                return True
+            return self.retry_unsafe and (e.status is None or
+                                          e.status >= RETRY_STATUS_MIN)
+        return self.retry_unsafe or not e.sent
+
+    def _get_connection(self, connections, parts):
+        key = (parts.scheme, parts.netloc)
+        connection = connections.get(key)
+        if connection is None:
+            if parts.scheme == 'https':
+                cls = httplib.HTTPSConnection
+            else:
+                cls = httplib.HTTPConnection
+            connection = connections[key] = cls(parts.netloc,
+                                                timeout=self.timeout)
+        return connection
+
+    def _send(self, connection, path, body, headers):
+        """Send ``body`` and retrieve the body of the response. Raises
+        :class:`CallError` unless the response is successful and
+        :class:`_AttemptError` in case of connection errors.
+        """
+        reused = connection.sock is not None
+        sent = False
+        try:
+            if not reused:
+                connection.connect()
+            sent = True
+            connection.request('POST', path, body, headers)
+            response = connection.getresponse()
+            data = response.read()
+        except (socket.error, httplib.HTTPException) as e:
+            connection.close()
+            # A persistent connection closed by the server while idle is
+            # only noticed once the response is read, which is empty since
+            # the request was never received.
+            if reused and isinstance(e, httplib.BadStatusLine):
+                sent = False
+            raise _AttemptError(e, sent)
+        except:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        if not 200 <= response.status < 300:
+            raise CallError(response.reason, status=response.status)
+        return data
+
+
+def get_stats(results, elapsed):
+    """Retrieve a dictionary of the throughput, in calls per second, the
+    latency percentiles of the executed ``results`` and the share of the
+    total latency spent encoding the calls and decoding the responses.
+
+    :param results: List of the :class:`CallResult` of the executed calls
+    :param elapsed: The number of seconds it took to execute all the calls
+    """
+    latencies = sorted(result.latency for result in results)
+    percentiles = {}
+    for percentile in LATENCY_PERCENTILES:
+        percentiles[percentile] = _get_percentile(latencies, percentile)
+
+    total_latency = sum(latencies)
+    encode_time = sum(result.encode_time for result in results)
+    decode_time = sum(result.decode_time for result in results)
+
+    return {
+        'calls': len(results),
+        'errors': sum(1 for result in results if not result.ok),
+        'attempts': sum(result.attempts for result in results),
+        'elapsed': elapsed,
+        'throughput': len(results) / elapsed if elapsed > 0 else 0.0,
+        'latency': percentiles,
+        'encode_share': encode_time / total_latency if total_latency else 0.0,
+        'decode_share': decode_time / total_latency if total_latency else 0.0,
+    }
+
+
+def format_stats(stats):
+    """Format the ``stats`` retrieved via :func:`get_stats` as text.
+
+    :param stats: The statistics to format
+    """
+    latencies = ', '.join('p%d %.1f ms' % (p, stats['latency'][p] * 1000)
+                          for p in sorted(stats['latency']))
+    return ('%d calls (%d errors, %d attempts) in %.3f s: '
+            '%.1f calls/s, latency %s, encode %.1f%%, decode %.1f%%' % (
+                stats['calls'], stats['errors'], stats['attempts'],
+                stats['elapsed'], stats['throughput'], latencies,
+                stats['encode_share'] * 100, stats['decode_share'] * 100))
+
+
+def _get_percentile(values, percentile):
+    """Retrieve the ``percentile`` of the sorted ``values`` by the
+    nearest-rank method. ``0.0`` is retrieved in case there are none.
+    """
+    if not values:
+        return 0.0
+    rank = int(round(percentile / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(rank, len(values) - 1))]
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+NVP Debugging.
+
+Explains why decoding a given payload is expensive. The payload is
+decoded by the same phases as ``nvp.loads`` while the cost of each key,
+and of each top-level subtree, is recorded along with the keys which
+are decoded in an unusual and thereby slow manner::
+
+    >>> import nvp.debug
+    >>> report = nvp.debug.explain('L_AMT0=1&L_AMT2=2')
+    >>> report['fallback_keys']
+    ['L_AMT2']
+
+The report is a dictionary which :func:`format_explanation` formats as
+text. Keys listed in ``fallback_keys`` contain an index out of range of
+its sequence, e.g due to a gap in the indexes, and are decoded as
+dictionary keys instead. Keys listed in ``multi_pass_keys`` are not
+tokenized in a single pass but have the convention of each of their
+components detected separately, e.g keys of a convention other than
+the one detected for the payload.
+
+The module can be executed in order to explain a payload stored in a file::
+
+    python -m nvp.debug payload.nvp
+"""
+
+import argparse
+
+from timeit import default_timer
+
+from nvp import util
+from nvp import phases
+
+#: Number of keys listed in the text format of a report
+FORMATTED_KEYS = 10
+
+
+def explain(string,
+            keep_blank_values=False,
+            strict_parsing=False,
+            key_filter=None,
+            value_filter=None,
+            limits=None,
+            interner=None,
+            registry=None,
+            convention=None,
+            batch_value_filter=None):
+    """Decode given NVP ``string`` and retrieve a report of the cost
+    of decoding each key and each top-level subtree. The options are
+    applied in the same manner as by ``nvp.loads``.
+
+    :param string: The encoded NVP string to explain
+    :param keep_blank_values: Whether to retain keys with undefined values
+    :param strict_parsing: Whether to reject malformed query strings by
+                           raising ``nvp.ParseError``.
+    :param key_filter: Function in which all keys should be filtered through.
+    :param value_filter: Function in which all values should be filtered
+                         through.
+    :param limits: ``nvp.Limits`` to enforce on untrusted input
+    :param interner: ``nvp.ValueInterner`` through which equal values of
+                     low-cardinality fields are shared across payloads.
+    :param registry: ``nvp.KeyRegistry`` through which keys and key paths
+                     are shared across payloads. The number of passes of
+                     keys is then unknown and reported as ``None``.
+    :param convention: The convention which all keys conform to. Otherwise,
+                       it is detected in the same manner as ``nvp.loads``.
+    :param batch_value_filter: Function given the list of all values at
+                               once rather than one value per call, or a
+                               dictionary of such functions per field.
+    """
+    started_at = default_timer()
+    query = phases.parse_query(string, keep_blank_values=keep_blank_values,
+                               strict_parsing=strict_parsing, limits=limits,
+                               convention=convention)
+    source = phases.filter_query(query, key_filter=key_filter,
+                                 value_filter=value_filter,
+                                 batch_value_filter=batch_value_filter,
+                                 interner=interner)
+    parse_time = default_timer() - started_at
+
+    payload_convention = convention
+    if payload_convention is None:
+        payload_convention = util.detect_payload_convention(source)
+
+    keys = {}
+
+    def collect(key, stats):
+        keys.setdefault(key, {'key': key}).update(stats)
+
+    ret = util.get_hierarchical_dict(source, limits=limits,
+                                     registry=registry,
+                                     convention=convention,
+                                     key_callback=collect)
+    subtrees = {}
+    for stats in keys.itervalues():
+        stats['depth'] = len(stats['path'])
+        stats['time'] = stats['tokenize_time'] + stats['build_time']
+
+        name = stats['path'][0] if stats['path'] else ''
+        subtree = subtrees.setdefault(name, {'keys': 0, 'time': 0.0,
+                                             'max_depth': 0})
+        subtree['keys'] += 1
+        subtree['time'] += stats['time']
+        subtree['max_depth'] = max(subtree['max_depth'], stats['depth'])
+
+    ordered = sorted(keys.itervalues(), key=lambda stats: -stats['time'])
+    return {
+        'convention': payload_convention,
+        'pairs': len(source),
+        'parse_time': parse_time,
+        'time': parse_time + sum(stats['time'] for stats in ordered),
+        'max_depth': max([stats['depth'] for stats in ordered] or [0]),
+        'keys': ordered,
+        'subtrees': subtrees,
+        'fallback_keys': sorted(stats['key'] for stats in ordered
+                                if stats['fallbacks']),
+        'multi_pass_keys': sorted(stats['key'] for stats in ordered
+                                  if (stats['passes'] or 1) > 1),
+        'result': ret,
+    }
+
+
+def format_explanation(report, keys=FORMATTED_KEYS):
+    """Format the ``report`` retrieved via :func:`explain` as text.
+
+    :param report: The report to format
+    :param keys: The number of the most expensive keys to list
+    """
+    lines = ['%d pairs decoded in %.3f ms (parsing %.3f ms), '
+             'convention: %s, max depth: %d' % (
+                 report['pairs'], report['time'] * 1000,
+                 report['parse_time'] * 1000,
+                 report['convention'] or 'mixed', report['max_depth'])]
+
+    lines.append('')
+    lines.append('%-30s %6s %10s %6s' % ('subtree', 'keys', 'time (ms)',
+                                        'depth'))
+    subtrees = sorted(report['subtrees'].iteritems(),
+                      key=lambda item: -item[1]['time'])
+    for name, subtree in subtrees:
+        lines.append('%-30s %6d %10.3f %6d' % (
+            name, subtree['keys'], subtree['time'] * 1000,
+            subtree['max_depth']))
+
+    lines.append('')
+    lines.append('%-30s %10s %6s %7s %s' % ('key', 'time (ms)', 'depth',
+                                           'passes', 'fallbacks'))
+    for stats in report['keys'][:keys]:
+        fallbacks = ', '.join('%s[%d] at depth %d' % (k, index, depth)
+                              for depth, k, index in stats['fallbacks'])
+        passes = stats['passes']
+        lines.append('%-30s %10.3f %6d %7s %s' % (
+            stats['key'], stats['time'] * 1000, stats['depth'],
+            '-' if passes is None else passes, fallbacks or '-'))
+
+    lines.append('')
+    lines.append('%d keys fell back from an index out of range: %s' % (
+        len(report['fallback_keys']),
+        ', '.join(report['fallback_keys']) or '-'))
+    lines.append('%d keys were tokenized in multiple passes: %s' % (
+        len(report['multi_pass_keys']),
+        ', '.join(report['multi_pass_keys']) or '-'))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m nvp.debug',
+        description='Explain the cost of decoding a payload.')
+    parser.add_argument('path', help='File containing the payload')
+    parser.add_argument('--keys', type=int, default=FORMATTED_KEYS,
+                        help='Number of the most expensive keys to list')
+    parser.add_argument('--convention', default=None,
+                        choices=util.CONVENTIONS)
+    args = parser.parse_args(argv)
+
+    with open(args.path) as f:
+        payload = f.read()
+
+    report = explain(payload.strip(), convention=args.convention)
+    print format_explanation(report, keys=args.keys)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+NVP Diagnostics.
+
+Measures the cost of encoding and decoding a given payload broken down
+by the phases of the procedure. Intended to determine which changes of
+representation would actually save memory::
+
+    >>> import nvp
+    >>> import nvp.diagnostics
+    >>> report = nvp.diagnostics.measure(nvp.loads, 'L_AMT0=1&L_AMT1=2')
+    >>> [phase['name'] for phase in report['phases']]
+    ['parse', 'filter', 'hierarchy']
+
+Each phase reports the time spent, the size retained by its output, the
+peak and retained number of allocated bytes along with the number of
+allocated blocks still alive once the phase is completed. In case
+``tracemalloc`` is unavailable, e.g on Python 2, allocations are not
+traced and reported as ``None``. The peak is then the growth of the peak
+resident set size of the process, as reported by ``resource.getrusage``,
+which remains ``0`` unless the phase exceeds the previous peak.
+
+In case the caller is tracing allocations already its trace is left
+running. The allocated bytes are then the growth of the traced memory
+while the peak and blocks, which cannot be told apart from the ones of
+the caller, are reported as ``None``.
+
+The phases are those of ``nvp.phases`` which ``nvp.loads`` and
+``nvp.dumps`` consist of. Thus, options given either are applied in the
+same manner. Options which cannot be broken down by phase, e.g ``cache``,
+raise a ``TypeError`` rather than being ignored.
+
+The module can be executed in order to measure a payload stored in a file::
+
+    python -m nvp.diagnostics --memory payload.nvp
+    python -m nvp.diagnostics --memory --encode payload.json
+"""
+
+import sys
+import json
+import time
+import inspect
+import argparse
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import nvp
+from nvp import util
+from nvp import models
+from nvp import phases
+
+#: Number of bytes per unit of the maximum resident set size
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+def measure(func, payload, **kwargs):
+    """Measure the cost of executing ``func`` on ``payload``.
+
+    In case ``func`` is either ``nvp.loads`` or ``nvp.dumps`` the cost
+    is broken down by the phases of the procedure. Otherwise, the entire
+    execution is considered a single phase.
+
+    :param func: The function to measure, e.g ``nvp.loads``
+    :param payload: The payload to give ``func``
+    :param kwargs: Additional keyword arguments to give ``func``
+    """
+    steps = _PHASES.get(func, None)
+    if steps is None:
+        steps = [('total', lambda value: func(value, **kwargs))]
+    else:
+        unsupported = sorted(set(kwargs) - _OPTIONS[func])
+        if unsupported:
+            message = 'Cannot measure %s by phase with options: %s'
+            raise TypeError(message % (func.__name__, ', '.join(unsupported)))
+        steps = [(name, _bind_options(phase, kwargs))
+                 for name, phase in steps]
+
+    report = {
+        'function': getattr(func, '__name__', repr(func)),
+        'tracemalloc': tracemalloc is not None,
+        'rusage': tracemalloc is None and resource is not None,
+        'phases': [],
+    }
+
+    value = payload
+    for name, phase in steps:
+        value, stats = _measure_phase(phase, value)
+        stats['name'] = name
+        report['phases'].append(stats)
+
+    report['time'] = sum(stats['time'] for stats in report['phases'])
+    report['result_size'] = get_retained_size(value)
+    return report
+
+
+def get_retained_size(obj):
+    """Retrieve the number of bytes retained by ``obj`` including
+    all the containers and values it references.
+
+    :param obj: The object to retrieve the retained size of
+    """
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if util.is_dict(obj):
+            if isinstance(obj, models.Model):
+                stack.extend(v for _, v in obj.iteritems())
+            else:
+                stack.extend(obj.iterkeys())
+                stack.extend(obj.itervalues())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    return size
+
+
+def format_report(report):
+    """Format the ``report`` retrieved via :func:`measure` as text.
+
+    :param report: The report to format
+    """
+    def fmt(value):
+        return '-' if value is None else str(value)
+
+    lines = ['%-10s %12s %12s %12s %10s %12s' % (
+        'phase', 'time (ms)', 'peak', 'allocated', 'blocks', 'retained')]
+    for phase in report['phases']:
+        lines.append('%-10s %12.3f %12s %12s %10s %12s' % (
+            phase['name'], phase['time'] * 1000,
+            fmt(phase['peak_bytes']), fmt(phase['allocated_bytes']),
+            fmt(phase['blocks']), phase['retained_bytes'],
+        ))
+    lines.append('%s: %.3f ms, result retains %d bytes' % (
+        report['function'], report['time'] * 1000, report['result_size']))
+    if report['rusage']:
+        lines.append('tracemalloc is unavailable; peak is the growth of the '
+                     'peak RSS, allocations not traced')
+    elif not report['tracemalloc']:
+        lines.append('tracemalloc is unavailable; allocations not traced')
+    return '\n'.join(lines)
+
+
+def _measure_phase(phase, value):
+    """Execute ``phase`` on ``value`` and retrieve a tuple of its
+    output along with the statistics of the execution.
+    """
+    is_traced = tracemalloc is not None and tracemalloc.is_tracing()
+    if is_traced:
+        traced_at, _ = tracemalloc.get_traced_memory()
+    elif tracemalloc is not None:
+        tracemalloc.start()
+    elif resource is not None:
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started_at = time.time()
+    ret = phase(value)
+    elapsed = time.time() - started_at
+
+    stats = {
+        'time': elapsed,
+        'peak_bytes': None,
+        'allocated_bytes': None,
+        'blocks': None,
+    }
+    if is_traced:
+        current, _ = tracemalloc.get_traced_memory()
+        stats['allocated_bytes'] = current - traced_at
+    elif tracemalloc is not None:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats['peak_bytes'] = peak
+        stats['allocated_bytes'] = current
+        stats['blocks'] = sum(stat.count for stat in
+                              snapshot.statistics('filename'))
+    elif resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        stats['peak_bytes'] = (usage.ru_maxrss - peak_rss) * RSS_UNIT
+
+    stats['retained_bytes'] = get_retained_size(ret)
+    return (ret, stats)
+
+
+def _get_phase_options(phase):
+    """Retrieve the names of the options which ``phase`` applies, i.e all
+    of its arguments except the value given by the previous phase.
+    """
+    return inspect.getargspec(phase).args[1:]
+
+
+def _bind_options(phase, options):
+    """Retrieve a function executing ``phase`` on a value given the
+    ``options`` which it applies.
+    """
+    kwargs = dict((k, options[k]) for k in _get_phase_options(phase)
+                  if k in options)
+    return lambda value: phase(value, **kwargs)
+
+
+#: Mapping of API functions and the phases they consist of
+_PHASES = {
+    nvp.loads: [
+        ('parse', phases.parse_query),
+        ('filter', phases.filter_query),
+        ('hierarchy', phases.build_hierarchy),
+    ],
+    nvp.dumps: [
+        ('pairs', phases.get_pairs),
+        ('encode', phases.encode_query),
+    ],
+}
+
+#: Mapping of API functions and the options their phases apply
+_OPTIONS = dict(
+    (func, frozenset(option for _, phase in steps
+                     for option in _get_phase_options(phase)))
+    for func, steps in _PHASES.iteritems()
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m nvp.diagnostics',
+        description='Measure the cost of decoding or encoding a payload.')
+    parser.add_argument('path', help='File containing the payload')
+    parser.add_argument('--memory', action='store_true',
+                        help='Report the memory footprint of each phase')
+    parser.add_argument('--encode', action='store_true',
+                        help='Encode the JSON payload rather than decode it')
+    parser.add_argument('--convention', default=util.DEFAULT_CONVENTION,
+                        choices=util.CONVENTIONS)
+    args = parser.parse_args(argv)
+
+    with open(args.path) as f:
+        payload = f.read()
+
+    if args.encode:
+        report = measure(nvp.dumps, json.loads(payload),
+                         convention=args.convention)
+    else:
+        report = measure(nvp.loads, payload.strip())
+
+    if args.memory:
+        print format_report(report)
+    else:
+        print '%s: %.3f ms' % (report['function'], report['time'] * 1000)
+
+if __name__ == '__main__':
+    main()
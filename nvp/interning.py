@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+NVP Value Interning.
+
+Bulk decoding of stored responses allocates the same values, e.g
+``ACK=Success`` and ``CURRENCYCODE=USD``, over and over again. Passing a
+:class:`ValueInterner` to ``nvp.loads`` or ``nvp.loads_many`` ensures
+equal values of low-cardinality fields share a single object::
+
+    >>> import nvp
+    >>> interner = nvp.ValueInterner(fields=['ACK', 'CURRENCYCODE'])
+    >>> a, b = nvp.loads_many(['ACK=Success', 'ACK=Success'],
+    ...                       interner=interner)
+    >>> a['ACK'] is b['ACK']
+    True
+
+Fields are identified by the last name in the path of each key. Thus,
+``PAYMENTINFO_0_CURRENCYCODE`` and ``L_CURRENCYCODE0`` are both considered
+the ``CURRENCYCODE`` field.
+
+Similarly, a :class:`KeyRegistry` shares the keys of the decoded
+dictionaries along with the tokenized path of each raw key. Thousands of
+records sharing the same keys thus share the same key objects too::
+
+    >>> registry = nvp.KeyRegistry()
+    >>> a, b = nvp.loads_many(['L_AMT0=1', 'L_AMT0=2'], registry=registry)
+    >>> a.keys()[0] is b.keys()[0]
+    True
+"""
+
+from nvp import util
+
+#: Maximum number of raw keys whose field is retained by a ValueInterner
+KEY_FIELD_CACHE_SIZE = 4096
+
+
+class ValueInterner(object):
+    """Table of decoded values shared across decoded payloads.
+
+    :param fields: Iterable of the fields whose values should be interned
+                   or ``None`` in order to intern the values of all fields.
+    :param max_values: Maximum number of distinct values interned per
+                       field. Fields exceeding it are considered to be of
+                       high cardinality and their values are no longer
+                       interned. Values already interned remain shared.
+    """
+    def __init__(self, fields=None, max_values=256):
+        self.fields = frozenset(fields) if fields is not None else None
+        self.max_values = max_values
+        self._tables = {}
+        self._key_fields = {}
+
+    def __len__(self):
+        return sum(len(table) for table in self._tables.itervalues())
+
+    def get_field(self, key):
+        """Retrieve the field of the raw ``key``, i.e the last name in the
+        path of it. ``None`` is retrieved in case the field should not
+        be interned at all.
+
+        :param key: The raw key to retrieve the field of
+        """
+        try:
+            return self._key_fields[key]
+        except KeyError:
+            pass
+
+        field = util.get_key_field(key)
+        if self.fields is not None and field not in self.fields:
+            field = None
+
+        # Keys containing sequence indexes are practically unbounded.
+        # Therefore, the mapping is simply reset once it is full.
+        if len(self._key_fields) >= KEY_FIELD_CACHE_SIZE:
+            self._key_fields.clear()
+        self._key_fields[key] = field
+        return field
+
+    def intern(self, key, value):
+        """Retrieve the interned equivalent of ``value`` of the raw ``key``.
+
+        :param key: The raw key of the value
+        :param value: The decoded value to intern
+        """
+        field = self.get_field(key)
+        if field is None or not isinstance(value, basestring):
+            return value
+
+        table = self._tables.get(field)
+        if table is None:
+            table = self._tables[field] = {}
+
+        interned = table.get(value)
+        if interned is not None:
+            return interned
+        if len(table) < self.max_values:
+            table[value] = value
+        return value
+
+    def intern_values(self, key, values):
+        """Retrieve the list of interned ``values`` of the raw ``key`` as
+        retrieved via ``urlparse.parse_qs``.
+
+        :param key: The raw key of the values
+        :param values: The decoded values to intern
+        """
+        if not util.is_non_string_sequence(values):
+            return self.intern(key, values)
+        return [self.intern(key, v) for v in values]
+
+    def clear(self):
+        """Remove all interned values."""
+        self._tables.clear()
+        self._key_fields.clear()
+
+
+class KeyRegistry(object):
+    """Bounded registry of the keys and tokenized key paths shared
+    across decoded payloads.
+
+    :param max_keys: Maximum number of raw keys, across all conventions,
+                     and separately key components, to register. Once
+                     full, keys which have not been registered are
+                     tokenized as usual.
+    """
+    def __init__(self, max_keys=4096):
+        self.max_keys = max_keys
+        self._paths = {}
+        self._path_count = 0
+        self._components = {}
+
+    def __len__(self):
+        return self._path_count
+
+    def get_key(self, key):
+        """Retrieve the registered equivalent of the string ``key``.
+
+        :param key: The key, or key component, to retrieve
+        """
+        registered = self._components.get(key)
+        if registered is not None:
+            return registered
+        if len(self._components) < self.max_keys:
+            self._components[key] = key
+        return key
+
+    def get_path(self, key, convention=None):
+        """Retrieve the tokenized path of the raw ``key`` consisting
+        of registered key components.
+
+        :param key: The raw key to retrieve the path of
+        :param convention: The convention which ``key`` conforms to.
+                           See ``nvp.util.tokenize_key``.
+        """
+        paths = self._paths.get(convention)
+        if paths is None:
+            paths = self._paths[convention] = {}
+
+        path = paths.get(key)
+        if path is not None:
+            return path
+
+        get_key = self.get_key
+        path = tuple([c if util.is_int(c) else get_key(c)
+                      for c in util.tokenize_key(key, convention)])
+        if self._path_count < self.max_keys:
+            paths[key] = path
+            self._path_count += 1
+        return path
+
+    def clear(self):
+        """Remove all registered keys and paths."""
+        self._paths.clear()
+        self._path_count = 0
+        self._components.clear()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+NVP Message.
+
+A mutable, dictionary-like container intended for large requests which
+are encoded repeatedly with only a few of their fields being altered in
+between, e.g amounts and tokens across retries of a checkout flow::
+
+    >>> import nvp
+    >>> message = nvp.Message({'METHOD': 'DoCapture', 'AMT': '10.00'})
+    >>> message.dumps()
+    'METHOD=DoCapture&AMT=10.00'
+    >>> message['AMT'] = '12.00'
+    >>> message.dumps()
+    'METHOD=DoCapture&AMT=12.00'
+
+The encoded fragment of each top-level subtree is cached and only the
+subtrees which have been assigned or deleted since the previous encoding
+are re-encoded. Note that in-place modifications of nested values, e.g
+``message['L_ITEMS'][0]['AMT'] = '5.00'``, cannot be detected. In such
+cases :meth:`Message.touch` should be called with the top-level key.
+"""
+
+from collections import MutableMapping
+
+from nvp import util
+
+
+class Message(MutableMapping):
+    """Dictionary-like NVP message which caches the encoded fragment
+    of each top-level subtree.
+
+    :param data: Dictionary of initial key-values of the message
+    :param convention: The convention to utilize in encoding keys
+                       corresponding to non-string sequences, e.g lists.
+    :param key_filter: Function in which all keys should be filtered through.
+                       Allowing key conversion from lowercase to uppercase
+                       or vice versa for example.
+    :param value_filter: Function in which all values should be filtered
+                         through. In order to UTF-8 encode values for
+                         example.
+    """
+    def __init__(self,
+                 data=None,
+                 convention=util.DEFAULT_CONVENTION,
+                 key_filter=None,
+                 value_filter=None):
+        self.convention = convention
+        self.key_filter = key_filter
+        self.value_filter = value_filter
+        self._data = {}
+        self._fragments = {}
+        if data:
+            self.update(data)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._fragments.pop(key, None)
+
+    def __delitem__(self, key):
+        del self._data[key]
+        self._fragments.pop(key, None)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self._data)
+
+    def touch(self, key):
+        """Mark the subtree of the top-level ``key`` as modified. Required
+        after in-place modifications of nested values in the subtree.
+
+        :param key: The top-level key of the modified subtree
+        """
+        if key not in self._data:
+            raise KeyError(key)
+        self._fragments.pop(key, None)
+
+    def dumps(self):
+        """Encode the message into an NVP query string. Only the subtrees
+        modified since the previous encoding are encoded again.
+        """
+        fragments = []
+        for key, value in self._data.iteritems():
+            fragment = self._fragments.get(key)
+            if fragment is None:
+                fragment = self._fragments[key] = self._encode(key, value)
+
+            # Empty sequences do not result in any pairs at all
+            if fragment:
+                fragments.append(fragment)
+        return '&'.join(fragments)
+
+    def dump(self, fp):
+        """Encode the message into an NVP query string and write
+        it to the file-like object ``fp``.
+
+        :param fp: The file pointer in which the encoded value should be stored
+        """
+        fp.write(self.dumps())
+
+    def _encode(self, key, value):
+        """Encode the subtree of the top-level ``key`` into a fragment
+        of an NVP query string.
+
+        :param key: The top-level key of the subtree
+        :param value: The value of the subtree
+        """
+        pairs = util._convert_into_list({key: value}, self.convention,
+                                        key_filter=self.key_filter,
+                                        value_filter=self.value_filter)
+        return util.encode_pairs(pairs)
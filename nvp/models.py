@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+NVP Models.
+
+Payloads can be decoded directly into instances of slotted classes rather
+than into hierarchical dictionaries which would otherwise be copied into
+such classes. Models inherit from :class:`Model`, declare their attributes
+in ``__slots__`` and declare nested models in ``nvp_fields``. Where a list
+containing a single model class declares a sequence of the model::
+
+    >>> import nvp
+    >>> class Item(nvp.Model):
+    ...     __slots__ = ('NAME', 'AMT')
+    >>> class Order(nvp.Model):
+    ...     __slots__ = ('ACK', 'L')
+    ...     nvp_fields = {'L': [Item]}
+    >>> order = nvp.loads('ACK=Success&L_0_NAME=Foo&L_0_AMT=1.00',
+    ...                   into=Order)
+    >>> order.L[0].AMT
+    '1.00'
+
+Attributes are assigned directly from the flat pairs of the payload and
+no intermediate dictionaries are built. Attributes absent from the payload
+are ``None``. Keys which do not correspond to any attribute are ignored
+since services tend to add fields to their responses over time.
+
+Models are encoded by ``nvp.dumps`` in the same manner as dictionaries.
+Their attributes, except the ones which are ``None``, are read directly.
+"""
+
+from nvp import util
+
+
+class Model(object):
+    """Base class of slotted classes which NVP payloads are decoded into.
+    Instances behave as read-only dictionaries of their attributes in
+    order to be encoded as such.
+    """
+    __slots__ = ()
+
+    #: Mapping of attributes to the model class of their value or a list
+    #: containing the model class of the items in their sequence value.
+    nvp_fields = {}
+
+    def __getattr__(self, name):
+        # Only invoked for attributes which have not been assigned.
+        # Thus, instances are created without initializing all slots.
+        if name in _get_schema(type(self))[1]:
+            return None
+        raise AttributeError(name)
+
+    def __getitem__(self, key):
+        if key not in _get_schema(type(self))[1]:
+            raise KeyError(key)
+        value = getattr(self, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return dict(self.iteritems()) == dict(other.iteritems())
+
+    def __ne__(self, other):
+        ret = self.__eq__(other)
+        return ret if ret is NotImplemented else not ret
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join(
+            '%s=%r' % (k, v) for k, v in self.iteritems()))
+
+    def iteritems(self):
+        """Retrieve a generator of the attributes which have been assigned
+        along with their values.
+        """
+        for name in _get_schema(type(self))[0]:
+            value = getattr(self, name)
+            if value is not None:
+                yield (name, value)
+
+    def setdefault(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            setattr(self, key, default)
+            return default
+
+
+def decode_into(source, model, limits=None, registry=None, convention=None):
+    """Decode the single-level ``source`` dictionary, as retrieved via
+    ``urlparse.parse_qs``, into an instance of the ``model`` class.
+
+    :param source: The single-level dictionary to decode
+    :param model: The :class:`Model` class to decode into
+    :param limits: The ``Limits`` to enforce while parsing key paths
+    :param registry: The ``KeyRegistry`` from which the tokenized key
+                     paths are retrieved
+    :param convention: The convention which all keys conform to
+    """
+    ret = model.__new__(model)
+    paths = util.get_sorted_key_paths(source, limits=limits,
+                                      registry=registry,
+                                      convention=convention)
+    for path, key in paths:
+        _assign(ret, path, source[key], key)
+    return ret
+
+
+#: Cache of model classes mapped to their slots and declared fields
+_schemas = {}
+
+
+def _get_schema(model):
+    """Retrieve a tuple of the attributes of the ``model`` class in the
+    order of declaration, the same attributes as a frozenset and the
+    fields declared by the class.
+    """
+    try:
+        return _schemas[model]
+    except KeyError:
+        pass
+
+    names = []
+    for cls in reversed(model.__mro__):
+        slots = cls.__dict__.get('__slots__', ())
+        if util.is_string(slots):
+            slots = (slots, )
+        names.extend(name for name in slots
+                     if name not in ('__dict__', '__weakref__'))
+
+    schema = (tuple(names), frozenset(names), model.nvp_fields)
+    _schemas[model] = schema
+    return schema
+
+
+def _assign(obj, path, value, key):
+    """Assign ``value`` to the attribute of ``obj``, or of the model
+    nested in it, located at the tokenized ``path`` of the raw ``key``.
+    """
+    # Prior to being decoded values are contained in lists. Single-item
+    # lists are unwrapped in the same manner as hierarchical dictionaries.
+    if util.is_non_string_sequence(value) and len(value) == 1:
+        value = value[0]
+
+    target = obj
+    length = len(path)
+    i = 0
+    while i < length:
+        name = path[i]
+        _, names, fields = _get_schema(type(target))
+        if name not in names:
+            return
+        field = fields.get(name)
+        i += 1
+
+        if field is None:
+            if i == length:
+                setattr(target, name, value)
+            elif i == length - 1 and util.is_int(path[i]):
+                items = _get_sequence(target, name)
+                _set_item(items, path[i], value, key)
+            else:
+                raise _get_mismatch_error(key, target, name)
+            return
+
+        if util.is_non_string_sequence(field):
+            if i == length or not util.is_int(path[i]):
+                raise _get_mismatch_error(key, target, name)
+            items = _get_sequence(target, name)
+            index = path[i]
+            i += 1
+            if index == len(items):
+                item_model = field[0]
+                items.append(item_model.__new__(item_model))
+            elif index > len(items):
+                raise _get_index_error(key, index)
+            target = items[index]
+        else:
+            child = getattr(target, name)
+            if child is None:
+                child = field.__new__(field)
+                setattr(target, name, child)
+            target = child
+
+    # The path ended at a model rather than at one of its attributes
+    raise _get_mismatch_error(key, target, path[-1])
+
+
+def _get_sequence(target, name):
+    items = getattr(target, name)
+    if items is None:
+        items = []
+        setattr(target, name, items)
+    elif not isinstance(items, list):
+        raise ValueError('Attribute %s of %s is not a sequence' % (
+            name, type(target).__name__))
+    return items
+
+
+def _set_item(items, index, value, key):
+    if index == len(items):
+        items.append(value)
+    elif index < len(items):
+        items[index] = value
+    else:
+        raise _get_index_error(key, index)
+
+
+def _get_index_error(key, index):
+    message = 'Index %d of key %s is out of range of the sequence'
+    return ValueError(message % (index, key))
+
+
+def _get_mismatch_error(key, target, name):
+    message = 'Key %s does not match the declaration of %s.%s'
+    return ValueError(message % (key, type(target).__name__, name))
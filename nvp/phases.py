@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+NVP Phases.
+
+The phases which ``nvp.loads`` and ``nvp.dumps`` consist of. Each phase
+is given the output of the previous one along with the options of the
+API function which it applies. Decoding is thereby equivalent to::
+
+    >>> from nvp import phases
+    >>> query = phases.parse_query('L_AMT0=1&L_AMT1=2')
+    >>> params = phases.filter_query(query)
+    >>> phases.build_hierarchy(params)
+    {'L': {'AMT': ['1', '2']}}
+
+The phases are exposed in order for diagnostics, see ``nvp.diagnostics``,
+to measure them separately while applying the options in the very same
+manner as the API functions do.
+"""
+
+from urlparse import parse_qs
+
+from nvp import util
+from nvp import models
+
+
+###############################################################################
+# DECODING PHASES
+###############################################################################
+
+def parse_query(string,
+                keep_blank_values=False,
+                strict_parsing=False,
+                limits=None,
+                convention=None):
+    """Parse the encoded NVP ``string`` into a dictionary of the lists of
+    values of each key. See ``nvp.loads`` for the options.
+    """
+    util.check_payload_limits(string, limits)
+    if strict_parsing:
+        # Reject malformed payloads in a single pass prior to allocating
+        # anything in order to keep the error path cheap.
+        util.validate_payload(string, convention=convention)
+
+    query = parse_qs(string, keep_blank_values=keep_blank_values,
+                     strict_parsing=strict_parsing)
+    util.check_key_limits(query, limits)
+    return query
+
+
+def filter_query(query,
+                 key_filter=None,
+                 value_filter=None,
+                 batch_value_filter=None,
+                 interner=None):
+    """Filter the keys and values of the parsed ``query`` into a
+    single-level dictionary. See ``nvp.loads`` for the options.
+    """
+    ret = dict(util.get_filtered_pairs(
+        query, key_filter=key_filter, value_filter=value_filter,
+        batch_value_filter=batch_value_filter,
+    ))
+
+    if interner is not None:
+        for k, v in ret.items():
+            ret[k] = interner.intern_values(k, v)
+    return ret
+
+
+def build_hierarchy(params,
+                    get_hierarchical=True,
+                    limits=None,
+                    registry=None,
+                    convention=None,
+                    into=None):
+    """Build the decoded value of the single-level dictionary ``params``.
+    See ``nvp.loads`` for the options.
+    """
+    if into is not None:
+        return models.decode_into(params, into, limits=limits,
+                                  registry=registry, convention=convention)
+    if get_hierarchical:
+        return util.get_hierarchical_dict(params, limits=limits,
+                                          registry=registry,
+                                          convention=convention)
+    if registry is not None:
+        return dict((registry.get_key(k), v) for k, v in params.iteritems())
+    return params
+
+
+###############################################################################
+# ENCODING PHASES
+###############################################################################
+
+def get_pairs(obj,
+              convention=util.DEFAULT_CONVENTION,
+              key_filter=None,
+              value_filter=None,
+              batch_value_filter=None):
+    """Retrieve the list of the NVP pairs of ``obj``. See ``nvp.dumps``
+    for the options.
+    """
+    return util.get_hierarchical_pairs(
+        obj, convention=convention,
+        key_filter=key_filter, value_filter=value_filter,
+        batch_value_filter=batch_value_filter,
+    )
+
+
+def encode_query(pairs, as_bytes=False):
+    """Encode the NVP ``pairs`` into a query string. See ``nvp.dumps``
+    for the options.
+    """
+    ret = util.encode_pairs(pairs)
+
+    # The quoted pairs consist of ASCII characters only. Thus, the query
+    # string is usually a byte string already and retrieved without a copy.
+    if as_bytes and not isinstance(ret, bytes):
+        ret = ret.encode('ascii')
+    return ret
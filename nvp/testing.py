@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+NVP Testing.
+
+A local stand-in for the NVP API of a partner. :class:`StubServer`
+decodes each request via ``nvp.loads`` and responds with a configurable
+payload encoded via ``nvp.dumps`` after a configurable latency::
+
+    >>> import nvp.testing
+    >>> with nvp.testing.StubServer({'ACK': 'Success'}) as server:
+    ...     executor = nvp.client.BatchExecutor(server.url)
+    ...     [r.response for r in executor.run([{'METHOD': 'GetBalance'}])]
+    [{'ACK': 'Success'}]
+
+The module can be executed in order to load test an NVP integration end
+to end on a single machine. Calls are made at the target rate against
+either a stub server started in the same process or the given URL::
+
+    python -m nvp.testing --rate 500 --duration 10 --payload request.json
+    python -m nvp.testing --rate 500 --url http://127.0.0.1:8080/nvp
+
+Requests per second, latency percentiles and the share of the latency
+spent encoding and decoding on the client, and on the stub server, are
+reported once completed.
+"""
+
+import json
+import time
+import argparse
+import threading
+import SocketServer
+import BaseHTTPServer
+
+import nvp
+import nvp.client
+from nvp import util
+
+#: Payload of the calls made by the load generator unless one is given
+DEFAULT_PAYLOAD = {
+    'METHOD': 'GetTransactionDetails',
+    'TRANSACTIONID': '0123456789ABCDEFG',
+    'L': [{'NAME': 'Item %d' % i, 'AMT': '%d.00' % i} for i in xrange(10)],
+}
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Local HTTP server responding to NVP calls.
+
+    :param response: The dictionary to respond with or a function given
+                     the decoded request retrieving either the dictionary
+                     or a tuple of the status and dictionary to respond
+                     with. By default the request is echoed along with
+                     ``ACK=Success``.
+    :param latency: The number of seconds to wait prior to responding or
+                    a function given the decoded request retrieving it
+    :param host: The host to bind to
+    :param port: The port to bind to. By default an available one.
+    :param convention: The convention to encode the responses with
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self,
+                 response=None,
+                 latency=0.0,
+                 host='127.0.0.1',
+                 port=0,
+                 convention=util.DEFAULT_CONVENTION):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), _StubHandler)
+        self.response = response
+        self.latency = latency
+        self.convention = convention
+        self.url = 'http://%s:%d/nvp' % self.server_address[:2]
+        self.stats = {
+            'requests': 0,
+            'connections': 0,
+            'decode_time': 0.0,
+            'encode_time': 0.0,
+        }
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """Serve requests in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving requests and close the socket of the server."""
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def respond(self, request):
+        """Retrieve a tuple of the status and dictionary to respond to
+        the decoded ``request`` with.
+
+        :param request: The decoded request
+        """
+        response = self.response
+        if response is None:
+            response = dict(request, ACK='Success')
+        elif callable(response):
+            response = response(request)
+
+        if isinstance(response, tuple):
+            return response
+        return (200, response)
+
+    def record(self, **stats):
+        """Add ``stats`` to the statistics of the server."""
+        with self._lock:
+            for k, v in stats.iteritems():
+                self.stats[k] += v
+
+
+class _StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.record(connections=1)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        started_at = time.time()
+        request = nvp.loads(body)
+        decode_time = time.time() - started_at
+
+        latency = server.latency
+        if callable(latency):
+            latency = latency(request)
+        if latency:
+            time.sleep(latency)
+
+        status, response = server.respond(request)
+        started_at = time.time()
+        data = nvp.dumps(response, convention=server.convention)
+        server.record(requests=1, decode_time=decode_time,
+                      encode_time=time.time() - started_at)
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/x-www-form-urlencoded')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def run_load(url, payload, rate, duration, concurrency=8):
+    """Call ``url`` with ``payload`` at ``rate`` calls per second during
+    ``duration`` seconds and retrieve the statistics of the calls. See
+    ``nvp.client.get_stats``.
+
+    :param url: The URL of the NVP API to call
+    :param payload: The dictionary to encode as the body of each call
+    :param rate: The number of calls per second to make
+    :param duration: The number of seconds to make calls during
+    :param concurrency: Maximum number of calls in flight at once
+    """
+    executor = nvp.client.BatchExecutor(url, max_concurrency=concurrency,
+                                        retries=0, rate=rate)
+    executor.run([payload] * max(1, int(rate * duration)))
+    return executor.stats
+
+
+def format_server_stats(stats):
+    """Format the ``stats`` of a :class:`StubServer` as text.
+
+    :param stats: The statistics of the server
+    """
+    requests = stats['requests'] or 1
+    return ('server: %d requests over %d connections, '
+            'decode %.3f ms, encode %.3f ms per request' % (
+                stats['requests'], stats['connections'],
+                stats['decode_time'] * 1000 / requests,
+                stats['encode_time'] * 1000 / requests))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m nvp.testing',
+        description='Load test an NVP API, or a local stub server of one.')
+    parser.add_argument('--url', default=None,
+                        help='URL to call rather than a local stub server')
+    parser.add_argument('--rate', type=float, default=100.0,
+                        help='Number of calls per second')
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help='Number of seconds to make calls during')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='Maximum number of calls in flight at once')
+    parser.add_argument('--payload', default=None,
+                        help='JSON file of the payload of each call')
+    parser.add_argument('--response', default=None,
+                        help='JSON file of the payload the stub responds with')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds the stub server waits prior to responding')
+    args = parser.parse_args(argv)
+
+    payload = DEFAULT_PAYLOAD
+    if args.payload:
+        with open(args.payload) as f:
+            payload = json.load(f)
+
+    if args.url:
+        stats = run_load(args.url, payload, args.rate, args.duration,
+                         concurrency=args.concurrency)
+        print nvp.client.format_stats(stats)
+        return
+
+    response = None
+    if args.response:
+        with open(args.response) as f:
+            response = json.load(f)
+
+    with StubServer(response, latency=args.latency) as server:
+        stats = run_load(server.url, payload, args.rate, args.duration,
+                         concurrency=args.concurrency)
+    print nvp.client.format_stats(stats)
+    print format_server_stats(server.stats)
+
+if __name__ == '__main__':
+    main()
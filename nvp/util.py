@@ -8,6 +8,14 @@ NVP module is primarily intended to define the API.
 
 """
 
+import os
+import re
+import json
+import itertools
+
+from timeit import default_timer
+from urllib import quote_plus, unquote
+
 
 #: Type identifier corresponding to keys of type somekey[0]
 CONVENTION_BRACKET = 'bracket'
@@ -37,6 +45,347 @@ KEY_HIERARCHY_SEPARATOR = '.'
 #: following structure: ``dict['foo']['bar']``
 KEY_UNDERSCORE_HIERARCHY_SEPARATOR = '_'
 
+#: The characters which separate key-value pairs in an NVP query string
+PAIR_SEPARATORS = ('&', ';')
+
+#: Regular expression matching the separators of key-value pairs
+_PAIR_SEPARATOR_RE = re.compile(r'[&;]')
+
+#: Number of bytes read at a time by decoders of file-like objects
+DECODE_CHUNK_SIZE = 65536
+
+#: Number of JSON fragments buffered prior to writing them
+JSON_WRITE_FRAGMENTS = 1024
+
+#: The characters which may constitute a sequence index in a key
+INDEX_DIGITS = '0123456789'
+
+#: Regular expressions matching a key component along with its trailing
+#: sequence indexes in the bracket and parentheses conventions respectively,
+#: e.g ``foo[0][1]`` or ``foo(0)(1)``.
+_GROUP_KEY_COMPONENT_RES = {
+    CONVENTION_BRACKET: re.compile(r'(.*?)((?:\[\d+\])+)$', re.S),
+    CONVENTION_PARENTHESES: re.compile(r'(.*?)((?:\(\d+\))+)$', re.S),
+}
+
+#: Regular expression matching each sequence index in a group of indexes
+_INDEX_RE = re.compile(r'\d+')
+
+#: Characters identifying the beginning and the end of sequence indexes
+#: in the bracket and parentheses conventions respectively
+_GROUP_KEY_IDENTIFIERS = {
+    CONVENTION_BRACKET: ('[', ']'),
+    CONVENTION_PARENTHESES: ('(', ')'),
+}
+
+#: Number of keys sampled in order to detect the convention of a payload
+PAYLOAD_CONVENTION_SAMPLE_SIZE = 16
+
+
+def _compile_fast_key_re(convention, strict):
+    """Compile the regular expression matching keys of ``convention``
+    which the fast group key tokenizer retrieves the same path of as
+    either the tokenizer of ``convention`` - in case of ``strict`` - or
+    the tokenizer detecting the convention of each key component.
+
+    Names are limited to printable ASCII characters and are never digits
+    only. In case of detection, names lacking an index cannot end with a
+    digit either since those are considered indexes of the underscore
+    convention. Neither can keys contain underscores.
+    """
+    open_identifier, close_identifier = _GROUP_KEY_IDENTIFIERS[convention]
+    excluded = '.[]()_'
+    if strict:
+        excluded = KEY_HIERARCHY_SEPARATOR + open_identifier + close_identifier
+    characters = ''.join(re.escape(chr(c)) for c in xrange(0x20, 0x7f)
+                         if chr(c) not in excluded and not chr(c).isdigit())
+    name = '[%s0-9]*[%s]' % (characters, characters)
+    indexes = '(?:%s\d+%s)' % (re.escape(open_identifier),
+                                re.escape(close_identifier))
+    if strict:
+        component = '(?:%s[%s0-9]*)?%s*' % (name, characters, indexes)
+    else:
+        component = '(?:(?:%s[%s0-9]*)?%s+|(?:%s)?)' % (
+            name, characters, indexes, name)
+    return re.compile('%s(?:\.%s)*\Z' % (component, component))
+
+
+#: Regular expressions matching the keys which the fast group key tokenizer
+#: applies to. Keyed by convention and whether the convention is given.
+_FAST_KEY_RES = dict(
+    ((convention, strict), _compile_fast_key_re(convention, strict))
+    for convention in _GROUP_KEY_IDENTIFIERS
+    for strict in (True, False)
+)
+
+#: Regular expression matching strings which ``urllib.quote_plus``
+#: would leave untouched, i.e strings which require no quoting at all.
+_SAFE_STRING_RE = re.compile(r'[A-Za-z0-9_.\-]*\Z')
+
+#: Characters which ``urllib.quote_plus`` retains as a single character,
+#: i.e the characters of safe strings along with spaces quoted as ``+``.
+_SINGLE_QUOTED_CHARACTERS = (
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_.- '
+)
+
+#: Maximum number of quoted keys to retain in the encoder key cache
+QUOTED_KEY_CACHE_SIZE = 4096
+
+#: Cache of keys mapped to their quoted value
+_quoted_keys = {}
+
+#: Number of pairs encoded into each chunk written by streaming encoders
+ENCODE_CHUNK_PAIRS = 512
+
+#: Number of formatted sequence index suffixes, e.g ``[12]``, to cache
+INDEX_SUFFIX_CACHE_SIZE = 1024
+
+#: Cache of conventions mapped to their formatted index suffixes
+_index_suffixes = {}
+
+
+###############################################################################
+# RESOURCE LIMITS
+###############################################################################
+
+class LimitExceededError(ValueError):
+    """Raised in case an NVP payload exceeds one of the :class:`Limits`
+    configured for the decoding of it.
+
+    :param name: The name of the exceeded limit, e.g ``max_depth``
+    :param value: The value which exceeded the limit
+    :param maximum: The configured maximum value of the limit
+    :param key: The key being processed when the limit was exceeded
+    """
+    def __init__(self, name, value, maximum, key=None):
+        self.name = name
+        self.value = value
+        self.maximum = maximum
+        self.key = key
+
+        message = 'NVP limit %s exceeded: %s > %s' % (name, value, maximum)
+        if key is not None:
+            # Keys are untrusted input and might be huge. Therefore, only
+            # include a prefix of them in the message.
+            message = '%s for key: %r' % (message, key[:64])
+        ValueError.__init__(self, message)
+
+
+class Limits(object):
+    """Resource limits to enforce while decoding untrusted NVP payloads.
+
+    Each limit defaults to ``None`` which disables it. The limits are
+    checked as early as possible in the decoding procedure, i.e the size
+    of the payload prior to parsing it and the depth and indexes of a key
+    as soon as its path has been tokenized.
+
+        >>> import nvp
+        >>> limits = nvp.Limits(max_depth=8, max_index=100)
+        >>> nvp.loads('L_AMT1000=1', limits=limits)
+        Traceback (most recent call last):
+            ...
+        LimitExceededError: NVP limit max_index exceeded: 1000 > 100 for key: 'L_AMT1000'
+
+    :param max_pairs: Maximum number of key-value pairs in the payload
+    :param max_bytes: Maximum length of the payload
+    :param max_key_length: Maximum length of each individual key
+    :param max_depth: Maximum number of components in a key path,
+                      e.g ``foo.bar[0]`` consists of three components
+    :param max_index: Maximum sequence index in a key path
+    """
+    def __init__(self,
+                 max_pairs=None,
+                 max_bytes=None,
+                 max_key_length=None,
+                 max_depth=None,
+                 max_index=None):
+        self.max_pairs = max_pairs
+        self.max_bytes = max_bytes
+        self.max_key_length = max_key_length
+        self.max_depth = max_depth
+        self.max_index = max_index
+
+    def check(self, name, value, key=None):
+        """Ensure ``value`` does not exceed the limit of given ``name``.
+
+        :param name: The name of the limit to check against
+        :param value: The value to check
+        :param key: The key which ``value`` was retrieved from, if any
+        """
+        maximum = getattr(self, name)
+        if maximum is not None and value > maximum:
+            raise LimitExceededError(name, value, maximum, key=key)
+
+
+def check_payload_limits(string, limits):
+    """Ensure the encoded NVP ``string`` does not exceed the size related
+    ``limits``. Intended to be executed prior to parsing the string.
+
+    :param string: The encoded NVP string to check
+    :param limits: The :class:`Limits` to enforce or ``None``
+    """
+    if limits is None:
+        return
+
+    limits.check('max_bytes', len(string))
+    if limits.max_pairs is not None:
+        # Counting the separators is an upper bound of the number of
+        # pairs which is cheap enough to compute prior to parsing.
+        separators = sum(string.count(s) for s in PAIR_SEPARATORS)
+        limits.check('max_pairs', separators + 1)
+
+
+def check_key_limits(source, limits):
+    """Ensure none of the keys in the ``source`` dictionary exceeds
+    the key related ``limits``.
+
+    :param source: The single-level dictionary retrieved via ``parse_qs``
+    :param limits: The :class:`Limits` to enforce or ``None``
+    """
+    if limits is None or limits.max_key_length is None:
+        return
+
+    for key in source:
+        limits.check('max_key_length', len(key), key=key)
+
+
+def check_key_path_limits(key, path, limits):
+    """Ensure the tokenized ``path`` of ``key`` does not exceed the
+    depth and index related ``limits``.
+
+    :param key: The raw key which ``path`` was tokenized from
+    :param path: The key path as retrieved via :func:`tokenize_key`
+    :param limits: The :class:`Limits` to enforce or ``None``
+    """
+    if limits is None:
+        return
+
+    limits.check('max_depth', len(path), key=key)
+    if limits.max_index is not None:
+        for component in path:
+            if is_int(component):
+                limits.check('max_index', component, key=key)
+
+
+###############################################################################
+# STRICT PARSING
+###############################################################################
+
+#: Regular expression matching percent signs not followed by two hex digits
+_BAD_ESCAPE_RE = re.compile(r'%(?![0-9A-Fa-f]{2})')
+
+#: Regular expression matching a valid dot-separated component of a key
+#: which contains sequence indexes, e.g ``foo[0][1]`` or ``foo(0)``.
+_STRICT_KEY_COMPONENT_RE = re.compile(
+    r'[^.\[\]()]+(?:(?:\[\d+\])+|(?:\(\d+\))+)?\Z'
+)
+
+
+class ParseError(ValueError):
+    """Raised in case strict parsing of an NVP payload is requested
+    and the payload is malformed.
+
+    :param reason: Description of what is malformed
+    :param offset: The byte offset in the payload at which the malformed
+                   pair - or escape sequence - begins. Unicode payloads
+                   are measured in their UTF-8 encoded form.
+    :param key: The key of the malformed pair, if any
+    """
+    def __init__(self, reason, offset, key=None):
+        self.reason = reason
+        self.offset = offset
+        self.key = key
+
+        message = 'Malformed NVP payload at offset %d: %s' % (offset, reason)
+        if key is not None:
+            message = '%s for key: %r' % (message, key[:64])
+        ValueError.__init__(self, message)
+
+
+def validate_payload(string, convention=None):
+    """Validate the encoded NVP ``string`` in a single pass. Intended to
+    be executed prior to decoding the string in strict parsing mode.
+    Raises :class:`ParseError` on the first malformed pair, i.e a pair
+    lacking a ``=`` or a key, a bad percent escape, inconsistent index
+    syntax in a key, a key path occurring more than once or a key path
+    which is both assigned a value and nested keys. The key paths seen,
+    along with their prefixes, are retained in order to detect the latter.
+
+        >>> import nvp.util
+        >>> nvp.util.validate_payload('L_AMT0=10.00&L_AMT0=5.00')
+        Traceback (most recent call last):
+            ...
+        ParseError: Malformed NVP payload at offset 13: duplicate key path for key: 'L_AMT0'
+
+    :param string: The encoded NVP string to validate
+    :param convention: The convention which all keys conform to. Key paths
+                       are tokenized with it in the same manner as by
+                       ``loads``. Otherwise, it is detected for each key.
+    """
+    paths = set()
+    prefixes = set()
+    offset = 0
+    for field in _PAIR_SEPARATOR_RE.split(string):
+        _check_strict_field(field, offset, paths, prefixes, convention)
+        offset += _get_byte_length(field) + 1
+
+
+def _check_strict_field(field, offset, paths, prefixes, convention=None):
+    """Ensure the raw ``field`` located at the byte ``offset`` is a
+    well-formed NVP pair whose key path, as tokenized given ``convention``,
+    is neither in the set of ``paths`` already seen nor in the set of
+    their ``prefixes``, and vice versa. Retrieves a tuple of the unquoted
+    key along with the raw value.
+    """
+    if not field:
+        raise ParseError('empty pair', offset)
+
+    k, separator, v = field.partition('=')
+    if not separator:
+        raise ParseError("missing '=' separator", offset, key=field)
+    if not k:
+        raise ParseError('missing key', offset)
+
+    key = unquote(k.replace('+', ' '))
+    match = _BAD_ESCAPE_RE.search(field)
+    if match is not None:
+        offset += _get_byte_length(field[:match.start()])
+        raise ParseError('bad percent escape', offset, key=key)
+
+    # Keys without any sequence indexes in brackets or parentheses are
+    # either of the underscore convention or plain dotted names.
+    if '[' in key or ']' in key or '(' in key or ')' in key:
+        components = key.split(KEY_HIERARCHY_SEPARATOR)
+        if not all(_STRICT_KEY_COMPONENT_RE.match(c) for c in components):
+            raise ParseError('bad index syntax', offset, key=key)
+        if '[' in key and '(' in key:
+            raise ParseError('inconsistent index syntax', offset, key=key)
+
+    path = tokenize_key(key, convention)
+    if path in paths:
+        raise ParseError('duplicate key path', offset, key=key)
+
+    # A trailing index out of range is retained as a part of the key when
+    # decoded, e.g SHIPTOSTREET2 alongside SHIPTOSTREET. Thus, only the
+    # prefixes of paths ending in an index of zero include the last key.
+    end = len(path) - 1
+    if end and is_int(path[-1]) and path[-1]:
+        end -= 1
+    path_prefixes = [path[:i] for i in xrange(1, end + 1)]
+    if path in prefixes or any(p in paths for p in path_prefixes):
+        raise ParseError('key path assigned both a value and nested keys',
+                         offset, key=key)
+    paths.add(path)
+    prefixes.update(path_prefixes)
+    return (key, v)
+
+
+def _get_byte_length(string):
+    """Retrieve the number of bytes of ``string`` once UTF-8 encoded."""
+    if isinstance(string, unicode):
+        return len(string.encode('utf-8'))
+    return len(string)
+
 
 ###############################################################################
 # TYPE HELPERS - MOSTLY DUCK TYPING SHORTCUTS
@@ -96,7 +445,8 @@ def sequence_has_index(sequence, index):
 def get_hierarchical_pairs(source,
                            convention=DEFAULT_CONVENTION,
                            key_filter=None,
-                           value_filter=None):
+                           value_filter=None,
+                           batch_value_filter=None):
     """Retrieve a list of tuples where the first item is the hierarchical
     key and the second its corresponding value.
 
@@ -112,17 +462,291 @@ def get_hierarchical_pairs(source,
     :param value_filter: Function in which all values should be filtered
                          through. In order to UTF-8 encode values for
                          example.
+    :param batch_value_filter: Function given the list of all values at
+                               once, or a dictionary of such functions
+                               per field. See :func:`filter_value_batch`.
     """
     if not is_dict(source):
         message = 'Cannot generate NVP pairs for non-dict object: %s'
         raise ValueError(message % source)
 
-    return _convert_into_list(
+    pairs = _convert_into_list(
         source, convention, key_filter=key_filter, value_filter=value_filter,
     )
+    if batch_value_filter is None:
+        return pairs
+
+    keys = [k for k, _ in pairs]
+    values = filter_value_batch(keys, [v for _, v in pairs],
+                                batch_value_filter)
+    return zip(keys, values)
+
+
+def iter_hierarchical_pairs(source,
+                            convention=DEFAULT_CONVENTION,
+                            key_filter=None,
+                            value_filter=None,
+                            batch_value_filter=None,
+                            batch_pairs=ENCODE_CHUNK_PAIRS):
+    """Retrieve a generator of the same tuples as the ones retrieved via
+    :func:`get_hierarchical_pairs`. Sequence values may be generators or
+    any other iterable which are consumed once, lazily, as the pairs
+    are generated.
 
+    :param source: The dictionary to convert into NVP pairs
+    :param convention: The convention to utilize in encoding keys
+                       corresponding to non-string sequences, e.g lists.
+    :param key_filter: Function in which all keys should be filtered through.
+                       Allowing key conversion from lowercase to uppercase
+                       or vice versa for example.
+    :param value_filter: Function in which all values should be filtered
+                         through. In order to UTF-8 encode values for
+                         example.
+    :param batch_value_filter: Function given the values of ``batch_pairs``
+                               pairs at a time, or a dictionary of such
+                               functions per field. See
+                               :func:`filter_value_batch`.
+    :param batch_pairs: The number of pairs given ``batch_value_filter``
+                        at a time.
+    """
+    if not is_dict(source):
+        message = 'Cannot generate NVP pairs for non-dict object: %s'
+        raise ValueError(message % source)
 
-def get_filtered_pairs(source, key_filter=None, value_filter=None):
+    pairs = _iter_hierarchical_pairs(
+        source, convention, key_filter=key_filter, value_filter=value_filter,
+    )
+    if batch_value_filter is None:
+        return pairs
+    return _iter_batch_filtered_pairs(pairs, batch_value_filter, batch_pairs)
+
+
+def encode_pairs(pairs):
+    """Encode given key-value ``pairs`` into an NVP query string.
+
+    The output is identical to the one of ``urllib.urlencode``. However,
+    quoted keys are cached since they tend to originate from a small
+    vocabulary and values which need no quoting are retained as they are.
+
+    :param pairs: Iterable of key-value tuples to encode
+    """
+    quote_key = _quote_key
+    quote_value = _quote_string
+    return '&'.join([quote_key(k) + '=' + quote_value(v) for k, v in pairs])
+
+
+def get_encoded_size(pairs):
+    """Retrieve the length of the NVP query string which the key-value
+    ``pairs`` are encoded into by :func:`encode_pairs` without encoding
+    the values nor joining the pairs.
+
+    :param pairs: Iterable of key-value tuples to measure
+    """
+    quote_key = _quote_key
+    quoted_length = _get_quoted_length
+    size = 0
+    count = 0
+    for k, v in pairs:
+        size += len(quote_key(k)) + 1 + quoted_length(v)
+        count += 1
+
+    # The pairs are joined by a single separator each
+    if count:
+        size += count - 1
+    return size
+
+
+def get_hierarchical_encoded_size(source,
+                                  convention=DEFAULT_CONVENTION,
+                                  value_filter=None):
+    """Retrieve the length of the NVP query string which the ``source``
+    dictionary is encoded into. The dictionary is walked and the quoted
+    lengths of its keys and values are summed. Neither the pairs nor
+    their keys are generated.
+
+    :param source: The dictionary to measure the encoded size of
+    :param convention: The convention to utilize in encoding keys
+                       corresponding to non-string sequences, e.g lists.
+    :param value_filter: Function in which all values should be filtered
+                         through.
+    """
+    if not is_dict(source):
+        message = 'Cannot generate NVP pairs for non-dict object: %s'
+        raise ValueError(message % source)
+
+    if convention not in CONVENTIONS:
+        message = 'Given convention is not one of the accepted values: %s'
+        raise ValueError(message % CONVENTIONS)
+
+    size, count = _get_hierarchical_encoded_size(source, convention,
+                                                 value_filter, 0, None)
+    # The pairs are joined by a single separator each
+    return size + count - 1 if count else 0
+
+
+def iter_split_payloads(source,
+                        split_key,
+                        convention=DEFAULT_CONVENTION,
+                        max_items=None,
+                        max_bytes=None,
+                        shared_keys=None,
+                        key_filter=None,
+                        value_filter=None,
+                        batch_value_filter=None):
+    """Retrieve a generator of NVP query strings which the items of the
+    sequence ``source[split_key]`` are split among. The items of each
+    query string are indexed from zero and the shared keys of ``source``
+    are repeated in each of them.
+
+    Each item is encoded once, at its index in the query string it is
+    added to, unless it has to be moved into the next one due to
+    ``max_bytes``. The sequence is consumed as the query strings are.
+
+    :param source: The dictionary to encode
+    :param split_key: The top-level key of the sequence to split
+    :param convention: The convention to utilize in encoding keys
+                       corresponding to non-string sequences, e.g lists.
+    :param max_items: Maximum number of items in each query string
+    :param max_bytes: Maximum length of each query string
+    :param shared_keys: The top-level keys to repeat in each query string.
+                        Other keys are encoded in the first one only. By
+                        default all keys are shared.
+    :param key_filter: Function in which all keys should be filtered through.
+    :param value_filter: Function in which all values should be filtered
+                         through.
+    :param batch_value_filter: Function given the values of each item, and
+                               of the other keys, at once rather than one
+                               value per call, or a dictionary of such
+                               functions per field. The values of the pairs
+                               of an item are given in batches of
+                               ``ENCODE_CHUNK_PAIRS`` pairs.
+                               See :func:`filter_value_batch`.
+    """
+    if not is_dict(source):
+        message = 'Cannot generate NVP pairs for non-dict object: %s'
+        raise ValueError(message % source)
+
+    if max_items is not None and max_items < 1:
+        raise ValueError('Cannot split into less than one item per payload')
+
+    items = source.get(split_key, ())
+    if is_dict(items) or not is_non_string_sequence(items):
+        message = 'Cannot split the non-sequence value of %s: %s'
+        raise ValueError(message % (split_key, items))
+
+    shared = {}
+    exclusive = {}
+    for k, v in source.iteritems():
+        if k == split_key:
+            continue
+        if shared_keys is None or k in shared_keys:
+            shared[k] = v
+        else:
+            exclusive[k] = v
+
+    def encode(obj, keys=None):
+        pairs = _iter_hierarchical_pairs(
+            obj, convention, key_filter=key_filter,
+            value_filter=value_filter, keys=keys,
+        )
+        if batch_value_filter is not None:
+            pairs = _iter_batch_filtered_pairs(pairs, batch_value_filter,
+                                               ENCODE_CHUNK_PAIRS)
+        return encode_pairs(pairs)
+
+    def encode_item(item, index):
+        component = generate_key_component(split_key, index,
+                                           convention=convention)
+        return encode(item, keys=[component])
+
+    header = [f for f in [encode(shared)] if f]
+    fragments = header + [f for f in [encode(exclusive)] if f]
+    size = len('&'.join(fragments))
+    count = 0
+    for position, item in enumerate(items):
+        if max_items is not None and count >= max_items:
+            yield '&'.join(fragments)
+            fragments = header[:]
+            size = len('&'.join(fragments))
+            count = 0
+
+        fragment = encode_item(item, count)
+        if (max_bytes is not None and
+            size + bool(fragments) + len(fragment) > max_bytes):
+            # Move the item into the next query string in case the
+            # current one contains anything but the shared keys.
+            if len(fragments) > len(header):
+                yield '&'.join(fragments)
+                fragments = header[:]
+                size = len('&'.join(fragments))
+                count = 0
+                fragment = encode_item(item, count)
+
+            if size + bool(fragments) + len(fragment) > max_bytes:
+                message = 'Item %d of %s cannot be encoded within %d bytes'
+                raise ValueError(message % (position, split_key, max_bytes))
+
+        # Empty items do not result in any pairs at all
+        if fragment:
+            size += bool(fragments) + len(fragment)
+            fragments.append(fragment)
+        count += 1
+
+    yield '&'.join(fragments)
+
+
+def iter_encoded_chunks(pairs, chunk_pairs=ENCODE_CHUNK_PAIRS):
+    """Encode given key-value ``pairs`` into chunks of an NVP query
+    string. Joining the chunks results in the same string as the one
+    retrieved via :func:`encode_pairs`. However, only ``chunk_pairs``
+    pairs are retained in memory at any given time.
+
+    :param pairs: Iterable of key-value tuples to encode
+    :param chunk_pairs: The number of pairs to encode into each chunk
+    """
+    quote_key = _quote_key
+    quote_value = _quote_string
+    chunk = []
+    prefix = ''
+    for k, v in pairs:
+        chunk.append(quote_key(k) + '=' + quote_value(v))
+        if len(chunk) >= chunk_pairs:
+            yield prefix + '&'.join(chunk)
+            prefix = '&'
+            chunk = []
+
+    if chunk:
+        yield prefix + '&'.join(chunk)
+
+
+def write_chunks(destination, chunks):
+    """Write the encoded ``chunks`` to ``destination`` one at a time
+    without joining them into a single string in between.
+
+    :param destination: Either a file descriptor, a socket or a file-like
+                        object supporting ``writelines`` or ``write``
+    :param chunks: Iterable of the encoded chunks to write
+    """
+    if is_int(destination):
+        for chunk in chunks:
+            # Writes to file descriptors, e.g pipes, might be partial
+            written = 0
+            while written < len(chunk):
+                written += os.write(destination, buffer(chunk, written))
+    elif hasattr(destination, 'sendall'):
+        for chunk in chunks:
+            destination.sendall(chunk)
+    elif hasattr(destination, 'writelines'):
+        destination.writelines(chunks)
+    else:
+        for chunk in chunks:
+            destination.write(chunk)
+
+
+def get_filtered_pairs(source,
+                       key_filter=None,
+                       value_filter=None,
+                       batch_value_filter=None):
     """Retrieve key-value pairs in given ``source`` dict and filter
     all keys via ``key_filter`` and values via ``value_filter``.
 
@@ -133,8 +757,12 @@ def get_filtered_pairs(source, key_filter=None, value_filter=None):
     :param value_filter: Function in which all values should be filtered
                          through. In order to UTF-8 encode values for
                          example.
+    :param batch_value_filter: Function given the list of all values at
+                               once, or a dictionary of such functions
+                               per field. Applied after ``value_filter``.
+                               See :func:`filter_value_batch`.
     """
-    if not (key_filter or value_filter):
+    if not (key_filter or value_filter or batch_value_filter):
         return source
 
     # Ensure callable filters exists prior to execution
@@ -149,25 +777,378 @@ def get_filtered_pairs(source, key_filter=None, value_filter=None):
         if not is_non_string_sequence(values):
             return value_filter(values)
         return [value_filter(v) for v in values]
-    return [(key_filter(k), filter_values(v)) for k, v in source.iteritems()]
+    pairs = [(key_filter(k), filter_values(v)) for k, v in source.iteritems()]
+    if batch_value_filter is None:
+        return pairs
+
+    # Flatten the values of all the pairs into a single batch and
+    # distribute the filtered values among the pairs afterwards.
+    keys = []
+    values = []
+    for k, v in pairs:
+        if is_non_string_sequence(v):
+            keys.extend([k] * len(v))
+            values.extend(v)
+        else:
+            keys.append(k)
+            values.append(v)
+    values = filter_value_batch(keys, values, batch_value_filter)
+
+    ret = []
+    offset = 0
+    for k, v in pairs:
+        if is_non_string_sequence(v):
+            ret.append((k, values[offset:offset + len(v)]))
+            offset += len(v)
+        else:
+            ret.append((k, values[offset]))
+            offset += 1
+    return ret
+
+
+def filter_value_batch(keys, values, batch_value_filter):
+    """Filter all ``values`` through ``batch_value_filter`` in a single
+    call rather than one call per value. Allowing vectorized conversions,
+    e.g ``lambda values: numpy.array(values, dtype=float)``.
+
+    In case ``batch_value_filter`` is a dictionary it is expected to map
+    fields, i.e the last name in the path of a key, to such functions.
+    Each function is then given the values of its field only. The values
+    of fields without a function are retained as they are.
+
+    :param keys: The raw key of each value
+    :param values: The list of values to filter
+    :param batch_value_filter: Function, or dictionary of functions,
+                               retrieving a sequence of filtered values
+                               of the same length as the one given.
+    """
+    if not is_dict(batch_value_filter):
+        return _call_batch_value_filter(batch_value_filter, values)
+
+    groups = {}
+    for i, k in enumerate(keys):
+        field = get_key_field(k)
+        if field in batch_value_filter:
+            groups.setdefault(field, []).append(i)
+
+    if not groups:
+        return values
+
+    values = list(values)
+    for field, indexes in groups.iteritems():
+        filtered = _call_batch_value_filter(batch_value_filter[field],
+                                            [values[i] for i in indexes])
+        for i, v in itertools.izip(indexes, filtered):
+            values[i] = v
+    return values
+
+
+def iter_raw_pairs(string_or_fp,
+                   keep_blank_values=False,
+                   strict_parsing=False,
+                   limits=None,
+                   chunk_size=DECODE_CHUNK_SIZE,
+                   convention=None):
+    """Retrieve a generator of the unquoted key-value tuples of an NVP
+    query string in the order they appear. Equivalent to the pairs of
+    ``urlparse.parse_qsl``. However, file-like objects are read in chunks
+    of ``chunk_size`` bytes. Thus, only a single pair is retained in memory
+    at any given time regardless of the size of the input. Except in
+    strict parsing mode which retains the key path of each pair, along
+    with its prefixes, in order to detect duplicates and conflicts, i.e
+    memory grows with the number of keys.
+
+    :param string_or_fp: The encoded NVP string or a file-like object
+                         supporting the ``read`` operation
+    :param keep_blank_values: Whether to retain keys with undefined values
+    :param strict_parsing: Whether to raise :class:`ParseError` on the first
+                           malformed pair. See :func:`validate_payload`.
+    :param limits: The :class:`Limits` to enforce as the input is read
+    :param chunk_size: The number of bytes to read from ``fp`` at a time
+    :param convention: The convention which all keys conform to. Utilized
+                       in order to detect duplicate and conflicting key
+                       paths in strict parsing mode.
+    """
+    if is_string(string_or_fp):
+        check_payload_limits(string_or_fp, limits)
+        fields = _PAIR_SEPARATOR_RE.split(string_or_fp)
+    else:
+        fields = _iter_fields(string_or_fp, limits, chunk_size)
+
+    count = 0
+    offset = 0
+    paths = set()
+    prefixes = set()
+    for field in fields:
+        if strict_parsing:
+            k, v = _check_strict_field(field, offset, paths, prefixes,
+                                       convention)
+            offset += _get_byte_length(field) + 1
+        else:
+            if not field:
+                continue
+
+            k, separator, v = field.partition('=')
+            if not (separator or keep_blank_values):
+                continue
+            k = unquote(k.replace('+', ' '))
+
+        if not (v or keep_blank_values):
+            continue
+
+        if limits is not None:
+            count += 1
+            limits.check('max_pairs', count)
+            limits.check('max_key_length', len(k), key=k)
+        yield (k, unquote(v.replace('+', ' ')))
+
+
+def find_pairs(string_or_fp,
+               keys,
+               keep_blank_values=False,
+               limits=None,
+               chunk_size=DECODE_CHUNK_SIZE):
+    """Retrieve a dictionary of the first value of each of the given raw
+    ``keys`` in an NVP query string. The input is scanned one pair at a
+    time until all ``keys`` have been found. The remaining input is
+    neither read nor unquoted, and neither are the values of other keys.
+
+    :param string_or_fp: The encoded NVP string or a file-like object
+                         supporting the ``read`` operation
+    :param keys: Iterable of the unquoted raw keys to find
+    :param keep_blank_values: Whether to retain keys with undefined values
+    :param limits: The :class:`Limits` to enforce as the input is read
+    :param chunk_size: The number of bytes to read from ``fp`` at a time
+    """
+    remaining = set(keys)
+    ret = {}
+    if not remaining:
+        return ret
+
+    if is_string(string_or_fp):
+        check_payload_limits(string_or_fp, limits)
+        fields = _iter_string_fields(string_or_fp)
+    else:
+        fields = _iter_fields(string_or_fp, limits, chunk_size)
+
+    count = 0
+    for field in fields:
+        if not field:
+            continue
+
+        k, separator, v = field.partition('=')
+        if not ((separator and v) or keep_blank_values):
+            continue
+        if '%' in k or '+' in k:
+            k = unquote(k.replace('+', ' '))
+
+        if limits is not None:
+            count += 1
+            limits.check('max_pairs', count)
+            limits.check('max_key_length', len(k), key=k)
+
+        if k in remaining:
+            ret[k] = unquote(v.replace('+', ' '))
+            remaining.discard(k)
+            if not remaining:
+                break
+    return ret
+
+
+def write_hierarchical_json(pairs,
+                            fp,
+                            key_filter=None,
+                            value_filter=None,
+                            limits=None):
+    """Write the JSON equivalent of the hierarchical dictionary of the
+    raw key-value ``pairs`` to the file-like object ``fp``. The output
+    is the same as the one of ``json.dump`` given ``sort_keys=True``.
+
+    Since pairs may appear in any order all of them are buffered, along
+    with their tokenized key paths, and sorted prior to being written.
+    Thus, memory is linear in the number of pairs. For regular payloads
+    no hierarchical dictionaries nor lists are built. The JSON is instead
+    written while walking the sorted paths and only the containers of the
+    current path are tracked in order to close them. Payloads relying on
+    the irregular cases of :func:`get_hierarchical_dict`, e.g gaps in
+    indexes or duplicate keys, fall back to building the hierarchical
+    dictionary via it and writing it via ``json.dump``.
+
+    :param pairs: Iterable of the raw key-value tuples to decode
+    :param fp: The file pointer in which the JSON should be written
+    :param key_filter: Function in which all keys should be filtered through.
+    :param value_filter: Function in which all values should be filtered
+                         through.
+    :param limits: The :class:`Limits` to enforce while parsing key paths
+    """
+    events = []
+    for raw_k, v in pairs:
+        k = key_filter(raw_k) if key_filter is not None else raw_k
+        if value_filter is not None:
+            v = value_filter(v)
+
+        path = tokenize_key(k)
+        check_key_path_limits(k, path, limits)
+        events.append((path, len(events), raw_k, v))
+    events.sort(key=_get_path_sort_key)
+
+    if not _is_regular_hierarchy(events):
+        # Group the values by their raw keys in the same order and manner
+        # as urlparse.parse_qs prior to building the dictionary.
+        events.sort(key=lambda event: event[1])
+        source = {}
+        for _, _, raw_k, v in events:
+            source.setdefault(raw_k, []).append(v)
+        source = dict(get_filtered_pairs(source, key_filter=key_filter))
+        json.dump(get_hierarchical_dict(source, limits=limits), fp,
+                  sort_keys=True)
+        return
+
+    encode_string = json.encoder.encode_basestring_ascii
+    fragments = ['{']
+    previous = ()
+    for path, _, _, value in events:
+        # Close the containers of the previous path which are not shared
+        # with the current one. The first differing component is a sibling
+        # in the innermost shared container.
+        shared = 0
+        if previous:
+            while previous[shared] == path[shared]:
+                shared += 1
+            for component in previous[shared + 1:len(previous)][::-1]:
+                fragments.append(']' if component.__class__ is int else '}')
+            fragments.append(', ')
+
+        last = len(path) - 1
+        for i in xrange(shared, len(path)):
+            component = path[i]
+            if component.__class__ is not int:
+                fragments.append(encode_string(component))
+                fragments.append(': ')
+            if i < last:
+                fragments.append('[' if path[i + 1].__class__ is int else '{')
+
+        if isinstance(value, basestring):
+            fragments.append(encode_string(value))
+        else:
+            fragments.append(json.dumps(value))
+
+        if len(fragments) >= JSON_WRITE_FRAGMENTS:
+            fp.write(''.join(fragments))
+            fragments = []
+        previous = path
+
+    for component in previous[1:][::-1]:
+        fragments.append(']' if component.__class__ is int else '}')
+    fragments.append('}')
+    fp.write(''.join(fragments))
 
 
-def get_hierarchical_dict(source):
+def get_hierarchical_dict(source,
+                          limits=None,
+                          registry=None,
+                          convention=None,
+                          key_callback=None):
     """Retrieve a hierarchical dictionary corresponding to the
     hierarchy defined in the keys of the given ``source`` directory.
 
     :param source: The single-level dictionary to convert
+    :param limits: The :class:`Limits` to enforce while parsing key paths
+    :param registry: The ``KeyRegistry`` from which the tokenized key
+                     paths, and thereby the keys, are retrieved
+    :param convention: The convention which all keys conform to. In case
+                       it is not given the convention is detected from a
+                       sample of the keys. See :func:`get_key_tokenizer`.
+    :param key_callback: Function called with each key along with a
+                         dictionary of the statistics of tokenizing it, see
+                         :func:`get_sorted_key_paths`, and once more with
+                         the ``build_time`` of inserting it into the
+                         hierarchy along with the ``fallbacks``, i.e the
+                         tuples of the depth, key and index of each index
+                         out of range retained as a part of the key.
+                         Intended for diagnostics, see ``nvp.debug``.
     """
     ret = {}
-    sorted_keys = sorted(source.keys())
     convert = _convert_into_hierarchical_dict
-
-    for key in sorted_keys:
+    paths = get_sorted_key_paths(source, limits=limits, registry=registry,
+                                 convention=convention,
+                                 key_callback=key_callback)
+    containers = set()
+    for path, key in paths:
         value = source[key]
-        ret = convert(ret, key, value, convention=detect_key_convention(key))
+        key_convention = convention or detect_key_convention(key)
+        if key_callback is None:
+            ret = convert(ret, list(path), value, convention=key_convention,
+                          containers=containers)
+            continue
+
+        fallbacks = []
+        started_at = default_timer()
+        ret = convert(ret, list(path), value, convention=key_convention,
+                      containers=containers, fallbacks=fallbacks)
+        key_callback(key, {
+            'build_time': default_timer() - started_at,
+            'fallbacks': fallbacks,
+        })
     return ret
 
 
+def get_sorted_key_paths(source,
+                         limits=None,
+                         registry=None,
+                         convention=None,
+                         key_callback=None):
+    """Retrieve a list of tuples of the tokenized path of each key in
+    the ``source`` dictionary along with the key itself. Sorted in the
+    order which the hierarchy is to be built in.
+
+    :param source: The single-level dictionary whose keys to tokenize
+    :param limits: The :class:`Limits` to enforce while parsing key paths
+    :param registry: The ``KeyRegistry`` from which the tokenized key
+                     paths are retrieved
+    :param convention: The convention which all keys conform to
+    :param key_callback: Function called with each key along with a
+                         dictionary of its ``path``, the ``tokenize_time``
+                         and the number of ``passes`` required to tokenize
+                         it. See :func:`get_key_tokenizer`. The passes are
+                         ``None`` for paths retrieved from a ``registry``.
+                         Intended for diagnostics, see ``nvp.debug``.
+    """
+    passes = {}
+    if registry is not None:
+        tokenize = lambda key: registry.get_path(key, convention=convention)
+    else:
+        multi_pass_callback = None
+        if key_callback is not None:
+            multi_pass_callback = passes.__setitem__
+        tokenize = get_key_tokenizer(source, convention=convention,
+                                     multi_pass_callback=multi_pass_callback)
+
+    # Tokenize all keys prior to building the hierarchy in order to
+    # reject payloads exceeding the limits before allocating anything.
+    paths = []
+    for key in source:
+        if key_callback is None:
+            path = tokenize(key)
+        else:
+            started_at = default_timer()
+            path = tokenize(key)
+            key_callback(key, {
+                'path': path,
+                'tokenize_time': default_timer() - started_at,
+                'passes': None if registry is not None else passes.get(key, 1),
+            })
+        check_key_path_limits(key, path, limits)
+        paths.append((path, key))
+
+    # Sorting the tokenized paths rather than the raw keys ensures
+    # sequence indexes are ordered numerically, i.e FOO10 after FOO9.
+    # Otherwise, the items of sequences longer than ten would be
+    # inserted out of order.
+    paths.sort(key=_get_path_sort_key)
+    return paths
+
+
 ###############################################################################
 # KEY PATH FUNCTIONS
 ###############################################################################
@@ -192,21 +1173,18 @@ def convert_underscore_into_bracket_key(key):
     converted = []
     components = key.split(KEY_UNDERSCORE_HIERARCHY_SEPARATOR)
     for component in components:
-        try:
-            index = int(component)
-            converted[-1] = gen_component(converted[-1], index)
-        except ValueError:
+        if converted and component.isdigit():
+            converted[-1] = gen_component(converted[-1], int(component))
+        else:
             converted.append(component)
 
     # In case the value is sequential the underscore convention requires
     # the index to be appended to the last key component string. Strange
     # convention since all other sequential indexes are separated with
     # underscores to the neighbour keys.
-    try:
-        k, index = parse_underscore_key_with_index(converted[-1])
+    k, index = _split_trailing_index(converted[-1])
+    if index is not None:
         converted[-1] = gen_component(k, index)
-    except ValueError:
-        pass
 
     return KEY_HIERARCHY_SEPARATOR.join(converted)
 
@@ -229,7 +1207,7 @@ def detect_key_convention(key):
 
     :param key: The key to check
     """
-    last_character = key[-1]
+    last_character = key[-1:]
 
     # Sequence with key following KEYNAME[0] standards
     if last_character == ']':
@@ -240,6 +1218,147 @@ def detect_key_convention(key):
     return CONVENTION_UNDERSCORE
 
 
+def tokenize_key(key, convention=None):
+    """Tokenize given ``key`` into a tuple reflecting its hierarchical path.
+    Each item in the tuple is either a string, i.e a dictionary key, or an
+    integer, i.e a sequence index.
+
+        >>> import nvp.util
+        >>> nvp.util.tokenize_key('L_FOO_0_BAR1')
+        ('L', 'FOO', 0, 'BAR', 1)
+        >>> nvp.util.tokenize_key('foo.bar[0][1]', 'bracket')
+        ('foo', 'bar', 0, 1)
+        >>> nvp.util.tokenize_key('foo.bar(0).a', 'parentheses')
+        ('foo', 'bar', 0, 'a')
+
+    In case no ``convention`` is given the key is tokenized in the same
+    manner as ``loads`` always has, i.e underscores are treated as
+    separators regardless of the convention and the convention of each
+    separated component is detected individually. Otherwise, only the
+    grammar of the given convention is applied.
+
+    The tokenizer never raises on malformed keys. Components which cannot
+    be parsed are retained as strings.
+
+    :param key: The key to tokenize
+    :param convention: The convention which ``key`` conforms to
+    """
+    if convention is None:
+        return _tokenize_detected_key(key)
+
+    func = _KEY_TOKENIZERS.get(convention, None)
+    if func is not None:
+        return func(key)
+
+    message = 'Given convention is not one of the accepted values: %s'
+    raise ValueError(message % CONVENTIONS)
+
+
+def get_key_field(key):
+    """Retrieve the field of given ``key``, i.e the last name in its
+    hierarchical path. ``None`` is retrieved for keys without any name.
+
+        >>> import nvp.util
+        >>> nvp.util.get_key_field('L_PAYMENTREQUEST_0_AMT1')
+        'AMT'
+
+    :param key: The raw key to retrieve the field of
+    """
+    for component in reversed(tokenize_key(key)):
+        if not is_int(component):
+            return component
+    return None
+
+
+def detect_payload_convention(keys,
+                              sample_size=PAYLOAD_CONVENTION_SAMPLE_SIZE):
+    """Detect the convention of an entire payload from a sample of its
+    ``keys``. ``None`` is retrieved in case the sampled keys utilize
+    different conventions.
+
+        >>> import nvp.util
+        >>> nvp.util.detect_payload_convention(['foo[0].a', 'bar'])
+        'bracket'
+        >>> nvp.util.detect_payload_convention(['foo[0].a', 'bar(0)'])
+
+    :param keys: Iterable of the raw keys of the payload
+    :param sample_size: The number of keys to sample
+    """
+    detected = None
+    for key in itertools.islice(keys, sample_size):
+        if '[' in key:
+            convention = CONVENTION_BRACKET
+        elif '(' in key:
+            convention = CONVENTION_PARENTHESES
+        else:
+            # Keys without indexes are compatible with any convention
+            continue
+
+        if detected is None:
+            detected = convention
+        elif detected != convention:
+            return None
+    return detected or CONVENTION_UNDERSCORE
+
+
+def get_key_tokenizer(keys=(), convention=None, multi_pass_callback=None):
+    """Retrieve a function which tokenizes keys in the same manner as
+    :func:`tokenize_key` given ``convention``. However, the function is
+    specialized for the convention which, in case it is not given, is
+    detected from a sample of ``keys`` once rather than for each key.
+
+    Keys of the bracket and parentheses conventions are tokenized by
+    splitting them at their separators and identifiers at once. Keys which
+    that would not result in the same path for, e.g due to non-ASCII names
+    or keys of another convention in a mixed payload, are tokenized as
+    usual. In case the sampled keys are mixed all keys are tokenized as
+    usual.
+
+    :param keys: Iterable of the raw keys to detect the convention from
+    :param convention: The convention which the keys conform to
+    :param multi_pass_callback: Function called with each key which is not
+                                tokenized in a single pass along with the
+                                number of passes, i.e keys which are
+                                converted into the bracket convention after
+                                which each component is parsed separately.
+                                Intended for diagnostics, see ``nvp.debug``.
+    """
+    strict = convention is not None
+    if strict:
+        fallback = _KEY_TOKENIZERS.get(convention, None)
+        if fallback is None:
+            message = 'Given convention is not one of the accepted values: %s'
+            raise ValueError(message % CONVENTIONS)
+    else:
+        convention = detect_payload_convention(keys)
+        fallback = _tokenize_detected_key
+        if multi_pass_callback is not None:
+            fallback = lambda key: _tokenize_detected_key(
+                key, multi_pass_callback=multi_pass_callback)
+        if convention is None:
+            return fallback
+
+    # Keys of the underscore convention are tokenized in a single scan
+    # already. Thus, there is nothing further to specialize.
+    if convention == CONVENTION_UNDERSCORE:
+        return fallback
+
+    match = _FAST_KEY_RES[(convention, strict)].match
+    open_identifier, close_identifier = _GROUP_KEY_IDENTIFIERS[convention]
+
+    def tokenize(key):
+        if match(key) is None:
+            return fallback(key)
+
+        # Names of matching keys are never digits only. Hence, all such
+        # components are indexes once the identifiers are replaced.
+        components = key.replace(open_identifier, KEY_HIERARCHY_SEPARATOR)
+        components = components.replace(close_identifier, '')
+        return tuple([int(c) if c.isdigit() else c
+                      for c in components.split(KEY_HIERARCHY_SEPARATOR)])
+    return tokenize
+
+
 def parse_underscore_key_with_index(key):
     """Retrieve sequence index in given ``key`` along with the
     filtered key itself where ``key`` conforms to the underscore convention.
@@ -250,16 +1369,9 @@ def parse_underscore_key_with_index(key):
 
     :param key: The key to retrieve sequence components from
     """
-    index_at = 0
-    while True:
-        try:
-            int(key[(index_at - 1)])
-            index_at -= 1
-        except ValueError:
-            break
-
-    if index_at:
-        return (key[:index_at], int(key[index_at:]))
+    k, index = _split_trailing_index(key)
+    if index is not None:
+        return (k, index)
 
     message = 'Given key has no index appended to it: %s'
     raise ValueError(message % key)
@@ -397,6 +1509,177 @@ def generate_key_component(key,
 # INTERNAL FUNCTIONS
 ###############################################################################
 
+def _split_trailing_index(key):
+    """Retrieve a tuple containing ``key`` without its trailing digits
+    along with the integer they represent. In case ``key`` has no trailing
+    digits, or consists of digits only, the index is ``None``.
+
+    :param key: The key component to split
+    """
+    k = key.rstrip(INDEX_DIGITS)
+    if not k or len(k) == len(key):
+        return (key, None)
+    return (k, int(key[len(k):]))
+
+
+def _append_component_tokens(tokens, component, convention):
+    """Append the name along with all sequence indexes of the single
+    key ``component`` to the list of ``tokens``.
+
+    :param tokens: The list of tokens to append to
+    :param component: The key component, e.g ``foo[0][1]`` or ``FOO0``
+    :param convention: The convention which ``component`` conforms to
+    """
+    if convention == CONVENTION_UNDERSCORE:
+        k, index = _split_trailing_index(component)
+        tokens.append(k)
+        if index is not None:
+            tokens.append(index)
+        return
+
+    match = _GROUP_KEY_COMPONENT_RES[convention].match(component)
+    if match is None:
+        tokens.append(component)
+        return
+
+    k, indexes = match.groups()
+    tokens.append(k)
+    tokens.extend(int(index) for index in _INDEX_RE.findall(indexes))
+
+
+def _tokenize_underscore_key(key):
+    """Tokenize given ``key`` according to the underscore convention.
+
+    :param key: The key to tokenize, e.g ``L_FOO_0_BAR1``
+    """
+    tokens = []
+    append = tokens.append
+
+    # Whether a name is followed by a separated index is unknown until
+    # the next component is reached. Hence, names are kept pending until
+    # then in order to tokenize the key in a single left-to-right scan.
+    pending = None
+    for component in key.split(KEY_UNDERSCORE_HIERARCHY_SEPARATOR):
+        if component.isdigit() and (tokens or pending is not None):
+            # Components followed by a separated index retain any
+            # trailing digits as apart of their name, e.g FOO2_0.
+            if pending is not None:
+                append(pending)
+                pending = None
+            append(int(component))
+            continue
+
+        if pending is not None:
+            _append_component_tokens(tokens, pending, CONVENTION_UNDERSCORE)
+        pending = component
+
+    if pending is not None:
+        _append_component_tokens(tokens, pending, CONVENTION_UNDERSCORE)
+    return tuple(tokens)
+
+
+def _tokenize_bracket_key(key):
+    """Tokenize given ``key`` according to the bracket convention.
+
+    :param key: The key to tokenize, e.g ``foo[0].bar[1]``
+    """
+    tokens = []
+    for component in key.split(KEY_HIERARCHY_SEPARATOR):
+        _append_component_tokens(tokens, component, CONVENTION_BRACKET)
+    return tuple(tokens)
+
+
+def _tokenize_parentheses_key(key):
+    """Tokenize given ``key`` according to the parentheses convention.
+
+    :param key: The key to tokenize, e.g ``foo(0).bar(1)``
+    """
+    tokens = []
+    for component in key.split(KEY_HIERARCHY_SEPARATOR):
+        _append_component_tokens(tokens, component, CONVENTION_PARENTHESES)
+    return tuple(tokens)
+
+
+def _tokenize_detected_key(key, multi_pass_callback=None):
+    """Tokenize given ``key`` of any convention. Keys of type underscore
+    are converted into the bracket convention after which the convention
+    of each component is detected separately.
+
+    Keys without any separator nor sequence identifier of the bracket and
+    parentheses conventions are tokenized directly by the underscore
+    tokenizer instead. Which results in the same path without having to
+    convert the key and parse the converted string once again.
+
+    :param key: The key to tokenize
+    :param multi_pass_callback: Function called with ``key`` along with the
+                                number of passes in case it is converted,
+                                i.e one plus the number of its components.
+    """
+    if '.' not in key and '[' not in key and '(' not in key:
+        return _tokenize_underscore_key(key)
+
+    tokens = []
+    components = convert_underscore_into_bracket_key(key).split(
+        KEY_HIERARCHY_SEPARATOR)
+    if multi_pass_callback is not None:
+        multi_pass_callback(key, 1 + len(components))
+    for component in components:
+        convention = detect_key_convention(component)
+        _append_component_tokens(tokens, component, convention)
+    return tuple(tokens)
+
+
+#: Mapping of conventions and their corresponding functions to
+#: tokenize keys conforming to the convention
+_KEY_TOKENIZERS = {
+    CONVENTION_BRACKET: _tokenize_bracket_key,
+    CONVENTION_PARENTHESES: _tokenize_parentheses_key,
+    CONVENTION_UNDERSCORE: _tokenize_underscore_key,
+}
+
+
+def _quote_string(obj):
+    """Retrieve the string representation of ``obj`` quoted in the
+    same manner as ``urllib.urlencode`` quotes keys and values.
+
+    :param obj: The key or value to quote
+    """
+    string = str(obj)
+    if _SAFE_STRING_RE.match(string):
+        return string
+    return quote_plus(string)
+
+
+def _get_quoted_length(obj):
+    """Retrieve the length of the string :func:`_quote_string` retrieves
+    for ``obj`` without quoting it. Every character other than the ones
+    retained as a single character is quoted as three, e.g ``%26``.
+
+    :param obj: The key or value to measure
+    """
+    string = str(obj)
+    if _SAFE_STRING_RE.match(string):
+        return len(string)
+    quoted = len(string.translate(None, _SINGLE_QUOTED_CHARACTERS))
+    return len(string) + 2 * quoted
+
+
+def _quote_key(key):
+    """Retrieve the quoted representation of ``key`` from the key cache.
+    In case it is missing the key is quoted and stored in the cache.
+
+    :param key: The key to quote
+    """
+    quoted = _quoted_keys.get(key)
+    if quoted is None:
+        # Keys containing sequence indexes are practically unbounded.
+        # Therefore, the cache is simply reset once it is full.
+        if len(_quoted_keys) >= QUOTED_KEY_CACHE_SIZE:
+            _quoted_keys.clear()
+        quoted = _quoted_keys[key] = _quote_string(key)
+    return quoted
+
+
 def _parse_hierarchical_key_path(key):
     """Parse and retrieve a tuple reflecting the hierarchy
     defined in the given raw ``key``.
@@ -405,52 +1688,28 @@ def _parse_hierarchical_key_path(key):
     which will be set in the top-level dictionary of the hierarchical
     dictionary.
 
-    The second item is a list of the remaining hierarchical keys
-    which have not been parsed - they should when the recursive
-    ``_convert_into_hierarchical_dict`` reaches their intended
-    depth and they are - at that level - considered the parent
-    key.
+    The second item is a list of the remaining hierarchical key
+    components which have not been consumed - they will be when the
+    recursive ``_convert_into_hierarchical_dict`` reaches their intended
+    depth and they are - at that level - considered the parent key.
 
         >>> import nvp.util
-        >>> nvp.util.parse_hierarchical_key_path('foo.bar.a.b')
+        >>> nvp.util._parse_hierarchical_key_path('foo.bar.a.b')
         ('foo', ['bar', 'a', 'b'])
-        >>> nvp.util.parse_hierarchical_key_path('foo.bar[0].a')
-        ('foo', ['bar[0]', 'a'])
-        >>> nvp.util.parse_hierarchical_key_path('FOO_BAR_0_A')
-        ('FOO', ['BAR_0', 'A'])
+        >>> nvp.util._parse_hierarchical_key_path('foo.bar[0].a')
+        ('foo', ['bar', 0, 'a'])
+        >>> nvp.util._parse_hierarchical_key_path('FOO_BAR_0_A')
+        ('FOO', ['BAR', 0, 'A'])
 
-    :param key: The raw key to retrieve hierarchy from
+    :param key: The raw key, or the list of its remaining
+                components, to retrieve hierarchy from
     """
     # Ensure we are dealing with a list of key components
     # rather than the string representation of the entire key path.
     if is_string(key):
-        # Convert keys of type underscore into the bracket convention
-        # prior to parsing them in order to avoid having to implement
-        # separate logic for the type since it is quite a weird convention.
-        key = convert_underscore_into_bracket_key(key)
-        key = key.split(KEY_HIERARCHY_SEPARATOR)
-
-    # In case the initial key item in the list of components is not
-    # a string we can return both the initial and remaining key
-    # components directly. Because in such case the key path has
-    # already been parsed.
-    initial_key = key.pop(0)
-    if not is_string(initial_key):
-        return (initial_key, key)
-
-    # Check whether the initial key is a representation of a
-    # sequence value, i.e list or tuple. Otherwise, there is
-    # no need to continue parsing the key path.
-    convention = detect_key_convention(initial_key)
-    if not convention:
-        return (initial_key, key)
+        key = list(tokenize_key(key))
 
-    while True:
-        try:
-            initial_key, index = parse_key_with_index(initial_key, convention)
-            key.insert(0, index)
-        except ValueError:
-            break
+    initial_key = key.pop(0)
     return (initial_key, key)
 
 
@@ -504,84 +1763,390 @@ def _convert_into_list(source,
     :param keys: List of key components in current NVP pair to generate
                  hierarchical key path from
     """
-    source_is_dict = is_dict(source)
-    source_is_sequential = is_non_string_sequence(source)
+    destination = destination if destination is not None else []
+    destination.extend(_iter_hierarchical_pairs(source, convention,
+                                                key_filter=key_filter,
+                                                value_filter=value_filter,
+                                                keys=keys))
+    return destination
 
+
+def _iter_hierarchical_pairs(source,
+                             convention,
+                             key_filter=None,
+                             value_filter=None,
+                             keys=None):
+    """Recursively generate the NVP pairs of given ``source`` dictionary.
+    Nested sequences are consumed as the pairs are generated. Allowing
+    generators and other iterables to be encoded without being stored
+    in memory in their entirety.
+
+    :param source: The dictionary to convert into NVP pairs
+    :param convention: The convention to utilize in encoding keys
+                          corresponding to non-string sequences, e.g lists.
+    :param key_filter: Function in which all keys should be filtered through.
+    :param value_filter: Function in which all values should be filtered
+                         through.
+    :param keys: List of key components in current NVP pair to generate
+                 hierarchical key path from
+    """
     # In case source is neither a dictionary nor a list
     # we have reached the end of the recursion required to
-    # generate the current pair and we can return the entire
-    # key along with the value - source in this case.
-    if not (source_is_dict or source_is_sequential):
-        # Assign current pair
-        path_k = generate_key(keys, convention=convention)
-        if key_filter is not None:
-            path_k = key_filter(path_k)
+    # generate the current pair.
+    if not (is_dict(source) or is_non_string_sequence(source)):
+        return iter([_get_leaf_pair(keys, source, convention,
+                                    key_filter, value_filter)])
+
+    # The keys of the pairs are generated incrementally from the prefix
+    # shared by all the pairs of the source. Sequences additionally share
+    # the parent key which each index is appended to.
+    keys = keys if keys else []
+    separator = _get_key_separator(convention)
+    parent = None
+    if not is_dict(source):
+        parent = keys[-1] if keys else None
+        keys = keys[:-1]
+
+    prefix = ''.join([k + separator for k in keys])
+    return _iter_prefixed_pairs(source, convention, key_filter, value_filter,
+                                prefix, parent)
+
+
+def _iter_prefixed_pairs(source,
+                         convention,
+                         key_filter,
+                         value_filter,
+                         prefix,
+                         parent):
+    """Recursively generate the NVP pairs of the ``source`` dictionary or
+    sequence whose keys all start with ``prefix``. Each prefix is thus
+    generated once per subtree rather than once per pair.
+
+    :param prefix: The generated key components preceding the ones of
+                   ``source`` including the trailing separator
+    :param parent: The key of the ``source`` sequence which the index of
+                   each item is appended to. ``None`` for dictionaries.
+    """
+    is_grouped = (convention == CONVENTION_BRACKET or
+                  convention == CONVENTION_PARENTHESES)
+    separator = _get_key_separator(convention)
+
+    if is_dict(source):
+        items = source.iteritems()
+    else:
+        # Now when source is a non-string sequence the key of each item
+        # is the parent key along with the index of the item. The source
+        # is iterated only once since it might be a generator or an
+        # iterator which cannot be rewound. Neither are keys generated
+        # for sequences without any items.
+        if not parent:
+            message = 'Cannot generate sequence key without parent key: %s'
+            raise ValueError(message % source)
+        items = itertools.izip(source, _iter_index_keys(parent, convention))
+        items = itertools.imap(_swap_pair, items)
+
+    for k, v in items:
+        # Values are the most common items and are thus generated
+        # without the overhead of another level of generators.
+        if not (is_dict(v) or is_non_string_sequence(v)):
+            # The underscore convention appends the index of the last
+            # key component directly to the key, e.g L_0 is encoded as L0.
+            if not is_grouped and k.count('_') == 1:
+                k = k.replace('_', '')
+            path_k = prefix + k
+            if key_filter is not None:
+                path_k = key_filter(path_k)
+            if value_filter is not None:
+                v = value_filter(v)
+            yield (path_k, v)
+            continue
+
+        if is_dict(v):
+            # Keys which are not strings cannot be a part of the prefix.
+            # The error is raised once the first pair of the subtree is
+            # generated in the same manner as for its leaf keys.
+            inner_prefix = None
+            if prefix is not None and is_string(k):
+                inner_prefix = prefix + k + separator
+            pairs = _iter_prefixed_pairs(v, convention, key_filter,
+                                         value_filter, inner_prefix, None)
+        else:
+            pairs = _iter_prefixed_pairs(v, convention, key_filter,
+                                         value_filter, prefix, k)
+        for pair in pairs:
+            yield pair
 
-        if value_filter is not None:
-            source = value_filter(source)
 
-        destination.append((path_k, source))
-        return destination
+def _swap_pair(pair):
+    return (pair[1], pair[0])
 
-    # Ensure both keys and destinations are initialized
-    keys = keys if keys else []
-    destination = destination if destination else []
-
-    # Recursively convert all items in the current dictionary
-    if source_is_dict:
-        for k, v in source.iteritems():
-            inner_keys = keys[:]
-            inner_keys.append(k)
-            destination = _convert_into_list(v, keys=inner_keys,
-                                             convention=convention,
-                                             key_filter=key_filter,
-                                             value_filter=value_filter,
-                                             destination=destination)
-
-        return destination
-
-    # Now when source is a non-string sequence we have to retrieve
-    # the previous item in the keys list in order to generate a valid
-    # key, since the current key will be an integer - the index of the
-    # value to store for the final key path. Since this function is recursive
-    # we do not need to iterate through all the keys to find the nearest
-    # string to utilize as the parent key. Because the previous recursion
-    # will have concatinated both its previous key along with the index
-    # of the containing sequence in which this key is located.
-    pk = keys.pop()
-    if not pk:
-        message = 'Cannot generate sequence key without parent key: %s'
-        raise ValueError(message % source)
 
-    index = 0
-    for value in source:
-        inner_keys = keys[:]
-        k = generate_key_component(pk, index, convention=convention)
+def _get_key_separator(convention):
+    """Retrieve the separator of the key components of ``convention``."""
+    if (convention == CONVENTION_BRACKET or
+        convention == CONVENTION_PARENTHESES):
+        return KEY_HIERARCHY_SEPARATOR
+    return KEY_UNDERSCORE_HIERARCHY_SEPARATOR
+
 
-        inner_keys.append(k)
-        index += 1
+def _iter_index_keys(parent, convention):
+    """Retrieve a generator of the keys of the items of the sequence of
+    the ``parent`` key, i.e ``parent`` along with the index of each item.
+    """
+    suffixes = _get_index_suffixes(convention)
+    for suffix in suffixes:
+        yield '%s%s' % (parent, suffix)
 
-        destination = _convert_into_list(value, convention,
-                                         key_filter=key_filter,
-                                         value_filter=value_filter,
-                                         destination=destination,
-                                         keys=inner_keys)
+    # Indexes beyond the cached ones are formatted for each sequence
+    for index in itertools.count(len(suffixes)):
+        yield generate_key_component(parent, index, convention=convention)
 
-    return destination
+
+def _get_index_suffixes(convention):
+    """Retrieve the list of the formatted index suffixes of sequence
+    keys of ``convention``, e.g ``[12]`` or ``_12``, from the cache.
+    """
+    suffixes = _index_suffixes.get(convention)
+    if suffixes is None:
+        # Formatted in the same manner as by generate_key_component
+        # which raises in case the convention is not accepted.
+        suffixes = [generate_key_component('', index, convention=convention)
+                    for index in xrange(INDEX_SUFFIX_CACHE_SIZE)]
+        _index_suffixes[convention] = suffixes
+    return suffixes
+
+
+def _get_leaf_pair(keys, value, convention, key_filter, value_filter):
+    """Retrieve the NVP pair of the leaf ``value`` located at the
+    hierarchical key path consisting of ``keys``.
+    """
+    path_k = generate_key(keys, convention=convention)
+    if key_filter is not None:
+        path_k = key_filter(path_k)
+
+    if value_filter is not None:
+        value = value_filter(value)
+    return (path_k, value)
+
+
+def _call_batch_value_filter(func, values):
+    """Call the batch value filter ``func`` with ``values`` and retrieve
+    the filtered values after ensuring none of them went missing.
+    """
+    filtered = func(values)
+    if len(filtered) != len(values):
+        message = 'Batch value filter retrieved %d values rather than %d'
+        raise ValueError(message % (len(filtered), len(values)))
+    return filtered
+
+
+def _iter_batch_filtered_pairs(pairs, batch_value_filter, batch_pairs):
+    """Retrieve a generator of the given ``pairs`` where the values of
+    ``batch_pairs`` pairs at a time are filtered in a single batch.
+    """
+    while True:
+        batch = list(itertools.islice(pairs, batch_pairs))
+        if not batch:
+            return
+
+        keys = [k for k, _ in batch]
+        values = filter_value_batch(keys, [v for _, v in batch],
+                                    batch_value_filter)
+        for pair in itertools.izip(keys, values):
+            yield pair
+
+
+def _iter_string_fields(string):
+    """Retrieve a generator of the raw, separated, fields of ``string``
+    which, unlike splitting it, only scans as far as the fields consumed.
+    """
+    start = 0
+    for match in _PAIR_SEPARATOR_RE.finditer(string):
+        yield string[start:match.start()]
+        start = match.end()
+    yield string[start:]
+
+
+def _get_hierarchical_encoded_size(source,
+                                   convention,
+                                   value_filter,
+                                   prefix,
+                                   component):
+    """Recursively retrieve a tuple of the total length of the encoded
+    pairs of ``source``, excluding separators between pairs, along with
+    the number of pairs. Mirrors :func:`_iter_hierarchical_pairs`.
+
+    Quoting retains the length of each character regardless of the ones
+    surrounding it. Thus, the quoted length of a key is the sum of the
+    quoted lengths of its components and separators.
+
+    :param prefix: The quoted length of the key components preceding
+                   the ones of ``source``, including the last separator.
+    :param component: Tuple of the quoted length and the number of
+                      underscores of the parent key of the ``source``
+                      sequence. ``None`` in case ``source`` is a dict.
+    """
+    is_underscore = (convention == CONVENTION_UNDERSCORE)
+    quote_key = _quote_key
+    quoted_length = _get_quoted_length
+
+    if is_dict(source):
+        items = ((quote_key(k), v) for k, v in source.iteritems())
+        items = (((len(k), k.count('_')), v) for k, v in items)
+    else:
+        if component is None or not component[0]:
+            message = 'Cannot generate sequence key without parent key: %s'
+            raise ValueError(message % source)
+
+        # Sequence keys consist of the parent key followed by the index
+        # either within identifiers, quoted as %5B and %5D or %28 and %29,
+        # or after an underscore in case of the underscore convention.
+        parent_length, parent_underscores = component
+        if is_underscore:
+            items = (((parent_length + 1 + len(str(i)),
+                       parent_underscores + 1), v)
+                     for i, v in enumerate(source))
+        else:
+            items = (((parent_length + 6 + len(str(i)),
+                       parent_underscores), v)
+                     for i, v in enumerate(source))
+
+    size = 0
+    count = 0
+    for (length, underscores), v in items:
+        if is_dict(v):
+            inner = _get_hierarchical_encoded_size(
+                v, convention, value_filter, prefix + length + 1, None)
+        elif is_non_string_sequence(v):
+            inner = _get_hierarchical_encoded_size(
+                v, convention, value_filter, prefix, (length, underscores))
+        else:
+            # The underscore of the last key component is removed in
+            # case it is the only one, e.g L_0 is encoded as L0.
+            if is_underscore and underscores == 1:
+                length -= 1
+            if value_filter is not None:
+                v = value_filter(v)
+            size += prefix + length + 1 + quoted_length(v)
+            count += 1
+            continue
+
+        size += inner[0]
+        count += inner[1]
+    return (size, count)
+
+
+def _iter_fields(fp, limits, chunk_size):
+    """Retrieve a generator of the raw, separated, fields read from
+    the file-like object ``fp`` in chunks of ``chunk_size`` bytes.
+    """
+    size = 0
+    remainder = ''
+    while True:
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            break
+
+        if limits is not None:
+            size += len(chunk)
+            limits.check('max_bytes', size)
+
+        # The last field might continue in the next chunk and is
+        # therefore retained until the next separator is read.
+        fields = _PAIR_SEPARATOR_RE.split(remainder + chunk)
+        remainder = fields.pop()
+        for field in fields:
+            yield field
+    yield remainder
+
+
+def _is_regular_hierarchy(events):
+    """Check whether the sorted ``events`` describe a hierarchy which
+    can be written without any of the fallbacks of
+    :func:`_convert_into_hierarchical_dict`. That is each path is unique,
+    no path is a prefix of another, the indexes of each sequence are
+    consecutive from zero and no key is both a dictionary and a sequence.
+
+    :param events: Sorted list of tuples starting with tokenized paths
+    """
+    previous = None
+    for event in events:
+        path = event[0]
+        shared = 0
+        if previous is not None:
+            length = min(len(previous), len(path))
+            while shared < length and previous[shared] == path[shared]:
+                shared += 1
+            if shared == length:
+                return False
+
+            before, after = previous[shared], path[shared]
+            if after.__class__ is int:
+                if before.__class__ is not int or after != before + 1:
+                    return False
+            elif before.__class__ is int:
+                return False
+            shared += 1
+        elif path[0].__class__ is int:
+            return False
+
+        # Sequences opened by the remaining components start at zero
+        for component in path[shared:]:
+            if component.__class__ is int and component != 0:
+                return False
+        previous = path
+    return True
+
+
+def _is_container(obj, containers):
+    """Check whether ``obj`` is a dictionary or list of the hierarchy, as
+    opposed to a value, given the set of the ids of the ``containers``.
+    """
+    if containers is None:
+        return is_dict(obj) or is_non_string_sequence(obj)
+    return id(obj) in containers
+
+
+def _get_path_sort_key(item):
+    """Retrieve the key by which the tokenized ``item`` is sorted prior to
+    building the hierarchy. Indexes are wrapped in tuples since those are
+    ordered after strings. Thereby, keys utilized both as a dictionary and
+    a sequence in the same payload are initialized as dictionaries rather
+    than sequences in which names cannot be assigned.
+
+    :param item: Tuple of the tokenized path and the raw key
+    """
+    return [(c,) if c.__class__ is int else c for c in item[0]]
 
 
 def _convert_into_hierarchical_dict(destination,
                                     keys,
                                     value,
                                     convention=DEFAULT_CONVENTION,
-                                    depth=0):
+                                    depth=0,
+                                    containers=None,
+                                    fallbacks=None):
     """Recursively convert given ``destination`` into a hierarchical
     dictionary which mirrors the hierarchy defined in the keys of the
     initial ``destination`` given.
 
+    Raises ``ValueError`` in case a key is assigned both a value and
+    nested keys since either of them would otherwise be lost.
+
     :param destination: The object in which all values should be assigned
     :param keys: List of components found in the single-level dictionary key
     :param value: The value to assign
+    :param convention: The convention of the single-level dictionary key
+    :param depth: The current depth of the recursion
+    :param containers: Set of the ids of the dictionaries and lists created
+                       while building the hierarchy. Thereby, values which
+                       are lists themselves are not mistaken for containers.
+                       Otherwise, all dictionaries and lists are considered
+                       containers.
+    :param fallbacks: List to which a tuple of the depth, key and index is
+                      appended for each index out of range which is
+                      retained as a part of the key. Intended for
+                      diagnostics, see ``nvp.debug``.
     """
     # Since this function is recursive we might end up with an empty
     # list of keys. In which case we should return the sanitized value
@@ -633,6 +2198,7 @@ def _convert_into_hierarchical_dict(destination,
 
         if (index == 0 or
             (destination_has_k and
+            _is_container(destination[k], containers) and
             is_non_string_sequence(destination[k]) and
             sequence_has_index(destination[k], (index - 1)))):
             # In the case of the next key being an integer we are
@@ -642,27 +2208,48 @@ def _convert_into_hierarchical_dict(destination,
             # Otherwise, we will trigger an IndexError when attempting to
             # insert the intended value at an index out of range.
             target = []
-        else:
+        elif not is_current_sequential:
             # The index has proven to be out of range in advance and we
             # should therefore fallback to setting the target to a dictionary.
             # We also need to re-generate the current key so that it contains
             # the incorrect index which should be treated as apart of the key
             # rather than an index.
             next_k = remaining_ks.pop(0)
+            if fallbacks is not None:
+                fallbacks.append((depth, k, index))
             k = generate_key_component(k, index,
                                        convention=convention,
                                        with_separator=len(remaining_ks))
+        # Otherwise, the current key is an index itself and cannot be
+        # re-generated since sequences cannot contain named keys. In which
+        # case the out of range index is retained as a key of the dictionary.
 
     # Ensure we initialize destination[k] prior to assigning values to it.
     if is_current_sequential and not sequence_has_index(destination, k):
+        if k != len(destination):
+            message = 'Index %d is out of range of the sequence at depth %d'
+            raise ValueError(message % (k, depth))
         destination.insert(k, target)
     elif not is_current_sequential and k not in destination:
         destination[k] = target
+    elif _is_container(destination[k], containers) != bool(remaining_ks):
+        # Either a value has already been assigned to a key which the
+        # remaining keys consider a container or the other way around.
+        # Since both cannot be retained the payload is rejected.
+        message = 'Key %r at depth %d is assigned both a value and nested keys'
+        raise ValueError(message % (k, depth))
+    else:
+        target = None
+
+    if target is not None and remaining_ks and containers is not None:
+        containers.add(id(target))
 
     destination[k] = _convert_into_hierarchical_dict(destination[k],
                                                      remaining_ks,
                                                      value,
                                                      convention=convention,
-                                                     depth=(depth + 1))
+                                                     depth=(depth + 1),
+                                                     containers=containers,
+                                                     fallbacks=fallbacks)
 
     return destination
@@ -9,10 +9,27 @@
 # This is primarily intended to be utilized during development of
 # the NVP package.
 #
+# Executed without arguments the script regenerates the data source of the
+# test suite. In case ``--pairs`` is given a reproducible corpus of random
+# payloads is generated instead. Intended for stress tests and benchmarks::
+#
+#     python generate_data_source.py --seed 1 --records 10 --pairs 100000 \
+#         --depth 3 --max-list-length 50 --gap-rate 0.1 \
+#         --conventions underscore,bracket --value-size 32 \
+#         --output /tmp/corpus.jsonl
+#
+# The corpus is written as JSON lines where each line contains the name,
+# convention, number of pairs, encoded NVP string and the expected decoded
+# value of a single payload.
+#
 
 import sys
 import json
+import random
 import os.path
+import argparse
+
+from urllib import urlencode
 
 
 def get_relative_as_abspath(path):
@@ -61,12 +78,271 @@ DATA = {
     'encoded': ENCODED,
 }
 
+# Characters which generated keys consist of. Digits, underscores and
+# separators are excluded since they would alter the hierarchy of the keys.
+KEY_CHARACTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+# Characters which generated values consist of. Includes a few characters
+# which require quoting in order to exercise the quoting of the encoder.
+VALUE_CHARACTERS = (
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
+    '.-_ &=+/%'
+)
+
+# Formats of sequence indexes appended to the keys of each convention
+INDEX_FORMATS = {
+    cbracket: '[%d]',
+    cparentheses: '(%d)',
+    cundersore: '%d',
+}
+
+
+class CorpusGenerator(object):
+    """Generator of random, yet reproducible, NVP payloads.
+
+    Each payload is generated as a tree in which sequences retain the
+    index of each item. Allowing the tree to be encoded with gaps in the
+    indexes while the expected decoded value is derived from the same tree.
+
+    :param seed: The seed of the random number generator
+    :param depth: Maximum depth of nested dictionaries and sequences
+    :param max_list_length: Maximum number of items in each sequence
+    :param gap_rate: Probability of a sequence having a gap in its indexes
+    :param value_size: Maximum length of each value
+    """
+    def __init__(self,
+                 seed=0,
+                 depth=3,
+                 max_list_length=10,
+                 gap_rate=0.0,
+                 value_size=16):
+        self.random = random.Random(seed)
+        self.depth = depth
+        self.max_list_length = max_list_length
+        self.gap_rate = gap_rate
+        self.value_size = value_size
+        self.convention = nvp.util.DEFAULT_CONVENTION
+
+    def generate(self, pairs, convention):
+        """Generate a tree consisting of roughly ``pairs`` leaf values.
+        The tree is a dictionary mapping keys to either values, trees or
+        sequences. Where sequences are lists of (index, item) tuples.
+
+        :param pairs: The number of leaf values to generate
+        :param convention: The convention the tree will be encoded with
+        """
+        self.convention = convention
+        tree = {}
+        remaining = pairs
+        while remaining > 0:
+            value, count = self.generate_node(self.depth, remaining)
+            tree[self.generate_key(tree)] = value
+            remaining -= count
+        return tree
+
+    def generate_node(self, depth, budget):
+        """Generate a node of at most ``budget`` leaf values. Retrieves a
+        tuple of the node along with the number of leaf values in it.
+        """
+        kind = self.random.random()
+        if depth <= 0 or budget < 2 or kind < 0.5:
+            return (self.generate_value(), 1)
+
+        if kind < 0.65:
+            length = self.random.randint(1, min(budget, self.max_list_length))
+            values = [self.generate_value() for _ in xrange(length)]
+            return (self.generate_sequence(values), length)
+
+        if kind < 0.85:
+            length = self.random.randint(1, self.max_list_length)
+            items = []
+            count = 0
+            while len(items) < length and count < budget:
+                item, item_count = self.generate_dict(depth - 1,
+                                                      budget - count)
+                items.append(item)
+                count += item_count
+            return (self.generate_sequence(items), count)
+
+        return self.generate_dict(depth - 1, budget)
+
+    def generate_dict(self, depth, budget):
+        width = self.random.randint(1, max(1, min(budget, 8)))
+        tree = {}
+        count = 0
+        while len(tree) < width and count < budget:
+            value, value_count = self.generate_node(depth, budget - count)
+            tree[self.generate_key(tree)] = value
+            count += value_count
+        return (tree, count)
+
+    def generate_sequence(self, items):
+        indexes = range(len(items))
+        if not self.can_have_gap(items):
+            return zip(indexes, items)
+
+        if len(items) > 1 and self.random.random() < self.gap_rate:
+            gap_at = self.random.randint(0, len(items) - 1)
+            gap = self.random.randint(1, 3)
+            indexes = [i if i < gap_at else i + gap for i in indexes]
+        return zip(indexes, items)
+
+    def can_have_gap(self, items):
+        """Check whether a sequence of ``items`` can be generated with a
+        gap in its indexes.
+
+        Items located after a gap are decoded as siblings of the sequence
+        whose keys depend on the convention detected from the last character
+        of each encoded key. Therefore, dictionaries containing sequences of
+        values, i.e keys ending with an index, would be split into two
+        siblings unless the underscore convention is utilized.
+        """
+        if self.convention == cundersore:
+            return True
+        return not any(_has_value_sequence(item) for item in items)
+
+    def generate_key(self, siblings):
+        while True:
+            length = self.random.randint(1, 12)
+            key = ''.join(self.random.choice(KEY_CHARACTERS)
+                          for _ in xrange(length))
+            if key not in siblings:
+                return key
+
+    def generate_value(self):
+        length = self.random.randint(1, self.value_size)
+        return ''.join(self.random.choice(VALUE_CHARACTERS)
+                       for _ in xrange(length))
+
+
+def _has_value_sequence(value):
+    if isinstance(value, dict):
+        return any(_has_value_sequence(v) for v in value.itervalues())
+    if isinstance(value, list):
+        return any(not isinstance(item, dict) or _has_value_sequence(item)
+                   for _, item in value)
+    return False
+
+
+def get_encoded_pairs(tree, convention, prefix=None, destination=None):
+    """Retrieve the flat NVP pairs of the generated ``tree``."""
+    destination = destination if destination is not None else []
+    separator = '_' if convention == cundersore else '.'
+    for key, value in tree.iteritems():
+        path = key if prefix is None else prefix + separator + key
+        _append_encoded_pairs(path, value, convention, destination)
+    return destination
+
+
+def _append_encoded_pairs(path, value, convention, destination):
+    if isinstance(value, dict):
+        get_encoded_pairs(value, convention, path, destination)
+    elif isinstance(value, list):
+        for index, item in value:
+            # The underscore convention appends the index of leaf values
+            # directly to the key while other indexes are separated.
+            if convention == cundersore and isinstance(item, dict):
+                item_path = '%s_%d' % (path, index)
+            else:
+                item_path = path + INDEX_FORMATS[convention] % index
+            _append_encoded_pairs(item_path, item, convention, destination)
+    else:
+        destination.append((path, value))
+
+
+def get_decoded_value(tree, convention):
+    """Retrieve the value ``nvp.loads`` is expected to decode the encoded
+    pairs of the generated ``tree`` into.
+
+    Sequence items located after a gap in the indexes are decoded as
+    siblings of the sequence. Their keys contain the index of the item.
+    """
+    decoded = {}
+    for key, value in tree.iteritems():
+        if not isinstance(value, list):
+            decoded[key] = _get_decoded_node(value, convention)
+            continue
+
+        items = []
+        for index, item in value:
+            if index == len(items):
+                items.append(_get_decoded_node(item, convention))
+            elif isinstance(item, dict):
+                decoded['%s_%d' % (key, index)] = get_decoded_value(
+                    item, convention)
+            else:
+                decoded[key + INDEX_FORMATS[convention] % index] = item
+        if items:
+            decoded[key] = items
+    return decoded
+
+
+def _get_decoded_node(value, convention):
+    if isinstance(value, dict):
+        return get_decoded_value(value, convention)
+    return value
+
+
+def generate_corpus(fp,
+                    seed=0,
+                    records=1,
+                    pairs=100,
+                    depth=3,
+                    max_list_length=10,
+                    gap_rate=0.0,
+                    conventions=nvp.CONVENTIONS,
+                    value_size=16):
+    """Write a corpus of generated NVP payloads as JSON lines to ``fp``."""
+    generator = CorpusGenerator(seed=seed, depth=depth,
+                                max_list_length=max_list_length,
+                                gap_rate=gap_rate, value_size=value_size)
+    for i in xrange(records):
+        convention = generator.random.choice(conventions)
+        tree = generator.generate(pairs, convention)
+        encoded_pairs = get_encoded_pairs(tree, convention)
+        record = {
+            'name': 'generated_%05d' % i,
+            'convention': convention,
+            'pairs': len(encoded_pairs),
+            'encoded': urlencode(encoded_pairs),
+            'decoded': get_decoded_value(tree, convention),
+        }
+        fp.write(json.dumps(record, sort_keys=True))
+        fp.write('\n')
+
 
 def main():
-    encoded_data = json.dumps(DATA, sort_keys=True, indent=4)
-    path = os.path.abspath(os.path.join(__file__, DATA_FILENAME))
-    with open(path, 'w') as f:
-        f.write(encoded_data)
+    parser = argparse.ArgumentParser(description='Generate NVP data sources.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--records', type=int, default=1)
+    parser.add_argument('--pairs', type=int, default=None,
+                        help='Generate a corpus of payloads of this size')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--max-list-length', type=int, default=10)
+    parser.add_argument('--gap-rate', type=float, default=0.0)
+    parser.add_argument('--conventions', default=','.join(nvp.CONVENTIONS))
+    parser.add_argument('--value-size', type=int, default=16)
+    parser.add_argument('--output', default='-')
+    args = parser.parse_args()
+
+    if args.pairs is None:
+        encoded_data = json.dumps(DATA, sort_keys=True, indent=4)
+        path = os.path.abspath(os.path.join(__file__, DATA_FILENAME))
+        with open(path, 'w') as f:
+            f.write(encoded_data)
+        return
+
+    fp = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        generate_corpus(fp, seed=args.seed, records=args.records,
+                        pairs=args.pairs, depth=args.depth,
+                        max_list_length=args.max_list_length,
+                        gap_rate=args.gap_rate,
+                        conventions=args.conventions.split(','),
+                        value_size=args.value_size)
+    finally:
+        if fp is not sys.stdout:
+            fp.close()
 
 if __name__ == '__main__':
     main()
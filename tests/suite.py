@@ -14,11 +14,16 @@ Although the data source is the main aspect of this test suite other
 more specific test methods can reside here too.
 """
 
+import imp
 import sys
 import json
+import socket
+import inspect
 import os.path
 import unittest
+import threading
 
+from array import array
 from urllib import urlencode
 
 try:
@@ -48,6 +53,10 @@ def get_relative_as_abspath(path):
 # imported rather than one located in site-packages for instance.
 sys.path.insert(0, get_relative_as_abspath('../'))
 import nvp
+import nvp.debug
+import nvp.client
+import nvp.testing
+import nvp.diagnostics
 
 
 class TestUtils(unittest.TestCase):
@@ -128,6 +137,48 @@ class TestUtils(unittest.TestCase):
             ('astring', 'Hello'),
         ]))
 
+    def test_get_hierarchical_pairs_beyond_cached_indexes(self):
+        # Keys of indexes beyond the cached suffixes are formatted as well
+        size = nvp.util.INDEX_SUFFIX_CACHE_SIZE + 2
+        items = [{'AMT': str(i), 'OPT': [str(i)]} for i in xrange(size)]
+        expected = {
+            nvp.util.CONVENTION_UNDERSCORE: ('L_%d_AMT', 'L_%d_OPT0'),
+            nvp.util.CONVENTION_BRACKET: ('L[%d].AMT', 'L[%d].OPT[0]'),
+            nvp.util.CONVENTION_PARENTHESES: ('L(%d).AMT', 'L(%d).OPT(0)'),
+        }
+        for conv, keys in expected.iteritems():
+            pairs = nvp.util.get_hierarchical_pairs({'L': items},
+                                                    convention=conv)
+            self.assertEqual(len(pairs), size * 2)
+            pairs = dict(pairs)
+            for i in (0, size - 2, size - 1):
+                for key in keys:
+                    self.assertEqual(pairs[key % i], str(i))
+
+    def test_encode_pairs(self):
+        pairs = [
+            ('L_AMT0', '10.00'),
+            ('L_NAME0', 'Hello world'),
+            ('L_DESC0', 'a&b=c/d~e%f+g'),
+            ('foo[0].bar', u'unicode'),
+            ('foo(1)', 1337),
+            ('NEGATIVE', -1.5),
+            ('EMPTY', ''),
+            ('L_AMT0', '10.00'),
+        ]
+        self.assertEqual(nvp.util.encode_pairs(pairs), urlencode(pairs))
+        self.assertEqual(nvp.util.encode_pairs([]), '')
+
+        # Quoted keys are retrieved from the cache on subsequent calls
+        self.assertEqual(nvp.util._quoted_keys['foo[0].bar'], 'foo%5B0%5D.bar')
+
+    def test_iter_encoded_chunks(self):
+        pairs = [('L_AMT%d' % i, '%d.00' % i) for i in range(7)]
+        chunks = list(nvp.util.iter_encoded_chunks(iter(pairs), chunk_pairs=3))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(''.join(chunks), nvp.util.encode_pairs(pairs))
+        self.assertEqual(list(nvp.util.iter_encoded_chunks([])), [])
+
     def test_get_hierarchical_dict(self):
         source = {
             'a.b[0]': 1,
@@ -175,6 +226,84 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(is_parentheses, nvp.util.CONVENTION_PARENTHESES)
         self.assertEqual(is_underscore_default, nvp.util.CONVENTION_UNDERSCORE)
 
+    def test_tokenize_key(self):
+        tokenize = nvp.util.tokenize_key
+        self.assertEqual(tokenize('L_FOO_0_BAR1'), ('L', 'FOO', 0, 'BAR', 1))
+        self.assertEqual(tokenize('FOO_0_0_0_BAR'), ('FOO', 0, 0, 0, 'BAR'))
+        self.assertEqual(tokenize('a.d[0][1]'), ('a', 'd', 0, 1))
+        self.assertEqual(tokenize('a(0).b(12)'), ('a', 0, 'b', 12))
+        self.assertEqual(tokenize('FOOBAR'), ('FOOBAR',))
+
+        # Separated indexes are not part of the preceding component
+        self.assertEqual(tokenize('X_B2_0'), ('X', 'B2', 0))
+
+        # Malformed keys are retained as strings rather than raising
+        self.assertEqual(tokenize('1337'), ('1337',))
+        self.assertEqual(tokenize('_foo'), ('', 'foo'))
+        self.assertEqual(tokenize('foo[bar]'), ('foo[bar]',))
+
+        # Explicit conventions only apply their own grammar
+        conv = nvp.util.CONVENTION_BRACKET
+        self.assertEqual(tokenize('foo_bar[0].b2', conv), ('foo_bar', 0, 'b2'))
+        conv = nvp.util.CONVENTION_PARENTHESES
+        self.assertEqual(tokenize('foo(0)(1).a', conv), ('foo', 0, 1, 'a'))
+        conv = nvp.util.CONVENTION_UNDERSCORE
+        self.assertEqual(tokenize('L_FOO_0_BAR1', conv),
+                         ('L', 'FOO', 0, 'BAR', 1))
+
+        self.assertRaises(ValueError, tokenize, 'somekey', 'invalid')
+
+    def test_tokenize_underscore_key(self):
+        expected = {
+            # Trailing indexes as opposed to separated index components
+            'L_AMT0': ('L', 'AMT', 0),
+            'L_AMT_0': ('L', 'AMT', 0),
+            'L_0_NAME': ('L', 0, 'NAME'),
+            'L_0_NAME1': ('L', 0, 'NAME', 1),
+            'L_10_AMT2': ('L', 10, 'AMT', 2),
+            'A_0_0_1': ('A', 0, 0, 1),
+            'SHIPTOSTREET': ('SHIPTOSTREET',),
+            'SHIPTOSTREET2': ('SHIPTOSTREET', 2),
+            # Leading, trailing and double underscores
+            '_A': ('', 'A'),
+            '_0': ('', 0),
+            'A_': ('A', ''),
+            'A_0_': ('A', 0, ''),
+            'A__B': ('A', '', 'B'),
+            'A__0': ('A', '', 0),
+            '__A': ('', '', 'A'),
+            # Digits inside of names
+            'B2C3': ('B2C', 3),
+            'L_B2C3': ('L', 'B2C', 3),
+            'L_B2_0': ('L', 'B2', 0),
+            'X_1A': ('X', '1A'),
+            '0_A': ('0', 'A'),
+        }
+        convert = nvp.util.convert_underscore_into_bracket_key
+        conv = nvp.util.CONVENTION_UNDERSCORE
+        for key, path in expected.iteritems():
+            self.assertEqual(nvp.util.tokenize_key(key), path)
+            self.assertEqual(nvp.util.tokenize_key(key, conv), path)
+
+            # Underscore keys were previously converted into the bracket
+            # convention and tokenized thereafter, which is to be retained.
+            if '_' in key:
+                self.assertEqual(nvp.util.tokenize_key(convert(key)), path)
+
+    def test_get_key_tokenizer(self):
+        detect = nvp.util.detect_payload_convention
+        self.assertEqual(detect(['A', 'foo[0].bar']), 'bracket')
+        self.assertEqual(detect(['A', 'foo(0).bar']), 'parentheses')
+        self.assertEqual(detect(['A', 'L_AMT0']), 'underscore')
+        self.assertEqual(detect(['foo[0]', 'foo(0)']), None)
+
+        keys = ['foo[0].bar[12]', 'foo.bar2', 'L_AMT0', 'foo(1)', '12[0]']
+        for convention in [None] + nvp.CONVENTIONS:
+            tokenize = nvp.util.get_key_tokenizer(keys, convention)
+            for key in keys:
+                self.assertEqual(tokenize(key),
+                                 nvp.util.tokenize_key(key, convention))
+
     def test_parse_underscore_key_with_index(self):
         parsed = nvp.util.parse_underscore_key_with_index('FOOBAR1337')
         self.assertEqual(parsed, ('FOOBAR', 1337))
@@ -354,6 +483,76 @@ class TestAPI(unittest.TestCase):
                 value = nvp.loads(query_string)
                 self.assertEqual(value, to_match)
 
+    def test_dumps_chunked(self):
+        items = [{'NAME': 'Item %d' % i, 'AMT': '%d.00' % i}
+                 for i in xrange(5)]
+        value = {'METHOD': 'AddItems', 'TOKEN': 'abc', 'L_ITEMS': items}
+
+        bodies = list(nvp.dumps_chunked(value, 'L_ITEMS', max_items=2,
+                                        convention=nvp.CONVENTION_BRACKET))
+        self.assertEqual(len(bodies), 3)
+        loaded = [nvp.loads(body, convention=nvp.CONVENTION_BRACKET)
+                  for body in bodies]
+        for body in loaded:
+            self.assertEqual(body['METHOD'], 'AddItems')
+            self.assertEqual(body['TOKEN'], 'abc')
+        self.assertEqual(loaded[0]['L_ITEMS'], items[:2])
+        self.assertEqual(loaded[2]['L_ITEMS'], items[4:])
+
+        # Only the shared keys are repeated
+        bodies = list(nvp.dumps_chunked(value, 'L_ITEMS', max_items=3,
+                                        shared_keys=['METHOD']))
+        self.assertEqual([nvp.loads(body).get('TOKEN') for body in bodies],
+                         ['abc', None])
+
+        bodies = list(nvp.dumps_chunked(value, 'L_ITEMS', max_bytes=100))
+        self.assertTrue(all(len(body) <= 100 for body in bodies))
+        items_loaded = []
+        for body in bodies:
+            items_loaded.extend(nvp.loads(body)['L']['ITEMS'])
+        self.assertEqual(items_loaded, items)
+
+        # Values are filtered in batches in the same manner as by dumps
+        def upper(values):
+            return [v.upper() for v in values]
+
+        for batch_value_filter in [upper, {'NAME': upper}]:
+            bodies = nvp.dumps_chunked(value, 'L_ITEMS', max_items=2,
+                                       batch_value_filter=batch_value_filter)
+            expected = nvp.dumps({'L_ITEMS': items[:2], 'METHOD': 'AddItems',
+                                  'TOKEN': 'abc'},
+                                 batch_value_filter=batch_value_filter)
+            self.assertEqual(nvp.loads(next(bodies)), nvp.loads(expected))
+
+        self.assertEqual(list(nvp.dumps_chunked({'A': '1'}, 'L', 2)),
+                         ['A=1'])
+        self.assertRaises(ValueError, list,
+                          nvp.dumps_chunked(value, 'L_ITEMS', max_bytes=30))
+        self.assertRaises(ValueError, list,
+                          nvp.dumps_chunked(value, 'METHOD', max_items=1))
+
+    def test_encoded_size(self):
+        value = {
+            'ACK': 'Success',
+            'NOTE': 'Fish & chips',
+            'L': [{'NAME': 'Foo', 'AMT': ['1.00', 2]}, {'NAME': u'Bar'}],
+            'EMPTY': [],
+        }
+        for convention in nvp.CONVENTIONS:
+            size = len(nvp.dumps(value, convention=convention))
+            self.assertEqual(nvp.encoded_size(value, convention=convention),
+                             size)
+            self.assertEqual(nvp.encoded_size(value, convention=convention,
+                                              key_filter=lambda k: k), size)
+
+        self.assertEqual(nvp.encoded_size({}), 0)
+        self.assertEqual(nvp.encoded_size({'A_1': '1'}), len('A1=1'))
+        self.assertEqual(nvp.encoded_size({'A': 1},
+                                          value_filter=lambda v: v * 10), 4)
+        self.assertRaises(ValueError, nvp.encoded_size, [])
+        self.assertRaises(ValueError, nvp.encoded_size, {'A': 1},
+                          convention='foo')
+
     def test_dump(self):
         value = {
             'foo': [
@@ -376,6 +575,73 @@ class TestAPI(unittest.TestCase):
 
         self.assertEqual(written_encoded_value, encoded_value)
 
+    def test_dump_destinations(self):
+        value = {'L_ITEMS': [{'NAME': 'Item %d' % i} for i in xrange(5000)]}
+        expected = nvp.dumps(value, as_bytes=True)
+        self.assertTrue(isinstance(expected, bytes))
+
+        class Writer(object):
+            def __init__(self):
+                self.chunks = []
+
+            def writelines(self, chunks):
+                self.chunks.extend(chunks)
+
+        writer = Writer()
+        nvp.dump(value, writer)
+        self.assertTrue(len(writer.chunks) > 1)
+        self.assertEqual(''.join(writer.chunks), expected)
+
+        def read_concurrently(read):
+            # The payload is read while being written since writes of
+            # payloads larger than the buffer of a pipe or socket block
+            # until the buffered data has been read.
+            received = []
+
+            def run():
+                while True:
+                    data = read(65536)
+                    if not data:
+                        break
+                    received.append(data)
+
+            thread = threading.Thread(target=run)
+            thread.daemon = True
+            thread.start()
+            return (thread, received)
+
+        read_fd, write_fd = os.pipe()
+        thread, received = read_concurrently(
+            lambda size: os.read(read_fd, size))
+        nvp.dump(value, write_fd)
+        os.close(write_fd)
+        thread.join()
+        os.close(read_fd)
+        self.assertEqual(''.join(received), expected)
+
+        a, b = socket.socketpair()
+        thread, received = read_concurrently(b.recv)
+        nvp.dump(value, a)
+        a.close()
+        thread.join()
+        b.close()
+        self.assertEqual(''.join(received), expected)
+
+    def test_dump_generators(self):
+        def get_items(count):
+            for i in xrange(count):
+                yield {'NAME': 'Item %d' % i, 'AMT': iter(['1.00', '2.00'])}
+
+        expected = nvp.dumps({'L_ITEMS': [
+            {'NAME': 'Item %d' % i, 'AMT': ['1.00', '2.00']}
+            for i in xrange(1000)
+        ]})
+        self.assertEqual(nvp.dumps({'L_ITEMS': get_items(1000)}), expected)
+
+        fp = StringIO()
+        nvp.dump({'L_ITEMS': get_items(1000)}, fp)
+        self.assertEqual(fp.getvalue(), expected)
+
     def test_load(self):
         value = {
             'foo': 'hello',
@@ -394,6 +660,264 @@ class TestAPI(unittest.TestCase):
 
         self.assertEqual(loaded_value, value)
 
+    def test_iterparse(self):
+        to_parse = 'L_AMT0=10.00&L_AMT1=5%2B1&foo[0].bar=a+b;ACK=Success'
+        expected = [
+            (('L', 'AMT', 0), '10.00'),
+            (('L', 'AMT', 1), '5+1'),
+            (('foo', 0, 'bar'), 'a b'),
+            (('ACK',), 'Success'),
+        ]
+        self.assertEqual(list(nvp.iterparse(to_parse)), expected)
+
+        # File-like objects are read in chunks split within the pairs
+        fp = StringIO(to_parse)
+        events = nvp.util.iter_raw_pairs(fp, chunk_size=4)
+        self.assertEqual([k for k, v in events],
+                         ['L_AMT0', 'L_AMT1', 'foo[0].bar', 'ACK'])
+        self.assertEqual(list(nvp.iterparse(StringIO(to_parse))), expected)
+
+        limits = nvp.Limits(max_depth=2)
+        events = nvp.iterparse(StringIO(to_parse), limits=limits)
+        self.assertRaises(nvp.LimitExceededError, list, events)
+
+    def test_peek(self):
+        to_peek = 'ACK=Failure&L_ERRORCODE0=10001&L%5FAMT0=1+2&ACK=Success'
+        self.assertEqual(nvp.peek(to_peek, ['ACK', 'L_ERRORCODE0']),
+                         {'ACK': 'Failure', 'L_ERRORCODE0': '10001'})
+        self.assertEqual(nvp.peek(to_peek, ['L_AMT0', 'MISSING']),
+                         {'L_AMT0': '1 2'})
+        self.assertEqual(nvp.peek('A=&B=1', ['A']), {})
+        self.assertEqual(nvp.peek('A=&B=1', ['A'], keep_blank_values=True),
+                         {'A': ''})
+
+        # The input is no longer read once all the keys are found
+        size = nvp.util.DECODE_CHUNK_SIZE * 4
+        fp = StringIO('ACK=Failure&' + 'A=' + 'a' * size)
+        self.assertEqual(nvp.peek(fp, ['ACK']), {'ACK': 'Failure'})
+        self.assertTrue(fp.tell() < size)
+
+    def test_to_json(self):
+        value = {
+            'L': [{'NAME': 'Item %d' % i, 'AMT': ['1.00', '2.00']}
+                  for i in range(12)],
+            'ACK': 'Success',
+            'EMPTY': [],
+        }
+        for convention in nvp.CONVENTIONS:
+            dumped = nvp.dumps(value, convention=convention)
+            expected = json.dumps(nvp.loads(dumped), sort_keys=True)
+
+            fp = StringIO()
+            nvp.to_json(dumped, fp)
+            self.assertEqual(fp.getvalue(), expected)
+
+            fp = StringIO()
+            nvp.to_json(StringIO(dumped), fp)
+            self.assertEqual(fp.getvalue(), expected)
+
+        # Gaps and duplicates are decoded in the same manner as loads
+        for to_decode in ['L_AMT0=1&L_AMT2=3', 'A=1&A=2&B_0=3', '']:
+            fp = StringIO()
+            nvp.to_json(to_decode, fp)
+            self.assertEqual(json.loads(fp.getvalue()), nvp.loads(to_decode))
+
+    def test_message(self):
+        value = {
+            'METHOD': 'DoExpressCheckoutPayment',
+            'L_ITEMS': [{'NAME': 'Foo', 'AMT': '1.00'},
+                        {'NAME': 'Bar baz', 'AMT': '2.00'}],
+            'EMPTY': [],
+            'AMT': '3.00',
+        }
+        message = nvp.Message(value, convention=nvp.CONVENTION_BRACKET)
+        self.assertEqual(dict(message), value)
+        dumped = nvp.dumps(value, convention=nvp.CONVENTION_BRACKET)
+        self.assertEqual(self.sort_encoded_value(message.dumps()),
+                         self.sort_encoded_value(dumped))
+
+        # Only the modified subtree is encoded again
+        items_fragment = message._fragments['L_ITEMS']
+        message['AMT'] = '4.00'
+        self.assertFalse('AMT' in message._fragments)
+        self.assertTrue('AMT=4.00' in message.dumps().split('&'))
+        self.assertTrue(message._fragments['L_ITEMS'] is items_fragment)
+
+        # In-place modifications require the subtree to be touched
+        message['L_ITEMS'][1]['AMT'] = '5.00'
+        self.assertFalse('L_ITEMS%5B1%5D.AMT=5.00' in message.dumps())
+        message.touch('L_ITEMS')
+        self.assertTrue('L_ITEMS%5B1%5D.AMT=5.00' in message.dumps())
+
+        del message['L_ITEMS']
+        self.assertEqual(nvp.loads(message.dumps()),
+                         {'METHOD': 'DoExpressCheckoutPayment', 'AMT': '4.00'})
+        self.assertRaises(KeyError, message.touch, 'L_ITEMS')
+
+        fp = StringIO()
+        message.dump(fp)
+        self.assertEqual(fp.getvalue(), message.dumps())
+
+    def test_loads_into_model(self):
+        class Item(nvp.Model):
+            __slots__ = ('NAME', 'AMT')
+
+        class Address(nvp.Model):
+            __slots__ = ('CITY', )
+
+        class Order(nvp.Model):
+            __slots__ = ('ACK', 'L', 'SHIPTO', 'TAGS')
+            nvp_fields = {'L': [Item], 'SHIPTO': Address}
+
+        to_loads = ('ACK=Success&L_0_NAME=Foo&L_0_AMT=1.00&L_1_NAME=Bar&'
+                    'SHIPTO_CITY=Paris&TAGS0=a&TAGS1=b&UNKNOWN=1')
+        order = nvp.loads(to_loads, into=Order)
+        self.assertTrue(isinstance(order, Order))
+        self.assertEqual(order.ACK, 'Success')
+        self.assertEqual([item.NAME for item in order.L], ['Foo', 'Bar'])
+        self.assertEqual(order.L[0].AMT, '1.00')
+        self.assertEqual(order.L[1].AMT, None)
+        self.assertEqual(order.SHIPTO.CITY, 'Paris')
+        self.assertEqual(order.TAGS, ['a', 'b'])
+        self.assertRaises(AttributeError, getattr, order, 'UNKNOWN')
+
+        # Models are encoded by reading their attributes
+        for convention in nvp.CONVENTIONS:
+            dumped = nvp.dumps(order, convention=convention)
+            self.assertEqual(nvp.loads(dumped, into=Order), order)
+            self.assertEqual(nvp.loads(dumped),
+                             nvp.loads(to_loads.replace('&UNKNOWN=1', '')))
+
+        self.assertEqual(nvp.loads('', into=Order), Order())
+
+        # Cache hits retrieve copies of the same models
+        cache = nvp.DecodeCache()
+        for _ in xrange(2):
+            loaded = nvp.loads(to_loads, into=Order, cache=cache)
+            self.assertTrue(isinstance(loaded, Order))
+            self.assertTrue(isinstance(loaded.L[0], Item))
+            self.assertTrue(isinstance(loaded.SHIPTO, Address))
+            self.assertEqual(loaded, order)
+        loaded.L.pop()
+        loaded.SHIPTO.CITY = 'Rome'
+        self.assertEqual(nvp.loads(to_loads, into=Order, cache=cache), order)
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertRaises(ValueError, nvp.loads, 'L_1_NAME=Foo', into=Order)
+        self.assertRaises(ValueError, nvp.loads, 'SHIPTO=Paris', into=Order)
+
+    def test_diagnostics_measure(self):
+        value = {'L': {'AMT': ['1.00', '2.00']}, 'ACK': 'Success'}
+        encoded = nvp.dumps(value)
+
+        report = nvp.diagnostics.measure(nvp.loads, encoded)
+        self.assertEqual([phase['name'] for phase in report['phases']],
+                         ['parse', 'filter', 'hierarchy'])
+        self.assertEqual(report['function'], 'loads')
+        self.assertTrue(report['result_size'] > 0)
+        for phase in report['phases']:
+            self.assertTrue(phase['time'] >= 0)
+            self.assertTrue(phase['retained_bytes'] > 0)
+            if report['tracemalloc']:
+                self.assertTrue(phase['peak_bytes'] >= 0)
+                self.assertTrue(phase['blocks'] > 0)
+            elif report['rusage']:
+                self.assertTrue(phase['peak_bytes'] >= 0)
+                self.assertEqual(phase['allocated_bytes'], None)
+                self.assertEqual(phase['blocks'], None)
+
+        # Options of loads are applied by the phases
+        report = nvp.diagnostics.measure(nvp.loads, encoded,
+                                         get_hierarchical=False,
+                                         convention=nvp.CONVENTION_UNDERSCORE,
+                                         strict_parsing=True)
+        result_size = nvp.diagnostics.get_retained_size(
+            nvp.loads(encoded, get_hierarchical=False))
+        self.assertEqual(report['result_size'], result_size)
+        self.assertRaises(TypeError, nvp.diagnostics.measure, nvp.loads,
+                          encoded, cache=nvp.DecodeCache())
+
+        # All options but the cache are applied by the phases of loads and
+        # all options of dumps by its phases.
+        options = nvp.diagnostics._OPTIONS
+        args = inspect.getargspec(nvp.loads).args[1:]
+        self.assertEqual(options[nvp.loads], set(args) - set(['cache']))
+        args = inspect.getargspec(nvp.dumps).args[1:]
+        self.assertEqual(options[nvp.dumps], set(args))
+
+        report = nvp.diagnostics.measure(nvp.dumps, value,
+                                         convention=nvp.CONVENTION_BRACKET)
+        self.assertEqual([phase['name'] for phase in report['phases']],
+                         ['pairs', 'encode'])
+        self.assertTrue('dumps: ' in nvp.diagnostics.format_report(report))
+
+        # Arbitrary functions are measured as a single phase
+        report = nvp.diagnostics.measure(nvp.util.tokenize_key, 'L_AMT0')
+        self.assertEqual(len(report['phases']), 1)
+
+    def test_diagnostics_measure_traced(self):
+        # The trace of a caller tracing allocations already is left running
+        class Tracemalloc(object):
+            traced = 0
+
+            def is_tracing(self):
+                return True
+
+            def get_traced_memory(self):
+                self.traced += 100
+                return (self.traced, self.traced)
+
+            def start(self):
+                raise AssertionError('Trace of the caller restarted')
+
+            stop = take_snapshot = start
+
+        tracemalloc = nvp.diagnostics.tracemalloc
+        nvp.diagnostics.tracemalloc = Tracemalloc()
+        try:
+            report = nvp.diagnostics.measure(nvp.loads, 'L_AMT0=1')
+        finally:
+            nvp.diagnostics.tracemalloc = tracemalloc
+
+        for phase in report['phases']:
+            self.assertEqual(phase['allocated_bytes'], 100)
+            self.assertEqual(phase['peak_bytes'], None)
+            self.assertEqual(phase['blocks'], None)
+
+    def test_debug_explain(self):
+        to_loads = 'foo[0].bar=1&foo[2].bar=2&L_AMT_0=3&x(0).y=4&ACK=Success'
+        report = nvp.debug.explain(to_loads)
+        self.assertEqual(report['result'], nvp.loads(to_loads))
+        self.assertEqual(report['convention'], None)
+        self.assertEqual(report['pairs'], 5)
+        self.assertEqual(report['max_depth'], 3)
+        self.assertEqual(report['fallback_keys'], ['foo[2].bar'])
+        self.assertEqual(report['multi_pass_keys'],
+                         ['foo[0].bar', 'foo[2].bar', 'x(0).y'])
+        self.assertEqual(sorted(report['subtrees']),
+                         ['ACK', 'L', 'foo', 'x'])
+        self.assertEqual(report['subtrees']['foo']['keys'], 2)
+        self.assertTrue('foo[2] at depth 0' in
+                        nvp.debug.format_explanation(report))
+
+        report = nvp.debug.explain('foo[0].bar=1&foo[1].bar=2')
+        self.assertEqual(report['convention'], nvp.CONVENTION_BRACKET)
+        self.assertEqual(report['fallback_keys'], [])
+        self.assertEqual(report['multi_pass_keys'], [])
+
+        # Options are applied in the same manner as by loads
+        limits = nvp.Limits(max_depth=2)
+        self.assertRaises(nvp.LimitExceededError, nvp.debug.explain,
+                          to_loads, limits=limits)
+        self.assertRaises(nvp.ParseError, nvp.debug.explain, 'A=1&A=2',
+                          strict_parsing=True)
+        registry = nvp.KeyRegistry()
+        report = nvp.debug.explain(to_loads, registry=registry)
+        self.assertEqual(report['result'], nvp.loads(to_loads))
+        self.assertEqual(report['fallback_keys'], ['foo[2].bar'])
+        self.assertEqual(report['keys'][0]['passes'], None)
+        self.assertTrue('foo[2] at depth 0' in
+                        nvp.debug.format_explanation(report))
+
     def test_dumps_with_key_filter(self):
         def key_to_upper(key):
             return key.upper()
@@ -432,6 +956,50 @@ class TestAPI(unittest.TestCase):
         loaded = nvp.loads(to_loads, value_filter=value_filter)
         self.assertEqual(expected, loaded)
 
+    def test_dumps_with_batch_value_filter(self):
+        calls = []
+
+        def batch_value_filter(values):
+            calls.append(len(values))
+            return ['%.2f' % v for v in values]
+
+        to_dump = {'AMT': 1, 'L': [{'AMT': 2}, {'AMT': 3.5}]}
+        expected = 'AMT=1.00&L_0_AMT=2.00&L_1_AMT=3.50'.split('&')
+        dumped = nvp.dumps(to_dump, batch_value_filter=batch_value_filter)
+        self.assertEqual(expected, sorted(dumped.split('&')))
+        self.assertEqual(calls, [3])
+
+        fp = StringIO()
+        nvp.dump(to_dump, fp, batch_value_filter=batch_value_filter)
+        self.assertEqual(expected, sorted(fp.getvalue().split('&')))
+
+        dumped = nvp.dumps({'AMT': 1, 'NAME': 'a'},
+                           batch_value_filter={'AMT': batch_value_filter})
+        self.assertEqual(['AMT=1.00', 'NAME=a'], sorted(dumped.split('&')))
+
+    def test_loads_with_batch_value_filter(self):
+        calls = []
+
+        def batch_value_filter(values):
+            calls.append(len(values))
+            return [int(v) / 10 for v in values]
+
+        to_loads = 'a=10&b=20&c=30&c=40&L_AMT0=50'
+        expected = dict(a=1, b=2, c=[3, 4], L={'AMT': [5]})
+        loaded = nvp.loads(to_loads, batch_value_filter=batch_value_filter)
+        self.assertEqual(expected, loaded)
+        self.assertEqual(calls, [5])
+
+        # Values are grouped by the field of their keys
+        loaded = nvp.loads(to_loads,
+                           batch_value_filter={'AMT': batch_value_filter})
+        expected = dict(a='10', b='20', c=['30', '40'], L={'AMT': [5]})
+        self.assertEqual(expected, loaded)
+        self.assertEqual(calls, [5, 1])
+
+        self.assertRaises(ValueError, nvp.loads, to_loads,
+                          batch_value_filter=lambda values: values[1:])
+
     def test_dumps_list_impostors(self):
         to_dumps = {
             'a': 'Hello',
@@ -501,6 +1069,405 @@ class TestAPI(unittest.TestCase):
             },
         })
 
+    def test_loads_long_sequences(self):
+        value = {'L': {'AMT': [str(i) for i in range(25)]}}
+        for convention in nvp.CONVENTIONS:
+            dumped = nvp.dumps(value, convention=convention)
+            self.assertEqual(nvp.loads(dumped), value)
+
+    def test_loads_conflicting_keys(self):
+        # Keys utilized both as a dictionary and a sequence
+        loaded = nvp.loads('B_0_0=a&B.C=b')
+        self.assertEqual(loaded, {'B': {0: ['a'], 'C': 'b'}})
+
+        loaded = nvp.loads('A(1)(2)=a&A_0_B=b')
+        self.assertEqual(loaded, {'A': [{'B': 'b'}, {2: 'a'}]})
+
+        # Out of range indexes of values are retained as part of the key
+        loaded = nvp.loads('SHIPTOSTREET=a&SHIPTOSTREET2=b')
+        self.assertEqual(loaded, {'SHIPTOSTREET': 'a', 'SHIPTOSTREET2': 'b'})
+        loaded = nvp.loads('A=1&A=2&A1=b')
+        self.assertEqual(loaded, {'A': ['1', '2'], 'A1': 'b'})
+
+        # Keys assigned both a value and nested keys are rejected rather
+        # than either of them being lost
+        conflicting = [
+            'A=1&A_B=2',
+            'A_B=2&A=1',
+            'A_0=1&A_0_B=2',
+            'A(0).B=a&A_0=b',
+            'A=1&A=2&A_0=b',
+        ]
+        for to_loads in conflicting:
+            self.assertRaises(ValueError, nvp.loads, to_loads)
+
+        # Gaps within nested sequences cannot be represented at all
+        self.assertRaises(ValueError, nvp.loads, 'A[0][0]=a&A[0][2]=b')
+        self.assertRaises(ValueError, nvp.loads, 'A_0_2=a&A_0_0=b')
+
+    def test_generated_corpus(self):
+        path = get_relative_as_abspath('../scripts/generate_data_source.py')
+        generator = imp.load_source('generate_data_source', path)
+
+        fp = StringIO()
+        generator.generate_corpus(fp, seed=1337, records=12, pairs=150,
+                                  depth=3, max_list_length=15, gap_rate=0.5)
+        records = [json.loads(line) for line in fp.getvalue().splitlines()]
+        self.assertEqual(len(records), 12)
+        for record in records:
+            loaded = nvp.loads(str(record['encoded']))
+            self.assertEqual(loaded, record['decoded'])
+
+    def test_loads_strict_parsing(self):
+        to_loads = 'L_AMT0=10.00&L_NAME0=Hello+world&foo[0].bar[1]=%2B'
+        self.assertEqual(nvp.loads(to_loads, strict_parsing=True),
+                         nvp.loads(to_loads))
+
+        malformed = [
+            ('A=1&&B=2', 4, None),
+            ('A=1&B', 4, 'B'),
+            ('A=1&B=%zz', 6, 'B'),
+            ('A=1&foo[0=2', 4, 'foo[0'),
+            ('foo[0].bar(1)=2', 0, 'foo[0].bar(1)'),
+            ('L_AMT0=1&L.AMT[0]=2', 9, 'L.AMT[0]'),
+        ]
+        for to_loads, offset, key in malformed:
+            try:
+                nvp.loads(to_loads, strict_parsing=True)
+            except nvp.ParseError as e:
+                self.assertEqual((e.offset, e.key), (offset, key))
+            else:
+                self.fail('ParseError not raised for: %s' % to_loads)
+
+            # Malformed pairs are otherwise silently accepted
+            nvp.loads(to_loads)
+
+        # Keys assigned both a value and nested keys are rejected up front
+        conflicting = [
+            ('A=1&A_B=2', 4, 'A_B'),
+            ('A_B=2&A=1', 6, 'A'),
+            ('A_0=1&A_0_B=2', 6, 'A_0_B'),
+            ('A_0_B=2&A_0=1', 8, 'A_0'),
+            ('A=1&A0=2', 4, 'A0'),
+            ('L_0=1&L_1=2&L=3', 12, 'L'),
+        ]
+        for to_loads, offset, key in conflicting:
+            try:
+                nvp.loads(to_loads, strict_parsing=True)
+            except nvp.ParseError as e:
+                self.assertEqual((e.offset, e.key), (offset, key))
+            else:
+                self.fail('ParseError not raised for: %s' % to_loads)
+
+        events = nvp.iterparse(StringIO('A=1&A=2'), strict_parsing=True)
+        self.assertRaises(nvp.ParseError, list, events)
+
+        # Offsets of unicode payloads are those of the UTF-8 encoded bytes
+        try:
+            nvp.loads(u'A=\xe9\xe9&B=%zz', strict_parsing=True)
+        except nvp.ParseError as e:
+            self.assertEqual(e.offset, 9)
+        else:
+            self.fail('ParseError not raised for a bad percent escape')
+
+        # Duplicate key paths are detected given the convention hint
+        to_loads = 'A_B=1&A.B=2'
+        self.assertRaises(nvp.ParseError, nvp.loads, to_loads,
+                          strict_parsing=True)
+        loaded = nvp.loads(to_loads, strict_parsing=True,
+                           convention=nvp.CONVENTION_BRACKET)
+        self.assertEqual(loaded, {'A_B': '1', 'A': {'B': '2'}})
+
+        # Trailing indexes out of range are retained as a part of the key
+        to_loads = 'SHIPTOSTREET=1+Main+St&SHIPTOSTREET2=Suite+2'
+        self.assertEqual(nvp.loads(to_loads, strict_parsing=True),
+                         {'SHIPTOSTREET': '1 Main St',
+                          'SHIPTOSTREET2': 'Suite 2'})
+        self.assertEqual(nvp.loads('L_1=a&L=b', strict_parsing=True),
+                         nvp.loads('L_1=a&L=b'))
+
+    def test_loads_with_convention(self):
+        value = {'L': [{'NAME': 'Item', 'AMT': ['1.00', '2.00']}], 'ACK': 'OK'}
+        for convention in nvp.CONVENTIONS:
+            dumped = nvp.dumps(value, convention=convention)
+            self.assertEqual(nvp.loads(dumped, convention=convention), value)
+
+        # Only the grammar of the given convention is applied
+        to_loads = 'foo_bar[0]=a&foo_bar[1]=b'
+        self.assertEqual(nvp.loads(to_loads, convention='bracket'),
+                         {'foo_bar': ['a', 'b']})
+        self.assertEqual(nvp.loads(to_loads), {'foo': {'bar': ['a', 'b']}})
+
+        # Mixed payloads are detected per key
+        to_loads = 'foo[0]=a&bar(0)=b&L_AMT0=c'
+        self.assertEqual(nvp.loads(to_loads),
+                         {'foo': ['a'], 'bar': ['b'], 'L': {'AMT': ['c']}})
+
+        self.assertRaises(ValueError, nvp.loads, 'A=1', convention='foo')
+
+    def test_loads_many_with_interner(self):
+        strings = [
+            'ACK=Success&PAYMENTINFO_0_CURRENCYCODE=USD&TOKEN=EC-%d' % i
+            for i in range(10)
+        ]
+        interner = nvp.ValueInterner(fields=['ACK', 'CURRENCYCODE'],
+                                     max_values=4)
+        loaded = list(nvp.loads_many(strings, interner=interner))
+        self.assertEqual(loaded, [nvp.loads(s) for s in strings])
+
+        first, last = loaded[0], loaded[-1]
+        self.assertTrue(first['ACK'] is last['ACK'])
+        self.assertTrue(first['PAYMENTINFO'][0]['CURRENCYCODE'] is
+                        last['PAYMENTINFO'][0]['CURRENCYCODE'])
+        self.assertFalse(first['TOKEN'] is nvp.loads(strings[0])['TOKEN'])
+        self.assertEqual(len(interner), 2)
+
+        # Fields exceeding the cap are no longer interned
+        interner = nvp.ValueInterner(max_values=4)
+        list(nvp.loads_many(strings, interner=interner))
+        self.assertEqual(len(interner), 6)
+
+    def test_loads_many_with_registry(self):
+        strings = ['L_NAME0=a&L_NAME1=b&ACK=Success', 'L_NAME0=c&ACK=Failure']
+        registry = nvp.KeyRegistry(max_keys=8)
+        loaded = list(nvp.loads_many(strings, registry=registry))
+        self.assertEqual(loaded, [nvp.loads(s) for s in strings])
+        self.assertEqual(len(registry), 3)
+
+        def get_key(obj, key):
+            return [k for k in obj if k == key][0]
+
+        first, last = loaded
+        self.assertTrue(get_key(first, 'ACK') is get_key(last, 'ACK'))
+        self.assertTrue(get_key(first['L'], 'NAME') is
+                        get_key(last['L'], 'NAME'))
+        self.assertEqual(registry.get_path('L_NAME1'), ('L', 'NAME', 1))
+
+        # Keys of single-level dictionaries are registered too
+        flat = nvp.loads(strings[0], get_hierarchical=False, registry=registry)
+        self.assertTrue(get_key(flat, 'ACK') is get_key(first, 'ACK'))
+
+        # Paths of all conventions are bound by max_keys at once
+        registry = nvp.KeyRegistry(max_keys=2)
+        for convention in nvp.CONVENTIONS + [None]:
+            registry.get_path('L_NAME0', convention)
+        self.assertEqual(len(registry), 2)
+
+    def test_loads_with_limits(self):
+        to_loads = 'L_FOO_0_BAR0=a&L_FOO_0_BAR1=b&TOKEN=abc'
+        limits = nvp.Limits(max_pairs=3, max_bytes=len(to_loads),
+                            max_key_length=12, max_depth=5, max_index=1)
+        loaded = nvp.loads(to_loads, limits=limits)
+        self.assertEqual(loaded, {
+            'L': {'FOO': [{'BAR': ['a', 'b']}]},
+            'TOKEN': 'abc',
+        })
+
+        def assert_exceeds(name, string, **kwargs):
+            try:
+                nvp.loads(string, limits=nvp.Limits(**kwargs))
+            except nvp.LimitExceededError as e:
+                self.assertEqual(e.name, name)
+                self.assertTrue(isinstance(e, ValueError))
+            else:
+                self.fail('Expected %s to be exceeded' % name)
+
+        assert_exceeds('max_pairs', 'a=1&b=2;c=3', max_pairs=2)
+        assert_exceeds('max_bytes', 'a=1&b=2', max_bytes=6)
+        assert_exceeds('max_key_length', 'abcdef=1', max_key_length=5)
+        assert_exceeds('max_index', 'L_AMT1000=1', max_index=100)
+        assert_exceeds('max_index', 'a[0][1001]=1', max_index=1000)
+        assert_exceeds('max_depth', 'a[0][0][0]=1', max_depth=3)
+        assert_exceeds('max_depth', '.'.join(['a'] * 5000) + '=1',
+                       max_depth=32)
+
+    def test_loads_with_cache(self):
+        cache = nvp.DecodeCache(max_entries=2)
+        to_loads = 'L_ITEM0=a&L_ITEM1=b&ACK=Success'
+        expected = {'L': {'ITEM': ['a', 'b']}, 'ACK': 'Success'}
+
+        self.assertEqual(nvp.loads(to_loads, cache=cache), expected)
+        loaded = nvp.loads(to_loads, cache=cache)
+        self.assertEqual(loaded, expected)
+
+        # Mutating a retrieved value must not corrupt the cached one
+        loaded['L']['ITEM'].append('c')
+        self.assertEqual(nvp.loads(to_loads, cache=cache), expected)
+
+        # Different options are cached separately
+        flat = nvp.loads(to_loads, get_hierarchical=False, cache=cache)
+        self.assertEqual(flat['ACK'], ['Success'])
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+        # The least recently utilized entry is evicted first
+        nvp.loads(to_loads, cache=cache)
+        nvp.loads('A=1', cache=cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        nvp.loads(to_loads, cache=cache)
+        self.assertEqual(cache.stats()['hits'], 4)
+
+        # Values other than dictionaries and lists retain their type
+        cache = nvp.DecodeCache()
+        to_arrays = lambda values: [array('c', v) for v in values]
+        for _ in xrange(2):
+            loaded = nvp.loads('A=ab&L_B0=c', batch_value_filter=to_arrays,
+                               cache=cache)
+            self.assertEqual(loaded, {'A': array('c', 'ab'),
+                                      'L': {'B': [array('c', 'c')]}})
+        loaded['A'].append('c')
+        loaded = nvp.loads('A=ab&L_B0=c', batch_value_filter=to_arrays,
+                           cache=cache)
+        self.assertEqual(loaded['A'], array('c', 'ab'))
+
+        # Entries are evicted in order to respect the byte bound
+        cache = nvp.DecodeCache(max_bytes=8)
+        nvp.loads('A=1&B=2', cache=cache)
+        nvp.loads('C=3', cache=cache)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.size, 3)
+
+
+class TestClient(unittest.TestCase):
+
+    def get_failing_response(self):
+        """Retrieve a response function of a stub server which responds
+        with a 503 to calls containing ``FAILURES=n`` the first ``n``
+        times they are received.
+        """
+        received = {}
+
+        def respond(request):
+            key = request['ID']
+            received[key] = received.get(key, 0) + 1
+            if received[key] <= int(request.get('FAILURES', 0)):
+                return (503, {'ACK': 'Failure'})
+            return dict(request, ACK='Success')
+        return respond
+
+    def test_stub_server(self):
+        latency = 0.05
+        with nvp.testing.StubServer({'ACK': 'Success'},
+                                    latency=latency) as server:
+            executor = nvp.client.BatchExecutor(server.url)
+            results = executor.run([{'ID': '1'}, {'ID': '2'}])
+        self.assertEqual([r.response for r in results],
+                         [{'ACK': 'Success'}, {'ACK': 'Success'}])
+        self.assertTrue(all(r.latency >= latency for r in results))
+        self.assertEqual(server.stats['requests'], 2)
+        self.assertTrue('2 requests' in
+                        nvp.testing.format_server_stats(server.stats))
+
+        # Server errors other than 503 are only retried in case it is safe
+        with nvp.testing.StubServer(lambda r: (500, {'ACK': 'Failure'}),
+                                    latency=lambda r: 0) as server:
+            executor = nvp.client.BatchExecutor(server.url, retries=2,
+                                                backoff=0)
+            results = executor.run([{'ID': '1'}])
+            self.assertEqual(results[0].error.status, 500)
+            self.assertEqual(results[0].attempts, 1)
+
+            executor = nvp.client.BatchExecutor(server.url, retries=2,
+                                                backoff=0, retry_unsafe=True)
+            results = executor.run([{'ID': '1'}])
+            self.assertEqual(results[0].error.status, 500)
+            self.assertEqual(results[0].attempts, 3)
+
+    def test_run_load(self):
+        with nvp.testing.StubServer() as server:
+            stats = nvp.testing.run_load(server.url, {'ID': '1'},
+                                         rate=200, duration=0.25)
+        self.assertEqual(stats['calls'], 50)
+        self.assertEqual(stats['errors'], 0)
+        # The calls are started at the given rate
+        self.assertTrue(stats['elapsed'] >= 0.2)
+        self.assertTrue(0 < stats['encode_share'] < 1)
+        self.assertTrue(0 < stats['decode_share'] < 1)
+
+    def test_batch_executor(self):
+        with nvp.testing.StubServer(self.get_failing_response()) as server:
+            executor = nvp.client.BatchExecutor(server.url, max_concurrency=4,
+                                                backoff=0.01)
+            calls = [{'ID': str(i)} for i in xrange(50)]
+            calls[3]['FAILURES'] = '1'
+            calls[7]['FAILURES'] = '5'
+            results = executor.run(calls)
+
+        self.assertEqual(len(results), 50)
+        for i, result in enumerate(results):
+            if i == 7:
+                continue
+            self.assertTrue(result.ok)
+            self.assertEqual(result.response['ID'], str(i))
+            self.assertEqual(result.response['ACK'], 'Success')
+
+        # Transient errors are retried until all retries have been made
+        self.assertEqual(results[3].attempts, 2)
+        self.assertFalse(results[7].ok)
+        self.assertEqual(results[7].error.status, 503)
+        self.assertEqual(results[7].attempts, 3)
+
+        # Connections are reused across the calls of each worker
+        self.assertEqual(server.stats['connections'], 4)
+
+        stats = executor.stats
+        self.assertEqual(stats['calls'], 50)
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['attempts'], 50 + 1 + 2)
+        self.assertTrue(stats['throughput'] > 0)
+        self.assertTrue(stats['latency'][50] <= stats['latency'][99])
+        self.assertTrue('50 calls' in nvp.client.format_stats(stats))
+
+    def test_batch_executor_connection_errors(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:%d/' % sock.getsockname()[1]
+        sock.close()
+
+        executor = nvp.client.BatchExecutor(url, retries=1, backoff=0)
+        results = executor.run([{'ID': '1'}])
+        self.assertFalse(results[0].ok)
+        self.assertTrue(isinstance(results[0].error, socket.error))
+        self.assertEqual(results[0].attempts, 2)
+        self.assertRaises(ValueError, nvp.client.BatchExecutor(None).run,
+                          [{'ID': '1'}])
+
+    def test_batch_executor_timeouts(self):
+        # The server might have received calls timing out while waiting for
+        # the response. Thus, those are only retried in case it is safe to.
+        with nvp.testing.StubServer(latency=0.2) as server:
+            executor = nvp.client.BatchExecutor(server.url, retries=2,
+                                                backoff=0, timeout=0.05)
+            results = executor.run([{'ID': '1'}])
+            self.assertTrue(isinstance(results[0].error, socket.timeout))
+            self.assertEqual(results[0].attempts, 1)
+
+            executor = nvp.client.BatchExecutor(server.url, retries=2,
+                                                backoff=0, timeout=0.05,
+                                                retry_unsafe=True)
+            results = executor.run([{'ID': '1'}])
+            self.assertTrue(isinstance(results[0].error, socket.timeout))
+            self.assertEqual(results[0].attempts, 3)
+
+    def test_batch_executor_unexpected_errors(self):
+        # Errors other than the ones of the calls fail the call rather than
+        # the worker. Thus, the remaining calls are executed nevertheless.
+        with nvp.testing.StubServer() as server:
+            executor = nvp.client.BatchExecutor(
+                server.url, max_concurrency=2, loads_options={'bogus': 1})
+            results = executor.run([{'ID': str(i)} for i in xrange(4)])
+        self.assertEqual(server.stats['requests'], 4)
+        for result in results:
+            self.assertFalse(result.ok)
+            self.assertTrue(isinstance(result.error, TypeError))
+        self.assertEqual(executor.stats['errors'], 4)
+
+        self.assertFalse(nvp.client.CallResult({'ID': '1'}).ok)
+
 
 if __name__ == '__main__':
     unittest.main()